@@ -0,0 +1,97 @@
+"""Document metadata
+
+Record size, content type, checksum, ETag and timestamps of documents so
+HEAD requests and listings are answered without S3. Existing rows are
+backfilled from S3 in batches, each committed on its own; rows whose
+object cannot be read keep NULL metadata and are looked up on demand.
+
+Revision ID: 0a6d3c95e4f1
+Revises: e5b2f7a19c63
+Create Date: 2026-10-18 14:36:09.551802
+
+"""
+from typing import Sequence, Union
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6d3c95e4f1'
+down_revision: Union[str, None] = 'e5b2f7a19c63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('size', sa.BigInteger(), nullable=True))
+    op.add_column('documents', sa.Column('content_type', sa.String(), nullable=True))
+    op.add_column('documents', sa.Column('checksum', sa.String(length=64), nullable=True))
+    op.add_column('documents', sa.Column('etag', sa.String(), nullable=True))
+    op.add_column('documents', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('documents', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('blobs', sa.Column('etag', sa.String(), nullable=True))
+
+    # content-addressed documents already know their checksum
+    op.execute('UPDATE documents SET checksum = blob_digest WHERE blob_digest IS NOT NULL')
+
+    with op.get_context().autocommit_block():
+        backfill_from_s3(op.get_bind())
+
+
+def backfill_from_s3(connection):
+    bucket = os.getenv('AWS_S3_BUCKET_NAME')
+    if not bucket:
+        return
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    s3 = boto3.client('s3', region_name=os.getenv('AWS_DEFAULT_REGION'))
+    select_batch = sa.text(
+        'SELECT id, project_id, file_url, blob_digest FROM documents '
+        'WHERE size IS NULL AND id > :after ORDER BY id LIMIT :limit'
+    )
+    update_row = sa.text(
+        'UPDATE documents SET size = :size, content_type = :content_type, '
+        'etag = :etag, updated_at = :updated_at WHERE id = :id'
+    )
+    after = 0
+    while True:
+        rows = connection.execute(
+            select_batch, {'after': after, 'limit': BACKFILL_BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        updates = []
+        for document_id, project_id, file_url, blob_digest in rows:
+            if blob_digest is not None:
+                key = f'blobs/{blob_digest[:2]}/{blob_digest}'
+            else:
+                key = f"{project_id}/{file_url.split('/')[-1]}"
+            try:
+                head = s3.head_object(Bucket=bucket, Key=key)
+            except (BotoCoreError, ClientError):
+                continue
+            updates.append({
+                'id': document_id,
+                'size': head['ContentLength'],
+                'content_type': head.get('ContentType'),
+                'etag': head.get('ETag'),
+                'updated_at': head.get('LastModified'),
+            })
+        if updates:
+            connection.execute(update_row, updates)
+        after = rows[-1][0]
+
+
+def downgrade() -> None:
+    op.drop_column('blobs', 'etag')
+    op.drop_column('documents', 'updated_at')
+    op.drop_column('documents', 'created_at')
+    op.drop_column('documents', 'etag')
+    op.drop_column('documents', 'checksum')
+    op.drop_column('documents', 'content_type')
+    op.drop_column('documents', 'size')
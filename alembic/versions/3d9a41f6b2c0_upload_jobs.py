@@ -0,0 +1,60 @@
+"""Upload jobs
+
+Revision ID: 3d9a41f6b2c0
+Revises: 8f3a6c0d5e17
+Create Date: 2026-10-18 12:21:07.402316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9a41f6b2c0'
+down_revision: Union[str, None] = '8f3a6c0d5e17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('upload_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('idempotency_key', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.project_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'idempotency_key', name='uq_upload_jobs_user_id_idempotency_key')
+    )
+    op.create_index('ix_upload_jobs_status_next_attempt_at', 'upload_jobs', ['status', 'next_attempt_at'], unique=False)
+    op.create_table('upload_job_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('stored_as', sa.String(), nullable=True),
+    sa.Column('spool_path', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('document_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['job_id'], ['upload_jobs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_upload_job_items_job_id', 'upload_job_items', ['job_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_upload_job_items_job_id', table_name='upload_job_items')
+    op.drop_table('upload_job_items')
+    op.drop_index('ix_upload_jobs_status_next_attempt_at', table_name='upload_jobs')
+    op.drop_table('upload_jobs')
@@ -0,0 +1,29 @@
+"""Document listing indexes
+
+Revision ID: 4b7d2e91c3a8
+Revises: 1c8bee4a3e9e
+Create Date: 2026-10-18 10:12:40.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7d2e91c3a8'
+down_revision: Union[str, None] = '1c8bee4a3e9e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keyset pagination of GET /project/{project_id}/documents
+    op.create_index('ix_documents_project_id_id', 'documents', ['project_id', 'id'], unique=False)
+    op.create_index('ix_documents_project_id_filename', 'documents', ['project_id', 'filename'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_project_id_filename', table_name='documents')
+    op.drop_index('ix_documents_project_id_id', table_name='documents')
@@ -0,0 +1,32 @@
+"""Document CRC-32
+
+Record the CRC-32 of documents so project ZIP archives can be laid out
+without reading their content, which lets archive downloads resume with
+byte ranges. Existing rows stay NULL until their content is replaced.
+
+Revision ID: 6c1f8e2d9a47
+Revises: 0a6d3c95e4f1
+Create Date: 2026-10-18 16:02:44.518230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c1f8e2d9a47'
+down_revision: Union[str, None] = '0a6d3c95e4f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('crc32', sa.BigInteger(), nullable=True))
+    op.add_column('upload_job_items', sa.Column('crc32', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('upload_job_items', 'crc32')
+    op.drop_column('documents', 'crc32')
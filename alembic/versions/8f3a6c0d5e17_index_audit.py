@@ -0,0 +1,178 @@
+"""Index audit
+
+Replace indexes on free-text columns and primary keys, which no query
+uses, with indexes matching the access-check, listing and upload query
+shapes, and add the missing unique constraints. On Postgres indexes are
+built and dropped CONCURRENTLY so the tables stay writable; an INVALID
+index left by an interrupted build is dropped and built again.
+
+Rows that would break the unique constraints are moved, not deleted:
+repeated participants and repeated documents pointing at the same S3
+object go to the index_audit_* tables, which downgrade restores. Documents
+sharing a name but not an object are distinct files, so the upgrade stops
+and lists them to be renamed first.
+
+Revision ID: 8f3a6c0d5e17
+Revises: 4b7d2e91c3a8
+Create Date: 2026-10-18 11:02:13.540871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3a6c0d5e17'
+down_revision: Union[str, None] = '4b7d2e91c3a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, columns) never used by a query
+UNUSED_INDEXES = [
+    ('ix_projects_description', 'projects', ['description']),
+    ('ix_projects_logo_url', 'projects', ['logo_url']),
+    ('ix_documents_file_url', 'documents', ['file_url']),
+    ('ix_documents_filename', 'documents', ['filename']),
+    ('ix_documents_project_id_filename', 'documents', ['project_id', 'filename']),
+    # duplicates of the primary key indexes
+    ('ix_projects_project_id', 'projects', ['project_id']),
+    ('ix_project_participants_id', 'project_participants', ['id']),
+    ('ix_documents_id', 'documents', ['id']),
+    ('ix_users_id', 'users', ['id']),
+]
+
+# (index name, table, columns, unique) matching actual query shapes
+QUERY_INDEXES = [
+    ('uq_project_participants_user_id_project_id', 'project_participants', ['user_id', 'project_id'], True),
+    ('ix_projects_owner_id_project_id', 'projects', ['owner_id', 'project_id'], False),
+    ('uq_documents_project_id_filename', 'documents', ['project_id', 'filename'], True),
+]
+
+
+# (side table, table, condition on a and its earlier twin b) of the rows
+# moved aside so the unique indexes can be built
+DUPLICATES = [
+    (
+        'index_audit_project_participants',
+        'project_participants',
+        'b.project_id = a.project_id AND b.user_id = a.user_id',
+    ),
+    (
+        'index_audit_documents',
+        'documents',
+        'b.project_id = a.project_id AND b.filename = a.filename '
+        'AND b.file_url = a.file_url',
+    ),
+]
+
+
+def _is_postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _table_exists(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def _check_document_conflicts():
+    conflicts = op.get_bind().execute(sa.text(
+        'SELECT project_id, filename, COUNT(*) FROM documents '
+        'WHERE filename IS NOT NULL GROUP BY project_id, filename '
+        'HAVING COUNT(*) > 1 AND '
+        '(COUNT(DISTINCT file_url) > 1 OR COUNT(file_url) < COUNT(*)) '
+        'ORDER BY project_id, filename'
+    )).all()
+    if conflicts:
+        report = '\n'.join(
+            f'  project {project_id}: {filename!r} ({count} documents)'
+            for project_id, filename, count in conflicts
+        )
+        raise RuntimeError(
+            'Documents with the same name in a project point at different '
+            'objects; rename or delete them, then run the migration again:\n'
+            + report
+        )
+
+
+# Copy every row with an earlier twin to the side table, then delete it
+def _move_duplicates(side_table, table, condition):
+    duplicates = (
+        f'SELECT * FROM {table} a WHERE EXISTS '
+        f'(SELECT 1 FROM {table} b WHERE {condition} AND b.id < a.id)'
+    )
+    if op.get_bind().execute(sa.text(f'SELECT COUNT(*) FROM ({duplicates}) d')).scalar() == 0:
+        return
+    op.execute(f'CREATE TABLE IF NOT EXISTS {side_table} AS SELECT * FROM {table} WHERE 1 = 0')
+    op.execute(f'INSERT INTO {side_table} {duplicates}')
+    op.execute(f'DELETE FROM {table} WHERE id IN (SELECT id FROM {side_table})')
+
+
+# Whether a Postgres index exists and is valid, None when it does not exist
+def _index_valid(name):
+    return op.get_bind().execute(sa.text(
+        'SELECT i.indisvalid FROM pg_index i '
+        'JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+    ), {'name': name}).scalar()
+
+
+def _drop_index(name, table):
+    if _is_postgresql():
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    else:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def _create_index(name, table, columns, unique):
+    if _is_postgresql():
+        valid = _index_valid(name)
+        if valid:
+            return
+        if valid is not None:
+            # a failed CONCURRENTLY build leaves an INVALID index behind
+            op.execute(f'DROP INDEX CONCURRENTLY {name}')
+    op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+
+def upgrade() -> None:
+    # duplicates would make the unique indexes fail; they can only come from
+    # concurrent requests and point at the same participant or S3 object
+    _check_document_conflicts()
+    for side_table, table, condition in DUPLICATES:
+        _move_duplicates(side_table, table, condition)
+
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in QUERY_INDEXES:
+            _create_index(name, table, columns, unique)
+        for name, table, _ in UNUSED_INDEXES:
+            _drop_index(name, table)
+
+    if _is_postgresql():
+        # promote the unique indexes to constraints without another table scan
+        op.execute(
+            'ALTER TABLE project_participants ADD CONSTRAINT '
+            'uq_project_participants_user_id_project_id '
+            'UNIQUE USING INDEX uq_project_participants_user_id_project_id'
+        )
+        op.execute(
+            'ALTER TABLE documents ADD CONSTRAINT uq_documents_project_id_filename '
+            'UNIQUE USING INDEX uq_documents_project_id_filename'
+        )
+
+
+def downgrade() -> None:
+    if _is_postgresql():
+        op.drop_constraint('uq_documents_project_id_filename', 'documents', type_='unique')
+        op.drop_constraint('uq_project_participants_user_id_project_id', 'project_participants', type_='unique')
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in UNUSED_INDEXES:
+            _create_index(name, table, columns, False)
+        for name, table, _, _ in QUERY_INDEXES:
+            _drop_index(name, table)
+
+    for side_table, table, _ in DUPLICATES:
+        if _table_exists(side_table):
+            op.execute(f'INSERT INTO {table} SELECT * FROM {side_table}')
+            op.drop_table(side_table)
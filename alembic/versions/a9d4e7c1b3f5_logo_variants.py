@@ -0,0 +1,28 @@
+"""Logo variants
+
+Record the resized copies rendered for each project logo.
+
+Revision ID: a9d4e7c1b3f5
+Revises: f6c2b9e4a1d8
+Create Date: 2026-10-18 22:03:40.518263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d4e7c1b3f5'
+down_revision: Union[str, None] = 'f6c2b9e4a1d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('projects', sa.Column('logo_variants', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('projects', 'logo_variants')
@@ -0,0 +1,51 @@
+"""Document versions
+
+Keep the content documents had before an update so earlier versions stay
+readable until their retention period ends, and number document updates
+so they can be made conditional on the current version.
+
+Revision ID: b8e4d1f7c2a9
+Revises: 6c1f8e2d9a47
+Create Date: 2026-10-18 18:11:05.362914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e4d1f7c2a9'
+down_revision: Union[str, None] = '6c1f8e2d9a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.create_table('document_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('file_url', sa.String(), nullable=False),
+    sa.Column('blob_digest', sa.String(length=64), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('checksum', sa.String(length=64), nullable=True),
+    sa.Column('crc32', sa.BigInteger(), nullable=True),
+    sa.Column('etag', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('superseded_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['blob_digest'], ['blobs.digest'], ),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('document_id', 'version', name='uq_document_versions_document_id_version')
+    )
+    op.create_index('ix_document_versions_superseded_at', 'document_versions', ['superseded_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_document_versions_superseded_at', table_name='document_versions')
+    op.drop_table('document_versions')
+    op.drop_column('documents', 'version')
@@ -0,0 +1,29 @@
+"""Document text claims
+
+Let extraction processes claim documents with a lease, so every process
+extracts different documents.
+
+Revision ID: c4e8a2f6d9b1
+Revises: a9d4e7c1b3f5
+Create Date: 2026-10-19 09:41:27.305118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a2f6d9b1'
+down_revision: Union[str, None] = 'a9d4e7c1b3f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('document_texts', sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('document_texts', 'locked_until')
@@ -0,0 +1,41 @@
+"""Filename counters
+
+Claims of document names per project, used to allocate report(1).pdf
+style names with a single upsert instead of reading every filename of
+the project. Existing documents are backfilled as claimed names.
+
+Revision ID: c71e5b08d4a2
+Revises: 3d9a41f6b2c0
+Create Date: 2026-10-18 13:05:52.918440
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c71e5b08d4a2'
+down_revision: Union[str, None] = '3d9a41f6b2c0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('filename_counters',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('last_suffix', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.project_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('project_id', 'filename')
+    )
+    op.execute(
+        'INSERT INTO filename_counters (project_id, filename, last_suffix) '
+        'SELECT DISTINCT project_id, filename, 0 FROM documents '
+        'WHERE project_id IS NOT NULL AND filename IS NOT NULL'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('filename_counters')
@@ -0,0 +1,145 @@
+"""Project search
+
+Keep a weighted tsvector of each project's name, description and document
+filenames, maintained by triggers, for GET /projects/search. Trigram
+indexes are added where the pg_trgm extension can be created.
+
+Revision ID: d3a7c5e9f1b2
+Revises: b8e4d1f7c2a9
+Create Date: 2026-10-18 19:24:51.730118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a7c5e9f1b2'
+down_revision: Union[str, None] = 'b8e4d1f7c2a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+functions = [
+    """
+CREATE OR REPLACE FUNCTION project_search_vector(
+    name VARCHAR, description TEXT, filenames TEXT
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(filenames, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION project_filenames(project INT) RETURNS TEXT AS $$
+    SELECT string_agg(translate(filename, '._-', '   '), ' ')
+    FROM documents WHERE project_id = project
+$$ LANGUAGE sql STABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION projects_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := project_search_vector(
+        NEW.name, NEW.description, project_filenames(NEW.project_id)
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION documents_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    UPDATE projects
+    SET search_vector = project_search_vector(
+        name, description, project_filenames(project_id)
+    )
+    WHERE project_id IN (SELECT DISTINCT project_id FROM changed_documents);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION documents_search_vector_update_trigger()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE projects
+    SET search_vector = project_search_vector(
+        name, description, project_filenames(project_id)
+    )
+    WHERE project_id IN (
+        SELECT unnest(ARRAY[old_documents.project_id, new_documents.project_id])
+        FROM old_documents JOIN new_documents ON old_documents.id = new_documents.id
+        WHERE old_documents.filename IS DISTINCT FROM new_documents.filename
+            OR old_documents.project_id IS DISTINCT FROM new_documents.project_id
+    );
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""",
+]
+
+triggers = [
+    """
+CREATE TRIGGER projects_search_vector
+BEFORE INSERT OR UPDATE OF name, description ON projects
+FOR EACH ROW EXECUTE FUNCTION projects_search_vector_trigger()
+""",
+    """
+CREATE TRIGGER documents_search_vector_insert
+AFTER INSERT ON documents REFERENCING NEW TABLE AS changed_documents
+FOR EACH STATEMENT EXECUTE FUNCTION documents_search_vector_trigger()
+""",
+    """
+CREATE TRIGGER documents_search_vector_delete
+AFTER DELETE ON documents REFERENCING OLD TABLE AS changed_documents
+FOR EACH STATEMENT EXECUTE FUNCTION documents_search_vector_trigger()
+""",
+    """
+CREATE TRIGGER documents_search_vector_update
+AFTER UPDATE ON documents
+REFERENCING OLD TABLE AS old_documents NEW TABLE AS new_documents
+FOR EACH STATEMENT EXECUTE FUNCTION documents_search_vector_update_trigger()
+""",
+    """
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS ix_projects_name_trgm
+        ON projects USING gin (name gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_documents_filename_trgm
+        ON documents USING gin (filename gin_trgm_ops);
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is not available, project search uses words only';
+END
+$$
+""",
+]
+
+
+def upgrade() -> None:
+    op.add_column('projects', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.create_index('ix_projects_search_vector', 'projects', ['search_vector'], unique=False, postgresql_using='gin')
+    for statement in functions + triggers:
+        op.execute(statement)
+    op.execute(
+        "UPDATE projects SET search_vector = project_search_vector("
+        "name, description, project_filenames(project_id))"
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS ix_documents_filename_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_projects_name_trgm')
+    op.execute('DROP TRIGGER documents_search_vector_update ON documents')
+    op.execute('DROP TRIGGER documents_search_vector_delete ON documents')
+    op.execute('DROP TRIGGER documents_search_vector_insert ON documents')
+    op.execute('DROP TRIGGER projects_search_vector ON projects')
+    op.execute('DROP FUNCTION documents_search_vector_update_trigger()')
+    op.execute('DROP FUNCTION documents_search_vector_trigger()')
+    op.execute('DROP FUNCTION projects_search_vector_trigger()')
+    op.execute('DROP FUNCTION project_filenames(INT)')
+    op.execute('DROP FUNCTION project_search_vector(VARCHAR, TEXT, TEXT)')
+    op.drop_index('ix_projects_search_vector', table_name='projects', postgresql_using='gin')
+    op.drop_column('projects', 'search_vector')
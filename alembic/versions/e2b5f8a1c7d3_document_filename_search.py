@@ -0,0 +1,169 @@
+"""Document filename search
+
+Keep a tsvector of each document's filename in documents.search_vector,
+maintained by a row trigger, instead of folding every filename into the
+project's search vector on each document change.
+
+Revision ID: e2b5f8a1c7d3
+Revises: c4e8a2f6d9b1
+Create Date: 2026-10-19 14:08:36.517204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b5f8a1c7d3'
+down_revision: Union[str, None] = 'c4e8a2f6d9b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+functions = [
+    """
+CREATE OR REPLACE FUNCTION project_search_vector(
+    name VARCHAR, description TEXT
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION document_search_vector(filename VARCHAR)
+RETURNS tsvector AS $$
+    SELECT setweight(
+        to_tsvector('simple', translate(coalesce(filename, ''), '._-', '   ')), 'C'
+    )
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION projects_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := project_search_vector(NEW.name, NEW.description);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION documents_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := document_search_vector(NEW.filename);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+]
+
+previous_functions = [
+    """
+CREATE OR REPLACE FUNCTION project_search_vector(
+    name VARCHAR, description TEXT, filenames TEXT
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(filenames, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION project_filenames(project INT) RETURNS TEXT AS $$
+    SELECT string_agg(translate(filename, '._-', '   '), ' ')
+    FROM documents WHERE project_id = project
+$$ LANGUAGE sql STABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION projects_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := project_search_vector(
+        NEW.name, NEW.description, project_filenames(NEW.project_id)
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION documents_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    UPDATE projects
+    SET search_vector = project_search_vector(
+        name, description, project_filenames(project_id)
+    )
+    WHERE project_id IN (SELECT DISTINCT project_id FROM changed_documents);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION documents_search_vector_update_trigger()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE projects
+    SET search_vector = project_search_vector(
+        name, description, project_filenames(project_id)
+    )
+    WHERE project_id IN (
+        SELECT unnest(ARRAY[old_documents.project_id, new_documents.project_id])
+        FROM old_documents JOIN new_documents ON old_documents.id = new_documents.id
+        WHERE old_documents.filename IS DISTINCT FROM new_documents.filename
+            OR old_documents.project_id IS DISTINCT FROM new_documents.project_id
+    );
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""",
+]
+
+previous_triggers = [
+    """
+CREATE TRIGGER documents_search_vector_insert
+AFTER INSERT ON documents REFERENCING NEW TABLE AS changed_documents
+FOR EACH STATEMENT EXECUTE FUNCTION documents_search_vector_trigger()
+""",
+    """
+CREATE TRIGGER documents_search_vector_delete
+AFTER DELETE ON documents REFERENCING OLD TABLE AS changed_documents
+FOR EACH STATEMENT EXECUTE FUNCTION documents_search_vector_trigger()
+""",
+    """
+CREATE TRIGGER documents_search_vector_update
+AFTER UPDATE ON documents
+REFERENCING OLD TABLE AS old_documents NEW TABLE AS new_documents
+FOR EACH STATEMENT EXECUTE FUNCTION documents_search_vector_update_trigger()
+""",
+]
+
+
+def upgrade() -> None:
+    op.execute('DROP TRIGGER documents_search_vector_update ON documents')
+    op.execute('DROP TRIGGER documents_search_vector_delete ON documents')
+    op.execute('DROP TRIGGER documents_search_vector_insert ON documents')
+    op.execute('DROP FUNCTION documents_search_vector_update_trigger()')
+    op.execute('DROP FUNCTION project_filenames(INT)')
+    op.execute('DROP FUNCTION project_search_vector(VARCHAR, TEXT, TEXT)')
+    for statement in functions:
+        op.execute(statement)
+    op.add_column('documents', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.execute('UPDATE documents SET search_vector = document_search_vector(filename)')
+    op.create_index('ix_documents_search_vector', 'documents', ['search_vector'], unique=False, postgresql_using='gin')
+    op.execute(
+        'CREATE TRIGGER documents_search_vector BEFORE INSERT OR UPDATE '
+        'OF filename ON documents '
+        'FOR EACH ROW EXECUTE FUNCTION documents_search_vector_trigger()'
+    )
+    op.execute('UPDATE projects SET search_vector = project_search_vector(name, description)')
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER documents_search_vector ON documents')
+    op.drop_index('ix_documents_search_vector', table_name='documents', postgresql_using='gin')
+    op.drop_column('documents', 'search_vector')
+    op.execute('DROP FUNCTION document_search_vector(VARCHAR)')
+    op.execute('DROP FUNCTION project_search_vector(VARCHAR, TEXT)')
+    for statement in previous_functions + previous_triggers:
+        op.execute(statement)
+    op.execute(
+        'UPDATE projects SET search_vector = project_search_vector('
+        'name, description, project_filenames(project_id))'
+    )
@@ -0,0 +1,48 @@
+"""Content-addressed blobs
+
+Revision ID: e5b2f7a19c63
+Revises: c71e5b08d4a2
+Create Date: 2026-10-18 13:48:31.207795
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b2f7a19c63'
+down_revision: Union[str, None] = 'c71e5b08d4a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('blobs',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('stored', sa.Boolean(), nullable=False),
+    sa.Column('unreferenced_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    op.create_index('ix_blobs_unreferenced_at', 'blobs', ['unreferenced_at'], unique=False)
+    # blob URLs are longer than the 100 characters allowed so far
+    op.alter_column('documents', 'file_url', type_=sa.String(), existing_nullable=True)
+    op.add_column('documents', sa.Column('blob_digest', sa.String(length=64), nullable=True))
+    op.create_index('ix_documents_blob_digest', 'documents', ['blob_digest'], unique=False)
+    op.create_foreign_key('documents_blob_digest_fkey', 'documents', 'blobs', ['blob_digest'], ['digest'])
+    op.add_column('upload_job_items', sa.Column('digest', sa.String(length=64), nullable=True))
+    op.add_column('upload_job_items', sa.Column('size', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    # file_url stays widened, longer URLs may exist by now
+    op.drop_column('upload_job_items', 'size')
+    op.drop_column('upload_job_items', 'digest')
+    op.drop_constraint('documents_blob_digest_fkey', 'documents', type_='foreignkey')
+    op.drop_index('ix_documents_blob_digest', table_name='documents')
+    op.drop_column('documents', 'blob_digest')
+    op.drop_index('ix_blobs_unreferenced_at', table_name='blobs')
+    op.drop_table('blobs')
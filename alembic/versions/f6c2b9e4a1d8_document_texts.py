@@ -0,0 +1,62 @@
+"""Document texts
+
+Keep the text extracted from .pdf and .docx documents, with a tsvector
+maintained by a trigger, for GET /documents/search.
+
+Revision ID: f6c2b9e4a1d8
+Revises: d3a7c5e9f1b2
+Create Date: 2026-10-18 21:07:12.402871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6c2b9e4a1d8'
+down_revision: Union[str, None] = 'd3a7c5e9f1b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('document_texts',
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('extracted_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('document_id')
+    )
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION document_texts_search_vector_trigger()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('simple', coalesce(NEW.content, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+    )
+    op.execute(
+        """
+CREATE TRIGGER document_texts_search_vector
+BEFORE INSERT OR UPDATE OF content ON document_texts
+FOR EACH ROW EXECUTE FUNCTION document_texts_search_vector_trigger()
+"""
+    )
+    op.create_index('ix_document_texts_search_vector', 'document_texts', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_document_texts_search_vector', table_name='document_texts', postgresql_using='gin')
+    op.execute('DROP TRIGGER document_texts_search_vector ON document_texts')
+    op.execute('DROP FUNCTION document_texts_search_vector_trigger()')
+    op.drop_table('document_texts')
@@ -1,33 +1,101 @@
 from fastapi import (
+    Header,
     HTTPException,
     status,
     Depends,
     UploadFile,
     Response,
     APIRouter,
-    BackgroundTasks,
+    Query,
+    Request,
 )
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing_extensions import List
+from typing_extensions import List, Literal, Optional
 
 from app.auth.jwt_handler import get_current_user
-from app.database import get_db
-from app.schemas import DocumentResponse
+from app.database import get_db, get_optional_async_db, get_read_db
+from app.schemas import (
+    BulkDeleteRequest,
+    BulkDeleteResponse,
+    CommitUploadRequest,
+    DocumentResponse,
+    DocumentSearchResult,
+    DocumentVersionResponse,
+    MoveDocumentRequest,
+    PresignedUpload,
+    PresignedUploadRequest,
+    UploadJobResponse,
+)
+from app.streaming import (
+    archive_response,
+    metadata_response,
+    parse_range_header,
+    presigned_download_response,
+    s3_streaming_response,
+)
 from app.models import User
+from app.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    cursor_field,
+    decode_cursor,
+    encode_cursor,
+)
 from app.crud.project import get_project_by_id_with_access
+from app.crud.upload_jobs import (
+    create_upload_job,
+    get_upload_job,
+    get_upload_job_by_key,
+    upload_job_status,
+)
+from app.crud.search import SEARCH_MAX_RESULTS, search_document_contents
+from app.workers import text_extractor, upload_worker_pool
 from app.crud.documents import (
-    has_access_to_document,
-    upload_docs,
+    DOCUMENT_SORT_COLUMNS,
+    PRESIGNED_URL_EXPIRES,
+    commit_presigned_uploads,
+    download_document_version,
+    get_document_version,
+    get_document_versions,
+    get_document_with_access,
+    head_project_document,
+    presign_document_download,
+    presign_document_uploads,
+    presigned_transfers_enabled,
     update_project_document,
     get_project_documents,
-    get_document,
+    get_project_documents_async,
+    project_archive,
     delete_project_document,
+    delete_project_documents,
+    move_project_document,
     allowed_document_extension,
 )
+from app.storage import StorageError
 
 router = APIRouter()
 
 
+# Search the text of the user's .pdf and .docx documents, best matches
+# first; documents are searchable once their text has been extracted
+@router.get(
+    "/documents/search",
+    response_model=List[DocumentSearchResult],
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+def search_documents(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(SEARCH_MAX_RESULTS, ge=1, le=SEARCH_MAX_RESULTS),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    return search_document_contents(db, current_user.id, q, limit)
+
+
 # List all document for the project
 @router.get(
     "/project/{project_id}/documents",
@@ -37,37 +105,78 @@ router = APIRouter()
 )
 async def list_all_project_document(
     project_id: int,
+    response: Response,
+    sort: Literal["id", "filename"] = "id",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    async_db: Optional[AsyncSession] = Depends(get_optional_async_db),
 ):
-    has_access = get_project_by_id_with_access(project_id, current_user.id, db=db)
-    if has_access is None:
+    after = None
+    if cursor is not None:
+        values = decode_cursor(cursor)
+        if values.get("sort") != sort:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+        sort_type = DOCUMENT_SORT_COLUMNS[sort].type.python_type
+        after = (
+            cursor_field(values, "value", sort_type),
+            cursor_field(values, "id", int),
+        )
+    # fetch one extra row to know whether another page follows; in async
+    # database mode the queries do not block the event loop
+    if async_db is not None:
+        documents = await get_project_documents_async(
+            user_id=current_user.id,
+            project_id=project_id,
+            db=async_db,
+            sort=sort,
+            after=after,
+            limit=limit + 1,
+        )
+    else:
+        documents = await get_project_documents(
+            user_id=current_user.id,
+            project_id=project_id,
+            db=db,
+            sort=sort,
+            after=after,
+            limit=limit + 1,
+        )
+    if documents is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this project",
         )
-    documents = await get_project_documents(
-        user_id=current_user.id, project_id=project_id, db=db
-    )
-    if documents is None or len(documents) == 0:
+    if len(documents) == 0 and cursor is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No documents found for this project",
         )
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            {"sort": sort, "value": getattr(last, sort), "id": last.id}
+        )
     return documents
 
 
-# Upload a document endpoint
+# Upload a document endpoint, files are queued and sent to S3 by the
+# upload workers
 @router.post(
     "/project/{project_id}/documents/",
-    response_model=None,
-    status_code=status.HTTP_200_OK,
+    response_model=UploadJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
     tags=["Document Methods"],
 )
 async def upload_documents(
     project_id: int,
     files: List[UploadFile],
-    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -78,18 +187,167 @@ async def upload_documents(
             detail="You don't have access to this project",
         )
 
-    file_contents = []
     for file in files:
         if not allowed_document_extension(file.filename):
             raise HTTPException(
                 status_code=400, detail="Only .docx, .pdf files are allowed"
             )
 
-        content = await file.read()
-        file_contents.append((file.filename, content))
+    job = None
+    if idempotency_key:
+        job = get_upload_job_by_key(idempotency_key, current_user.id, db)
+    if job is None:
+        job = await run_in_threadpool(
+            create_upload_job,
+            db,
+            project_id,
+            current_user.id,
+            [(file.filename, file.file) for file in files],
+            idempotency_key,
+        )
+        upload_worker_pool.notify()
+    if job.project_id != project_id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Idempotency key was already used for another project",
+        )
+    response.headers["Location"] = f"/uploads/{job.id}"
+    return upload_job_status(job)
+
+
+# Progress of an upload job
+@router.get(
+    "/uploads/{job_id}",
+    response_model=UploadJobResponse,
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+async def get_upload_status(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    job = get_upload_job(job_id, current_user.id, db)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload job not found"
+        )
+    return upload_job_status(job)
+
+
+def require_presigned_transfers():
+    if not presigned_transfers_enabled():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Presigned transfers are disabled",
+        )
+
+
+# Request presigned URLs to upload documents straight to S3
+@router.post(
+    "/project/{project_id}/documents/presigned-uploads",
+    response_model=List[PresignedUpload],
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+async def create_presigned_uploads(
+    project_id: int,
+    upload_request: PresignedUploadRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    require_presigned_transfers()
+    has_access = get_project_by_id_with_access(project_id, current_user.id, db=db)
+    if has_access is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this project",
+        )
+
+    for file in upload_request.files:
+        if not allowed_document_extension(file.filename) or "/" in file.filename:
+            raise HTTPException(
+                status_code=400, detail="Only .docx, .pdf files are allowed"
+            )
+
+    return await run_in_threadpool(
+        presign_document_uploads,
+        db,
+        project_id,
+        current_user.id,
+        upload_request.files,
+    )
+
+
+# Register documents uploaded with presigned URLs; answers 207 with the
+# result of each file when only some could be committed, 409 when none
+@router.post(
+    "/project/{project_id}/documents/presigned-uploads/commit",
+    response_model=None,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Document Methods"],
+)
+async def commit_uploads(
+    project_id: int,
+    commit_request: CommitUploadRequest,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    require_presigned_transfers()
+    has_access = get_project_by_id_with_access(project_id, current_user.id, db=db)
+    if has_access is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this project",
+        )
+
+    for file in commit_request.files:
+        if not allowed_document_extension(file.stored_as) or "/" in file.stored_as:
+            raise HTTPException(
+                status_code=400, detail="Only .docx, .pdf files are allowed"
+            )
+
+    results = await commit_presigned_uploads(
+        db, project_id, current_user.id, commit_request.files
+    )
+    text_extractor.notify()
+    failed = [result for result in results if result["status"] == "failed"]
+    if len(failed) == len(results):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "No files could be committed", "results": results},
+        )
+    if failed:
+        response.status_code = status.HTTP_207_MULTI_STATUS
+        return {"message": "Some files could not be committed", "results": results}
+    return {"message": "Files uploaded successfully", "results": results}
+
 
-    background_tasks.add_task(upload_docs, db, project_id, file_contents)
-    return {"message": "Files uploaded successfully"}
+# Download every document of a project as one ZIP archive
+@router.get(
+    "/project/{project_id}/documents/archive",
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+async def download_project_archive(
+    project_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    archive = await run_in_threadpool(project_archive, project_id, current_user.id, db)
+    if archive is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this project",
+        )
+    return archive_response(
+        archive,
+        f"project-{project_id}.zip",
+        request.headers.get("range"),
+        request.headers.get("if-range"),
+    )
 
 
 # Download a document
@@ -98,65 +356,159 @@ async def upload_documents(
 )
 async def download_document(
     document_id: int,
+    request: Request,
+    redirect: bool = True,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     from app.crud.documents import download_project_document
 
-    has_access = has_access_to_document(document_id, current_user.id, db=db)
-    if has_access is False:
+    document = get_document_with_access(document_id, current_user.id, db=db)
+    if document is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this document",
         )
-    document = get_document(document_id, db=db)
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+    if presigned_transfers_enabled():
+        return presigned_download_response(
+            presign_document_download(document), PRESIGNED_URL_EXPIRES, redirect
         )
-    document_content, error_msg = download_project_document(document=document)
+    byte_range = parse_range_header(request.headers.get("range"))
+    s3_object, error_msg = await run_in_threadpool(
+        download_project_document, document=document, byte_range=byte_range
+    )
     if error_msg:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_msg)
-    file_name = document.file_url.split("/")[-1]
-    return Response(
-        content=document_content,
-        headers={
-            "Content-Disposition": f"attachment; filename={file_name}",
-            "Content-Type": "application/octet-stream",
-        },
+    return s3_streaming_response(s3_object, document.filename)
+
+
+# Document metadata without its content
+@router.head(
+    "/document/{document_id}", status_code=status.HTTP_200_OK, tags=["Document Methods"]
+)
+async def head_document(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    document = get_document_with_access(document_id, current_user.id, db=db)
+    if document is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this document",
+        )
+    if document.size is not None:
+        return metadata_response(
+            document.filename,
+            document.size,
+            document.content_type,
+            document.etag,
+            document.updated_at,
+        )
+
+    # saved before its metadata was recorded, ask S3
+    try:
+        head = await run_in_threadpool(head_project_document, document)
+    except StorageError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document content not found"
+        )
+    return metadata_response(
+        document.filename,
+        head["ContentLength"],
+        head.get("ContentType"),
+        head.get("ETag"),
+        head.get("LastModified"),
     )
 
 
-# Update document endpoint
+# Update document endpoint; with If-Match the update is refused with 412
+# when the document has changed since the client read it
 @router.put(
     "/document/{document_id}", status_code=status.HTTP_200_OK, tags=["Document Methods"]
 )
 async def update_file_content(
     document_id: int,
     file: UploadFile,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    has_access = has_access_to_document(document_id, current_user.id, db=db)
-    if has_access is False:
+    existing_document = get_document_with_access(document_id, current_user.id, db=db)
+    if existing_document is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this document",
         )
-    # check if document exists
-    existing_document = get_document(document_id, db=db)
-    if existing_document is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
-        )
     # update document content
-    error_msg = await update_project_document(document=existing_document, file=file)
+    error_msg = await update_project_document(
+        document=existing_document, file=file, db=db, if_match=if_match
+    )
     if error_msg:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_msg)
+    text_extractor.notify()
 
+    if existing_document.etag:
+        response.headers["ETag"] = existing_document.etag
     return {"message": "File content updated successfully"}
 
 
+# Earlier versions of a document, newest first
+@router.get(
+    "/document/{document_id}/versions",
+    response_model=List[DocumentVersionResponse],
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+def list_document_versions(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    document = get_document_with_access(document_id, current_user.id, db=db)
+    if document is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this document",
+        )
+    return get_document_versions(document, db)
+
+
+# Download an earlier version of a document
+@router.get(
+    "/document/{document_id}/versions/{version}",
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+async def download_version(
+    document_id: int,
+    version: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    document = get_document_with_access(document_id, current_user.id, db=db)
+    if document is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this document",
+        )
+    document_version = get_document_version(document, version, db)
+    if document_version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Version {version} of document {document_id} not found",
+        )
+    byte_range = parse_range_header(request.headers.get("range"))
+    s3_object, error_msg = await run_in_threadpool(
+        download_document_version, document_version, byte_range
+    )
+    if error_msg:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_msg)
+    return s3_streaming_response(s3_object, document.filename)
+
+
 # Delete document endpoint
 @router.delete(
     "/document/{document_id}",
@@ -169,18 +521,72 @@ async def delete_document(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    has_access = has_access_to_document(document_id, current_user.id, db=db)
-    if has_access is False:
+    document = get_document_with_access(document_id, current_user.id, db=db)
+    if document is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this document",
         )
-    document = get_document(document_id, db=db)
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
-        )
     error_msg = await delete_project_document(document=document, db=db)
     if error_msg:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_msg)
     return {"message": "Document successfully deleted"}
+
+
+# Move a document to another project the user has access to
+@router.post(
+    "/document/{document_id}/move",
+    response_model=DocumentResponse,
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+async def move_document(
+    document_id: int,
+    move_request: MoveDocumentRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    document = get_document_with_access(document_id, current_user.id, db=db)
+    if document is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this document",
+        )
+    project = get_project_by_id_with_access(
+        db=db, project_id=move_request.project_id, user_id=current_user.id
+    )
+    if project is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this project",
+        )
+    error_msg = await run_in_threadpool(
+        move_project_document, db, document, move_request.project_id
+    )
+    if error_msg:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=error_msg
+        )
+    return document
+
+
+# Delete many documents at once, by id or by a filter on one project
+@router.post(
+    "/documents/bulk-delete",
+    response_model=BulkDeleteResponse,
+    status_code=status.HTTP_200_OK,
+    tags=["Document Methods"],
+)
+async def bulk_delete_documents(
+    delete_request: BulkDeleteRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    return await run_in_threadpool(
+        delete_project_documents,
+        db,
+        current_user.id,
+        delete_request.document_ids,
+        delete_request.project_id,
+        delete_request.filename_prefix,
+    )
@@ -0,0 +1,100 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from typing_extensions import Optional
+import hmac
+import os
+
+from app.auth.cache import principal_cache
+from app.auth.hashing import password_executor
+from app.db_metrics import pool_metrics_registry
+from app.storage import storage_cache_registry
+from app.extraction import extraction_metrics, extraction_pool
+from app.workers import (
+    blob_collector,
+    text_extractor,
+    upload_worker_pool,
+    version_purger,
+)
+
+# shared secret monitoring sends in the X-Internal-Token header; the
+# internal routes are disabled while it is unset
+INTERNAL_METRICS_TOKEN = os.getenv("INTERNAL_METRICS_TOKEN")
+
+
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    if not INTERNAL_METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_internal_token is None or not hmac.compare_digest(
+        x_internal_token.encode(), INTERNAL_METRICS_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid internal token"
+        )
+
+
+router = APIRouter(
+    prefix="/internal",
+    include_in_schema=False,
+    dependencies=[Depends(require_internal_token)],
+)
+
+
+# Hit/miss counters of the verified-principal cache
+@router.get(
+    "/metrics/auth-cache", status_code=status.HTTP_200_OK, tags=["Internal Methods"]
+)
+def auth_cache_metrics():
+    return principal_cache.stats()
+
+
+# Backlog and rejections of the password hashing executor
+@router.get(
+    "/metrics/password-executor",
+    status_code=status.HTTP_200_OK,
+    tags=["Internal Methods"],
+)
+def password_executor_metrics():
+    return password_executor.stats()
+
+
+# Checkouts, overflow, wait-time histogram and timeouts of every DB pool
+@router.get(
+    "/metrics/db-pool", status_code=status.HTTP_200_OK, tags=["Internal Methods"]
+)
+def db_pool_metrics():
+    return [metrics.snapshot() for metrics in pool_metrics_registry.values()]
+
+
+# Liveness and throughput of the upload workers in this process
+@router.get(
+    "/metrics/upload-workers",
+    status_code=status.HTTP_200_OK,
+    tags=["Internal Methods"],
+)
+def upload_worker_metrics():
+    return {
+        **upload_worker_pool.stats(),
+        "blob_gc": blob_collector.stats(),
+        "version_purge": version_purger.stats(),
+    }
+
+
+# Throughput of document text extraction in this process
+@router.get(
+    "/metrics/extraction", status_code=status.HTTP_200_OK, tags=["Internal Methods"]
+)
+def extraction_pipeline_metrics():
+    return {
+        **extraction_metrics.stats(),
+        "pool_restarts": extraction_pool.restarts,
+        "task": text_extractor.stats(),
+    }
+
+
+# Size, hit rate and evictions of the disk caches in front of storage
+@router.get(
+    "/metrics/storage-cache",
+    status_code=status.HTTP_200_OK,
+    tags=["Internal Methods"],
+)
+def storage_cache_metrics():
+    return {name: cache.stats() for name, cache in storage_cache_registry.items()}
@@ -4,20 +4,33 @@ from fastapi import (
     File,
     HTTPException,
     Depends,
-    Response,
+    Query,
+    Request,
     status,
 )
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from typing_extensions import Optional
 from app.models import Project, User
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.auth.jwt_handler import get_current_user
 from app.crud.logo import (
     upload_to_s3,
     allowed_file_extension,
-    get_project_logo_url,
+    get_project_logo,
+    logo_variant_filename,
+    pick_logo_variant,
+    presign_logo_download,
+    presigned_logo_transfers_enabled,
     delete_logo,
 )
+from app.crud.documents import PRESIGNED_URL_EXPIRES
 from app.crud.project import get_project_by_id_with_access
+from app.streaming import (
+    parse_range_header,
+    presigned_download_response,
+    s3_streaming_response,
+)
 
 router = APIRouter()
 
@@ -44,37 +57,50 @@ async def upload_project_logo(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    image = await upload_to_s3(
-        logo=file, project_id=project_id, db=db, user_id=current_user.id
-    )
+    image = await upload_to_s3(project=project, db=db, logo=file)
 
     return image
 
 
-# Download logo endpoint
+# Download logo endpoint; with size, the smallest variant at least that
+# many pixels large, WebP when the client accepts it
 @router.get(
     "/project/{project_id}/logo", status_code=status.HTTP_200_OK, tags=["Logo Methods"]
 )
 async def download_project_logo(
     project_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    redirect: bool = True,
+    size: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     from app.crud.logo import download_logo_from_s3
 
-    logo_url = get_project_logo_url(db, project_id, current_user.id)
+    logo_url, variants = get_project_logo(db, project_id, current_user.id)
+    variant = None
+    if size is not None:
+        variant = pick_logo_variant(variants, size, request.headers.get("accept"))
+    if presigned_logo_transfers_enabled():
+        return presigned_download_response(
+            presign_logo_download(logo_url, project_id, variant),
+            PRESIGNED_URL_EXPIRES,
+            redirect,
+        )
 
-    logo_data, error_msg = download_logo_from_s3(logo_url, project_id)
+    byte_range = parse_range_header(request.headers.get("range"))
+    logo_object, error_msg = await run_in_threadpool(
+        download_logo_from_s3, logo_url, project_id, byte_range, variant
+    )
     if error_msg:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_msg)
     filename = logo_url.split("/")[-1]
-    return Response(
-        content=logo_data,
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}",
-            "Content-Type": "application/octet-stream",
-        },
-    )
+    if variant is not None:
+        filename = logo_variant_filename(logo_url, variant)
+    response = s3_streaming_response(logo_object, filename)
+    if size is not None:
+        response.headers["Vary"] = "Accept"
+    return response
 
 
 # Delete logo endpoint
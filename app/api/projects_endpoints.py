@@ -3,28 +3,43 @@ from fastapi import (
     status,
     Depends,
     APIRouter,
+    Query,
+    Response,
 )
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from app.auth.jwt_handler import get_current_user
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas import (
+    CloneProjectRequest,
     CreateUpdateProject,
     ProjectDocumentInfo,
     ProjectResponse,
+    ProjectSearchResult,
 )
 from app.models import User
+from app.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    cursor_field,
+    decode_cursor,
+    encode_cursor,
+)
 from app.crud.project import (
     projects_info_with_docs,
     create_project_with_owner,
     update_project_info,
-    delete_specific_project,
+    get_project_with_role,
     get_project_by_id_with_access,
     get_project_by_id,
 )
+from app.crud.documents import clone_project, remove_project
+from app.crud.search import SEARCH_MAX_RESULTS, search_projects
+from app.crud.logo import copy_project_logo
 from app.crud.user import (
-    is_only_participant,
     get_user_by_username,
     add_project_participant,
 )
@@ -56,9 +71,42 @@ async def create_project(
     tags=["Project Methods"],
 )
 async def list_all_projects(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    after_id = None
+    if cursor is not None:
+        after_id = cursor_field(decode_cursor(cursor), "project_id", int)
+    # fetch one extra row to know whether another page follows
+    projects = projects_info_with_docs(
+        user_id=current_user.id, db=db, after_id=after_id, limit=limit + 1
+    )
+    if len(projects) > limit:
+        projects = projects[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            {"project_id": projects[-1]["id"]}
+        )
+    return projects
+
+
+# Search the names and descriptions of the user's projects and the names of
+# their documents, best matches first
+@router.get(
+    "/projects/search",
+    response_model=List[ProjectSearchResult],
+    status_code=status.HTTP_200_OK,
+    tags=["Project Methods"],
+)
+def search_all_projects(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(SEARCH_MAX_RESULTS, ge=1, le=SEARCH_MAX_RESULTS),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
 ):
-    return projects_info_with_docs(user_id=current_user.id, db=db)
+    return search_projects(db, current_user.id, q, limit)
 
 
 # Get project specific details endpoint
@@ -71,7 +119,7 @@ async def list_all_projects(
 def get_project_details(
     project_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     db_project = get_project_by_id_with_access(
         db=db, project_id=project_id, user_id=current_user.id
@@ -84,6 +132,39 @@ def get_project_details(
     return db_project
 
 
+# Clone a project with its documents and participants for the current user
+@router.post(
+    "/project/{project_id}/clone",
+    response_model=ProjectResponse,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Project Methods"],
+)
+async def clone_project_endpoint(
+    project_id: int,
+    clone_request: Optional[CloneProjectRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    source = get_project_by_id_with_access(
+        db=db, project_id=project_id, user_id=current_user.id
+    )
+    if source is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Project with ID {project_id} not found",
+        )
+    name = clone_request.name if clone_request else None
+    clone, error_msg = await run_in_threadpool(
+        clone_project, db, source, current_user.id, name
+    )
+    if error_msg:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=error_msg
+        )
+    await run_in_threadpool(copy_project_logo, source, clone, db)
+    return clone
+
+
 # Update a project endpoint
 @router.put(
     "/project/{project_id}/info",
@@ -120,17 +201,22 @@ def delete_project(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    delete = delete_specific_project(db, project_id, current_user.id)
-    if is_only_participant(user_id=current_user.id, project_id=project_id, db=db):
+    project, role = get_project_with_role(project_id, current_user.id, db)
+    if role == "participant":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You are participant of this project, cannot delete",
         )
-    if delete is None:
+    if project is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Project with ID {project_id} not found",
         )
+    error_msg = remove_project(db, project)
+    if error_msg:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=error_msg
+        )
     return {"message": "You have successfully deleted project!"}
 
 
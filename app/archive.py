@@ -0,0 +1,308 @@
+import hashlib
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# objects fetched ahead of the one being written to an archive
+ARCHIVE_PREFETCH = int(os.getenv("ARCHIVE_PREFETCH", "4"))
+# prefetched objects up to this size are read into memory, larger ones
+# are only opened; bounds the memory of one archive download
+ARCHIVE_PREFETCH_MAX_BYTES = int(
+    os.getenv("ARCHIVE_PREFETCH_MAX_BYTES", str(8 * 1024 * 1024))
+)
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", "16"))
+# bytes read from storage per chunk of an archive
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+# sizes and CRC follow the data in a descriptor, names are UTF-8
+ZIP_FLAGS = 0x0008 | 0x0800
+
+archive_executor = ThreadPoolExecutor(
+    max_workers=ARCHIVE_WORKERS, thread_name_prefix="archive"
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+# One file of an archive; `version` changes whenever its content does
+class ArchiveEntry:
+    def __init__(self, name, size, modified, crc32=None, version=None, source=None):
+        self.name = name.replace("/", "_").replace("\\", "_")
+        self.size = size
+        self.modified = modified
+        self.crc32 = crc32
+        self.version = version
+        self.source = source
+
+
+class Segment:
+    def __init__(self, kind, offset, length, index=None):
+        self.kind = kind
+        self.offset = offset
+        self.length = length
+        self.index = index
+
+
+def dos_datetime(modified):
+    if modified is None or modified.year < 1980:
+        return 0, (1 << 5) | 1
+    time = (modified.hour << 11) | (modified.minute << 5) | (modified.second // 2)
+    date = ((modified.year - 1980) << 9) | (modified.month << 5) | modified.day
+    return time, date
+
+
+def local_header(entry: ArchiveEntry):
+    name = entry.name.encode()
+    time, date = dos_datetime(entry.modified)
+    if entry.size >= ZIP32_LIMIT:
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+        version, sizes = ZIP64_VERSION, ZIP32_LIMIT
+    else:
+        extra, version, sizes = b"", ZIP_VERSION, 0
+    header = struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034B50,
+        version,
+        ZIP_FLAGS,
+        0,
+        time,
+        date,
+        0,
+        sizes,
+        sizes,
+        len(name),
+        len(extra),
+    )
+    return header + name + extra
+
+
+def descriptor_length(entry: ArchiveEntry):
+    return 24 if entry.size >= ZIP32_LIMIT else 16
+
+
+def data_descriptor(entry: ArchiveEntry, crc: int):
+    if entry.size >= ZIP32_LIMIT:
+        return struct.pack("<IIQQ", 0x08074B50, crc, entry.size, entry.size)
+    return struct.pack("<IIII", 0x08074B50, crc, entry.size, entry.size)
+
+
+def central_header(entry: ArchiveEntry, crc: int, offset: int):
+    name = entry.name.encode()
+    time, date = dos_datetime(entry.modified)
+    zip64_fields = []
+    if entry.size >= ZIP32_LIMIT:
+        zip64_fields += [entry.size, entry.size]
+    if offset >= ZIP32_LIMIT:
+        zip64_fields.append(offset)
+    extra = b""
+    if zip64_fields:
+        extra = struct.pack(
+            f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields
+        )
+    header = struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014B50,
+        ZIP64_VERSION,
+        ZIP64_VERSION if zip64_fields else ZIP_VERSION,
+        ZIP_FLAGS,
+        0,
+        time,
+        date,
+        crc,
+        min(entry.size, ZIP32_LIMIT),
+        min(entry.size, ZIP32_LIMIT),
+        len(name),
+        len(extra),
+        0,
+        0,
+        0,
+        0,
+        min(offset, ZIP32_LIMIT),
+    )
+    return header + name + extra
+
+
+def end_records(count: int, directory_offset: int, directory_size: int):
+    records = b""
+    if (
+        count >= 0xFFFF
+        or directory_offset >= ZIP32_LIMIT
+        or directory_size >= ZIP32_LIMIT
+    ):
+        records += struct.pack(
+            "<IQHHIIQQQQ",
+            0x06064B50,
+            44,
+            ZIP64_VERSION,
+            ZIP64_VERSION,
+            0,
+            0,
+            count,
+            count,
+            directory_size,
+            directory_offset,
+        )
+        records += struct.pack(
+            "<IIQI", 0x07064B50, 0, directory_offset + directory_size, 1
+        )
+    records += struct.pack(
+        "<IHHHHIIH",
+        0x06054B50,
+        0,
+        0,
+        min(count, 0xFFFF),
+        min(count, 0xFFFF),
+        min(directory_size, ZIP32_LIMIT),
+        min(directory_offset, ZIP32_LIMIT),
+        0,
+    )
+    return records
+
+
+# Read part of an entry ahead of time, small parts straight into memory
+def prefetch(fetch, entry: ArchiveEntry, start: int, end: int):
+    body = fetch(entry, start, end)
+    if end - start + 1 > ARCHIVE_PREFETCH_MAX_BYTES:
+        return body
+    try:
+        return io.BytesIO(body.read())
+    finally:
+        body.close()
+
+
+def close_prefetched(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+# Uncompressed ZIP of entries whose sizes are known up front, so its length
+# and the offset of every byte are known before any content is read;
+# fetch(entry, start, end) opens the inclusive byte range of an entry
+class ZipArchive:
+    def __init__(self, entries: list, fetch):
+        self.entries = entries
+        self.fetch = fetch
+        self.segments = []
+        self.offsets = []
+        offset = 0
+        for index, entry in enumerate(entries):
+            self.offsets.append(offset)
+            for kind, length in (
+                ("header", len(local_header(entry))),
+                ("data", entry.size),
+                ("descriptor", descriptor_length(entry)),
+            ):
+                self.segments.append(Segment(kind, offset, length, index))
+                offset += length
+        self.directory_offset = offset
+        directory_length = sum(
+            len(central_header(entry, 0, entry_offset))
+            for entry, entry_offset in zip(entries, self.offsets)
+        )
+        directory_length += len(end_records(len(entries), offset, directory_length))
+        self.segments.append(Segment("directory", offset, directory_length))
+        self.size = offset + directory_length
+
+    # byte ranges can be served once every CRC is known without reading
+    # the content that comes before the range
+    @property
+    def resumable(self):
+        return all(entry.crc32 is not None for entry in self.entries)
+
+    @property
+    def etag(self):
+        key = repr(
+            [
+                (entry.name, entry.size, entry.crc32, entry.version)
+                for entry in self.entries
+            ]
+        )
+        return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+    def _render(self, segment: Segment, crcs: dict):
+        if segment.kind == "header":
+            return local_header(self.entries[segment.index])
+        if segment.kind == "descriptor":
+            return data_descriptor(self.entries[segment.index], crcs[segment.index])
+        directory = b"".join(
+            central_header(entry, crcs[index], self.offsets[index])
+            for index, entry in enumerate(self.entries)
+        )
+        return directory + end_records(
+            len(self.entries), self.directory_offset, len(directory)
+        )
+
+    # Bytes start to end (inclusive) of the archive; the next entries are
+    # fetched concurrently while the current one is written
+    def iter_range(self, start: int = 0, end: int = None):
+        end = self.size - 1 if end is None else end
+        crcs = {
+            index: 0 if entry.size == 0 else entry.crc32
+            for index, entry in enumerate(self.entries)
+        }
+        segments = [
+            segment
+            for segment in self.segments
+            if segment.length
+            and segment.offset <= end
+            and segment.offset + segment.length > start
+        ]
+        bounds = [
+            (
+                max(start, segment.offset) - segment.offset,
+                min(end, segment.offset + segment.length - 1) - segment.offset,
+            )
+            for segment in segments
+        ]
+        fetches = iter(
+            (self.entries[segment.index], lo, hi)
+            for segment, (lo, hi) in zip(segments, bounds)
+            if segment.kind == "data"
+        )
+        pending = deque()
+
+        def fetch_next():
+            part = next(fetches, None)
+            if part is not None:
+                pending.append(archive_executor.submit(prefetch, self.fetch, *part))
+
+        for _ in range(ARCHIVE_PREFETCH):
+            fetch_next()
+        try:
+            for segment, (lo, hi) in zip(segments, bounds):
+                if segment.kind != "data":
+                    stop = hi + 1
+                    yield self._render(segment, crcs)[lo:stop]
+                    continue
+                body = pending.popleft().result()
+                fetch_next()
+                crc, received = 0, 0
+                try:
+                    while True:
+                        chunk = body.read(ARCHIVE_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        crc = zlib.crc32(chunk, crc)
+                        received += len(chunk)
+                        yield chunk
+                finally:
+                    body.close()
+                if received != hi - lo + 1:
+                    raise ArchiveError(
+                        f"{self.entries[segment.index].name} changed while "
+                        "it was archived"
+                    )
+                if lo == 0 and hi == segment.length - 1:
+                    crcs[segment.index] = crc
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    future.add_done_callback(close_prefetched)
@@ -3,27 +3,35 @@ import os
 from fastapi import Depends, HTTPException, status, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
 
-from app.database import get_db
+from app.auth.cache import principal_cache
+from app.auth.hashing import (
+    hash_password_sync,
+    password_executor,
+    pwd_context,
+    verify_password_sync,
+)
+from app.database import get_db, use_primary
 from app.models import User
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 
 async def hash_pass(password: str):
-    return pwd_context.hash(password)
+    return await password_executor.run(hash_password_sync, password)
 
 
 # verify password
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str):
+    return await password_executor.run(
+        verify_password_sync, plain_password, hashed_password
+    )
 
 
 # create token
@@ -34,9 +42,20 @@ async def create_access_token(email: str):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# Rebuild a cached principal as a User attached to the request session;
+# only the id and email are cached, other columns load on first access
+def _principal_to_user(principal: dict, db: Session):
+    user = User(**principal)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
 ):
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return _principal_to_user(principal, db)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -52,11 +71,19 @@ async def get_current_user(
                 detail="Invalid or expired token",
             )
         user = db.query(User).filter(User.email == email).first()
+        # a replica may not have caught up with a freshly created user yet
+        if user is None and use_primary(db):
+            user = db.query(User).filter(User.email == email).first()
         if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or expired token",
             )
+        principal_cache.set(
+            token,
+            {"id": user.id, "email": user.email},
+            token_exp=expire,
+        )
         return user
     except JWTError:
         raise HTTPException(
@@ -65,10 +92,17 @@ async def get_current_user(
         )
 
 
+# Changed or removed users must re-authenticate against the database
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_principal(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+
 async def authenticate(db: Session, email: str, password: str):
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user:
         return False
-    if not verify_password(password, db_user.hashed_password):
+    if not await verify_password(password, db_user.hashed_password):
         return None
     return db_user
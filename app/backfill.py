@@ -0,0 +1,52 @@
+# Extract the text of every document that has none of its current version,
+# with the same batches as the background extractor, and print the
+# throughput; for documents uploaded before extraction existed or while it
+# was down:
+#
+#     python -m app.backfill [--batch-size 50] [--retry-failed]
+
+import argparse
+import json
+import logging
+
+from sqlalchemy import delete
+
+from app.crud.document_texts import EXTRACTION_BATCH_SIZE, extract_document_batch
+from app.database import SessionLocal
+from app.extraction import extraction_metrics, extraction_pool
+from app.models import DocumentText
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=EXTRACTION_BATCH_SIZE)
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="extract documents again whose extraction failed",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with SessionLocal() as db:
+        if args.retry_failed:
+            db.execute(delete(DocumentText).where(DocumentText.status == "failed"))
+            db.commit()
+        try:
+            while True:
+                count = extract_document_batch(db, args.batch_size)
+                stats = extraction_metrics.stats()
+                print(
+                    f"{stats['documents']} documents, {stats['failed']} failed, "
+                    f"{stats['docs_per_second']} docs/s, "
+                    f"{stats['mb_per_second']} MB/s"
+                )
+                if count < args.batch_size:
+                    break
+        finally:
+            extraction_pool.shutdown()
+    print(json.dumps(extraction_metrics.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+from datetime import timedelta
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.orm import Session
+from typing_extensions import List
+import hashlib
+import os
+import zlib
+
+from app.database import dialect_insert
+from app.models import Blob, utcnow
+
+# "path" stores every upload under {project_id}/{filename}, "content"
+# stores identical bytes once under their sha256
+DOCUMENT_STORAGE_MODE = os.getenv("DOCUMENT_STORAGE_MODE", "path")
+# unreferenced blobs are kept this long before they are collected, in seconds
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+BLOB_GC_BATCH_SIZE = int(os.getenv("BLOB_GC_BATCH_SIZE", "100"))
+
+
+def content_addressed_storage():
+    return DOCUMENT_STORAGE_MODE == "content"
+
+
+def blob_key(digest: str):
+    return f"blobs/{digest[:2]}/{digest}"
+
+
+# Wraps a file object, hashing everything read from or written through it;
+# the CRC-32 is what ZIP archives of the document record
+class HashingFile:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.crc32 = 0
+        self.size = 0
+
+    def _update(self, data):
+        self.hash.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.size += len(data)
+
+    def read(self, size: int = -1):
+        data = self.fileobj.read(size)
+        self._update(data)
+        return data
+
+    def write(self, data):
+        self._update(data)
+        return self.fileobj.write(data)
+
+    @property
+    def digest(self):
+        return self.hash.hexdigest()
+
+
+# Take a reference on a blob, creating its row on first use; returns
+# whether its object is already in the bucket and its ETag. The row lock
+# of the upsert also waits for a collection of the same blob to finish.
+def acquire_blob(db: Session, digest: str, size: int):
+    insert = dialect_insert(db)
+    if insert is not None:
+        statement = insert(Blob).values(
+            digest=digest, size=size, refcount=1, stored=False
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[Blob.digest],
+            set_={"refcount": Blob.refcount + 1, "unreferenced_at": None},
+        ).returning(Blob.stored, Blob.etag)
+        stored, etag = db.execute(statement).one()
+        return stored, etag
+
+    blob = db.get(Blob, digest, with_for_update=True)
+    if blob is None:
+        db.add(Blob(digest=digest, size=size, refcount=1, stored=False))
+        db.flush()
+        return False, None
+    blob.refcount += 1
+    blob.unreferenced_at = None
+    db.flush()
+    return blob.stored, blob.etag
+
+
+def mark_blob_stored(db: Session, digest: str, etag: str):
+    db.execute(update(Blob).where(Blob.digest == digest).values(stored=True, etag=etag))
+
+
+# Drop `count` references of a blob, stamping it for collection at zero
+def release_blob_statement(digest: str, count: int = 1):
+    return (
+        update(Blob)
+        .where(Blob.digest == digest)
+        .values(
+            refcount=Blob.refcount - count,
+            unreferenced_at=case(
+                (Blob.refcount - count <= 0, utcnow()), else_=Blob.unreferenced_at
+            ),
+        )
+    )
+
+
+# Take another reference on blobs in use, for copies of their documents
+def retain_blobs(db: Session, digests: List[str]):
+    counts = {}
+    for digest in digests:
+        counts[digest] = counts.get(digest, 0) + 1
+    for digest, count in counts.items():
+        db.execute(
+            update(Blob)
+            .where(Blob.digest == digest)
+            .values(refcount=Blob.refcount + count, unreferenced_at=None)
+        )
+
+
+def release_blobs(db: Session, digests: List[str]):
+    counts = {}
+    for digest in digests:
+        counts[digest] = counts.get(digest, 0) + 1
+    for digest, count in counts.items():
+        db.execute(release_blob_statement(digest, count))
+
+
+# Lock a batch of blobs nobody referenced for the grace period; the locks
+# are held until the caller deleted their objects and rows
+def lock_collectable_blobs(db: Session):
+    cutoff = utcnow() - timedelta(seconds=BLOB_GC_GRACE_SECONDS)
+    statement = (
+        select(Blob.digest)
+        .where(Blob.refcount <= 0, Blob.unreferenced_at <= cutoff)
+        .order_by(Blob.unreferenced_at)
+        .limit(BLOB_GC_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    )
+    return db.scalars(statement).all()
+
+
+def delete_blob_rows(db: Session, digests: List[str]):
+    db.execute(delete(Blob).where(Blob.digest.in_(digests), Blob.refcount <= 0))
@@ -0,0 +1,236 @@
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import os
+import tempfile
+import time
+
+from app.crud import documents
+from app.database import dialect_insert
+from app.extraction import (
+    EXTRACTION_MAX_BYTES,
+    EXTRACTION_WORKERS,
+    EXTRACTORS,
+    ExtractionError,
+    extraction_metrics,
+    extraction_pool,
+)
+from app.models import Document, DocumentText, utcnow
+from app.storage import StorageError
+
+# documents extracted per batch, one transaction each
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "20"))
+# where documents are downloaded to for extraction, the system default if unset
+EXTRACTION_SPOOL_DIR = os.getenv("EXTRACTION_SPOOL_DIR") or None
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# a batch whose process died is extracted again once its claims run out
+EXTRACTION_LEASE_SECONDS = float(os.getenv("EXTRACTION_LEASE_SECONDS", "600"))
+
+# downloads documents and waits on the extraction processes, so downloads
+# overlap with extraction
+extraction_executor = ThreadPoolExecutor(
+    max_workers=max(EXTRACTION_WORKERS, 1), thread_name_prefix="extraction"
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Documents without text of their current version and not claimed by
+# another process, oldest first; a failed extraction is retried once the
+# document gets a new version
+def stale_documents(db: Session, limit: int = EXTRACTION_BATCH_SIZE):
+    return db.scalars(
+        select(Document)
+        .outerjoin(DocumentText, DocumentText.document_id == Document.id)
+        .filter(
+            or_(
+                DocumentText.document_id.is_(None),
+                and_(
+                    or_(
+                        DocumentText.version != Document.version,
+                        DocumentText.status == "pending",
+                    ),
+                    or_(
+                        DocumentText.locked_until.is_(None),
+                        DocumentText.locked_until < utcnow(),
+                    ),
+                ),
+            ),
+            or_(
+                *(Document.filename.ilike(f"%.{extension}") for extension in EXTRACTORS)
+            ),
+        )
+        .order_by(Document.id)
+        .limit(limit)
+    ).all()
+
+
+# Claim stale documents for this process with a lease, returns the ids it
+# got; a document claimed by another process meanwhile is left to it. The
+# text row of an earlier version keeps its content until it is replaced
+def claim_documents(db: Session, documents: list):
+    now = utcnow()
+    locked_until = now + timedelta(seconds=EXTRACTION_LEASE_SECONDS)
+    statement = dialect_insert(db)(DocumentText).values(
+        [
+            {
+                "document_id": document.id,
+                "version": document.version,
+                "status": "pending",
+                "extracted_at": now,
+                "locked_until": locked_until,
+            }
+            for document in documents
+        ]
+    )
+    claimed = db.scalars(
+        statement.on_conflict_do_update(
+            index_elements=[DocumentText.document_id],
+            set_={"locked_until": locked_until},
+            where=or_(
+                DocumentText.locked_until.is_(None),
+                DocumentText.locked_until < now,
+            ),
+        ).returning(DocumentText.document_id)
+    ).all()
+    db.commit()
+    return set(claimed)
+
+
+# Copy a document body to the spool file, stops once it is too large to
+# extract; returns the bytes copied
+def spool_document(body, spool):
+    size = 0
+    while size <= EXTRACTION_MAX_BYTES:
+        chunk = body.read(SPOOL_CHUNK_SIZE)
+        if not chunk:
+            break
+        spool.write(chunk)
+        size += len(chunk)
+    spool.flush()
+    return size
+
+
+# Download a document to a spool file and extract its text, returns its
+# status, text, error and size
+def extract_document_text(s3_key: str, filename: str, size: int = None):
+    if size is not None and size > EXTRACTION_MAX_BYTES:
+        return "skipped", None, "Document is too large to extract", 0
+    response, error = documents.open_document_object(s3_key)
+    if error:
+        return "failed", None, error, 0
+    suffix = "." + filename.rsplit(".", 1)[-1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=EXTRACTION_SPOOL_DIR) as spool:
+        try:
+            size = spool_document(response["Body"], spool)
+        except (StorageError, OSError) as e:
+            return "failed", None, f"Failed to download document: {e}", 0
+        finally:
+            response["Body"].close()
+        if size > EXTRACTION_MAX_BYTES:
+            return "skipped", None, "Document is too large to extract", 0
+        try:
+            text = extraction_pool.extract(spool.name, filename)
+            if not text:
+                # scanned pages and the like, nothing to search
+                return "skipped", None, "Document has no text", size
+            return "indexed", text, None, size
+        except ExtractionError as e:
+            return "failed", None, str(e), size
+        except Exception as e:
+            logger.warning("Extracting %s failed: %s", filename, e)
+            return "failed", None, f"Failed to extract text: {e}", size
+
+
+# Store extracted texts; a text never replaces one of a newer version
+def store_document_texts(db: Session, rows: list):
+    existing = set(
+        db.scalars(
+            select(Document.id).filter(
+                Document.id.in_([row["document_id"] for row in rows])
+            )
+        )
+    )
+    rows = [row for row in rows if row["document_id"] in existing]
+    if not rows:
+        return
+    statement = dialect_insert(db)(DocumentText).values(rows)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[DocumentText.document_id],
+            set_={
+                column: statement.excluded[column]
+                for column in (
+                    "version",
+                    "status",
+                    "content",
+                    "error",
+                    "extracted_at",
+                    "locked_until",
+                )
+            },
+            where=DocumentText.version <= statement.excluded.version,
+        )
+    )
+    db.commit()
+
+
+# Extract the text of one batch of stale documents, returns how many were
+# extracted
+def extract_document_batch(db: Session, limit: int = EXTRACTION_BATCH_SIZE):
+    candidates = stale_documents(db, limit)
+    if not candidates:
+        db.commit()
+        return 0
+    stale = [
+        (
+            document.id,
+            document.version,
+            documents.document_s3_key(document),
+            document.filename,
+            document.size,
+        )
+        for document in candidates
+    ]
+    # only the claims are held while the batch downloads and extracts
+    claimed = claim_documents(db, candidates)
+    stale = [item for item in stale if item[0] in claimed]
+    if not stale:
+        return 0
+    started = time.monotonic()
+    results = extraction_executor.map(
+        lambda item: extract_document_text(*item[2:]), stale
+    )
+    rows, failed, total_size = [], 0, 0
+    for (document_id, version, *_), (status, content, error, size) in zip(
+        stale, results
+    ):
+        rows.append(
+            {
+                "document_id": document_id,
+                "version": version,
+                "status": status,
+                "content": content,
+                "error": error,
+                "extracted_at": utcnow(),
+                "locked_until": None,
+            }
+        )
+        failed += status == "failed"
+        total_size += size
+    store_document_texts(db, rows)
+    extraction_metrics.record(len(rows), failed, total_size, started)
+    return len(rows)
+
+
+# Extract every stale document, batch by batch, returns how many were
+# extracted
+def extract_pending_documents(db: Session, batch_size: int = EXTRACTION_BATCH_SIZE):
+    extracted = 0
+    while True:
+        count = extract_document_batch(db, batch_size)
+        extracted += count
+        if count < batch_size:
+            return extracted
@@ -1,66 +1,396 @@
-from fastapi import HTTPException, UploadFile
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, exists, insert, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing_extensions import List
-import boto3
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from jose import JWTError, jwt
+import asyncio
+import logging
+import mimetypes
 import os
 
-from app.models import Document, Project, ProjectParticipant
-from app.crud.project import get_project_by_id_with_access
+from app.archive import ArchiveEntry, ZipArchive, archive_executor
+from app.crud.blobs import (
+    HashingFile,
+    acquire_blob,
+    blob_key,
+    delete_blob_rows,
+    lock_collectable_blobs,
+    mark_blob_stored,
+    release_blob_statement,
+    release_blobs,
+    retain_blobs,
+)
+from app.auth.jwt_handler import ALGORITHM, SECRET_KEY
+from app.database import async_equivalent, dialect_insert
+from app.models import (
+    Document,
+    DocumentVersion,
+    FilenameCounter,
+    Project,
+    ProjectParticipant,
+    utcnow,
+)
+from app.storage import InvalidRange, ObjectNotFound, StorageError, build_storage
+from app.crud.project import (
+    get_project_by_id_with_access,
+    get_project_by_id_with_access_async,
+    project_access_filter,
+    project_role,
+)
 
 ALLOWED_EXTENSIONS = {"docx", "pdf"}
 
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_DEFAULT_REGION"),
+# parallel S3 transfers per upload worker
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
+# multipart upload part size, S3 requires at least 5 MiB
+UPLOAD_PART_SIZE = max(
+    int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024
+)
+
+# "proxy" streams transfers through the app, "presigned" hands out S3 URLs
+DOCUMENT_TRANSFER_MODE = os.getenv("DOCUMENT_TRANSFER_MODE", "proxy")
+# lifetime of presigned S3 URLs, in seconds
+PRESIGNED_URL_EXPIRES = int(os.getenv("PRESIGNED_URL_EXPIRES", "300"))
+# how long a presigned upload can be committed, in seconds
+PRESIGNED_COMMIT_EXPIRES = int(os.getenv("PRESIGNED_COMMIT_EXPIRES", "3600"))
+
+# earlier versions of documents are kept this long after an update, in days
+DOCUMENT_VERSION_RETENTION_DAYS = float(
+    os.getenv("DOCUMENT_VERSION_RETENTION_DAYS", "30")
+)
+DOCUMENT_VERSION_PURGE_BATCH_SIZE = int(
+    os.getenv("DOCUMENT_VERSION_PURGE_BATCH_SIZE", "500")
 )
 
+logger = logging.getLogger(__name__)
+
+upload_executor = ThreadPoolExecutor(
+    max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="s3-upload"
+)
+
+storage = build_storage(os.getenv("AWS_S3_BUCKET_NAME"), "documents")
+
 
 def allowed_document_extension(document):
     return "." in document and document.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-# Upload document/documents
-async def upload_docs(db: Session, project_id: int, files: List[UploadFile]):
-    uploaded_files = []
+# Content type stored with the object, served back on download
+def document_content_type(filename: str):
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+# Claim a name in a project, returns 0 for the first claim and the number
+# of earlier claims otherwise; concurrent claims of a name are serialized
+# by the row lock of the upsert
+def claim_filename(db: Session, project_id: int, filename: str):
+    insert = dialect_insert(db)
+    if insert is not None:
+        statement = insert(FilenameCounter).values(
+            project_id=project_id, filename=filename, last_suffix=0
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[FilenameCounter.project_id, FilenameCounter.filename],
+            set_={"last_suffix": FilenameCounter.last_suffix + 1},
+        ).returning(FilenameCounter.last_suffix)
+        return db.execute(statement).scalar_one()
+
+    counter = db.get(FilenameCounter, (project_id, filename), with_for_update=True)
+    if counter is None:
+        db.add(FilenameCounter(project_id=project_id, filename=filename, last_suffix=0))
+        db.flush()
+        return 0
+    counter.last_suffix += 1
+    db.flush()
+    return counter.last_suffix
+
+
+def suffixed_filename(filename: str, suffix: int):
+    name, ext = os.path.splitext(filename)
+    return f"{name}({suffix}){ext}"
+
+
+# Pick a free name for an uploaded file, e.g. report(1).pdf; generated names
+# are claimed too, so they never collide with a later upload of that name
+def allocate_filename(db: Session, project_id: int, filename: str):
+    suffix = claim_filename(db, project_id, filename)
+    while True:
+        candidate = filename if suffix == 0 else suffixed_filename(filename, suffix)
+        if suffix == 0 or claim_filename(db, project_id, candidate) == 0:
+            # documents saved before names were claimed have no claim row
+            taken = db.query(
+                exists().where(
+                    Document.project_id == project_id, Document.filename == candidate
+                )
+            ).scalar()
+            if not taken:
+                return candidate
+        suffix = claim_filename(db, project_id, filename)
+
 
-    existing_files = (
-        db.query(Document.filename).filter(Document.project_id == project_id).all()
+# Pick a free name for each uploaded file; claims are committed right away
+# so concurrent uploads of the same name do not wait on each other
+def allocate_filenames(db: Session, project_id: int, filenames: List[str]):
+    allocated = [allocate_filename(db, project_id, filename) for filename in filenames]
+    db.commit()
+    return allocated
+
+
+# Free the name of a deleted document for new uploads
+def release_filename_statement(project_id: int, filename: str):
+    return delete(FilenameCounter).where(
+        FilenameCounter.project_id == project_id,
+        FilenameCounter.filename == filename,
+    )
+
+
+# Public URL of an object in the documents bucket
+def document_file_url(s3_key: str):
+    return (
+        f"https://{os.getenv('AWS_S3_BUCKET_NAME')}."
+        f"s3.{os.getenv('AWS_DEFAULT_REGION')}.amazonaws.com/{s3_key}"
     )
-    existing_filenames = {file[0] for file in existing_files}
+
+
+# Bucket key of a document, its blob for content-addressed documents
+def document_s3_key(document: Document):
+    if document.blob_digest is not None:
+        return blob_key(document.blob_digest)
+    return f"{document.project_id}/{document.file_url.split('/')[-1]}"
+
+
+# Stream one file to the documents bucket in parts, returns its URL and
+# ETag; at most one part of the file is held in memory at a time
+def put_document_object(s3_key: str, fileobj, content_type: str = None):
+    etag = storage.put(
+        s3_key,
+        fileobj,
+        content_type or document_content_type(s3_key),
+        UPLOAD_PART_SIZE,
+    )
+    return document_file_url(s3_key), etag
+
+
+# Delete objects uploaded for documents that were never saved, failures are
+# only logged
+def discard_document_objects(keys: List[str]):
+    for key, error in storage.delete_many(keys).items():
+        logger.warning("Unsaved document object %s not deleted: %s", key, error)
+
+
+# Store a file whose digest is known as a blob, returns its URL and ETag;
+# only the first copy of some content is sent to the bucket
+def store_document_blob(
+    db: Session, fileobj, digest: str, size: int, content_type: str = None
+):
+    stored, etag = acquire_blob(db, digest, size)
+    db.commit()
+    if not stored:
+        try:
+            _, etag = put_document_object(blob_key(digest), fileobj, content_type)
+        except Exception:
+            db.execute(release_blob_statement(digest))
+            db.commit()
+            raise
+        mark_blob_stored(db, digest, etag)
+        db.commit()
+    return document_file_url(blob_key(digest)), etag
+
+
+# Delete the objects of blobs nobody referenced for the grace period,
+# returns how many were collected
+def collect_unreferenced_blobs(db: Session):
+    digests = lock_collectable_blobs(db)
+    for digest in digests:
+        storage.delete(blob_key(digest))
+    delete_blob_rows(db, digests)
+    db.commit()
+    return len(digests)
+
+
+# Object metadata straight from storage, for documents saved before it was stored
+def head_project_document(document: Document):
+    return storage.head(document_s3_key(document))
+
+
+# Presigned mode needs a backend that can sign URLs, such as S3
+def presigned_transfers_enabled(backend=None):
+    backend = backend or storage
+    return DOCUMENT_TRANSFER_MODE == "presigned" and backend.supports_presigned_urls
+
+
+def presign_document_download(document: Document):
+    return storage.presign_download(
+        document_s3_key(document), document.filename, PRESIGNED_URL_EXPIRES
+    )
+
+
+# Upload URLs for files the client sends straight to S3: one PUT URL for
+# files that fit in a part, a multipart upload with a URL per part otherwise
+def presign_document_uploads(db: Session, project_id: int, user_id: int, files: list):
+    stored_names = allocate_filenames(db, project_id, [file.filename for file in files])
+
+    uploads = []
+    for file, filename in zip(files, stored_names):
+        s3_key = f"{project_id}/{filename}"
+        content_type = document_content_type(filename)
+        upload = {"filename": file.filename, "stored_as": filename}
+        if file.size <= UPLOAD_PART_SIZE:
+            upload["url"] = storage.presign_upload(
+                s3_key, content_type, PRESIGNED_URL_EXPIRES
+            )
+        else:
+            upload_id = storage.create_multipart_upload(s3_key, content_type)
+            part_count = -(-file.size // UPLOAD_PART_SIZE)
+            upload.update(
+                upload_id=upload_id,
+                part_size=UPLOAD_PART_SIZE,
+                part_urls=[
+                    storage.presign_upload_part(
+                        s3_key, upload_id, part_number, PRESIGNED_URL_EXPIRES
+                    )
+                    for part_number in range(1, part_count + 1)
+                ],
+            )
+        upload["upload_token"] = upload_token(
+            project_id, user_id, filename, upload.get("upload_id")
+        )
+        uploads.append(upload)
+    return uploads
+
+
+# Signed proof that a name was allocated to a user in a project, handed
+# out with the presigned URLs and required to commit the upload
+def upload_token(project_id: int, user_id: int, stored_as: str, upload_id: str):
+    claims = {
+        "sub": "presigned-upload",
+        "project_id": project_id,
+        "user_id": user_id,
+        "stored_as": stored_as,
+        "upload_id": upload_id,
+        "exp": datetime.utcnow() + timedelta(seconds=PRESIGNED_COMMIT_EXPIRES),
+    }
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+# Check a committed file against its upload token; expired or forged
+# tokens and names allocated elsewhere are refused
+def valid_upload_token(project_id: int, user_id: int, file):
     try:
-        for file in files:
-            original_filename = file[0]
-            filename = original_filename
-
-            counter = 1
-            while filename in existing_filenames:
-                name, ext = os.path.splitext(original_filename)
-                filename = f"{name}({counter}){ext}"
-                counter += 1
-
-            existing_filenames.add(filename)
-            content = file[1]
-            s3_key = f"{project_id}/{filename}"
-            s3.put_object(
-                Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key=s3_key, Body=content
+        claims = jwt.decode(file.upload_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return (
+        claims.get("sub") == "presigned-upload"
+        and claims.get("project_id") == project_id
+        and claims.get("user_id") == user_id
+        and claims.get("stored_as") == file.stored_as
+        and claims.get("upload_id") == file.upload_id
+    )
+
+
+# Make sure a client-side upload landed in the bucket, completing it
+# first when it was sent in parts; returns its URL and object metadata
+def finish_presigned_upload(s3_key: str, upload_id: str = None, parts: list = None):
+    if upload_id:
+        storage.complete_multipart_upload(
+            s3_key,
+            upload_id,
+            [
+                {"PartNumber": part.part_number, "ETag": part.etag}
+                for part in sorted(parts or [], key=lambda p: p.part_number)
+            ],
+        )
+    head = storage.head(s3_key)
+    return document_file_url(s3_key), head
+
+
+# Create document rows for files uploaded with presigned URLs,
+# returns a success or failure result per file
+async def commit_presigned_uploads(
+    db: Session, project_id: int, user_id: int, files: list
+):
+    # uploads are only completed for names allocated to this user
+    valid = [valid_upload_token(project_id, user_id, file) for file in files]
+    existing_filenames = {
+        filename
+        for (filename,) in db.query(Document.filename).filter(
+            Document.project_id == project_id,
+            Document.filename.in_([file.stored_as for file in files]),
+        )
+    }
+
+    loop = asyncio.get_running_loop()
+    checks = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                upload_executor,
+                finish_presigned_upload,
+                f"{project_id}/{file.stored_as}",
+                file.upload_id,
+                file.parts,
             )
-            file_url = (
-                f"https://{os.getenv('AWS_S3_BUCKET_NAME')}."
-                f"s3.{os.getenv('AWS_DEFAULT_REGION')}.amazonaws.com/{s3_key}"
+            for file, is_valid in zip(files, valid)
+            if is_valid
+        ),
+        return_exceptions=True,
+    )
+    checks = iter(checks)
+
+    results = []
+    documents = []
+    for file, is_valid in zip(files, valid):
+        result = {"stored_as": file.stored_as}
+        if not is_valid:
+            result.update(status="failed", error="Invalid upload token")
+            results.append(result)
+            continue
+        check = next(checks)
+        if file.stored_as in existing_filenames:
+            result.update(status="failed", error="Document already exists")
+        elif isinstance(check, ObjectNotFound):
+            result.update(status="failed", error="Upload not found in storage")
+        elif isinstance(check, Exception):
+            logger.error(
+                "Commit of %s to project %s failed: %s",
+                file.stored_as,
+                project_id,
+                check,
             )
-            document = Document(
-                project_id=project_id, file_url=file_url, filename=filename
+            result.update(status="failed", error=str(check))
+        else:
+            existing_filenames.add(file.stored_as)
+            file_url, head = check
+            documents.append(
+                Document(
+                    project_id=project_id,
+                    file_url=file_url,
+                    filename=file.stored_as,
+                    size=head["ContentLength"],
+                    content_type=head.get("ContentType"),
+                    etag=head["ETag"],
+                )
             )
-            db.add(document)
-            uploaded_files.append(file_url)
+            result.update(status="uploaded")
+        results.append(result)
+
+    try:
+        db.add_all(documents)
         db.commit()
-    except Exception as e:
-        print(f"Error during file upload: {e}")
+    except SQLAlchemyError as e:
+        logger.error(
+            "Saving committed documents of project %s failed: %s", project_id, e
+        )
         db.rollback()
-    return {"message": "Files uploaded successfully"}
+        for result in results:
+            if result["status"] == "uploaded":
+                result.update(status="failed", error="Failed to save document")
+    return results
 
 
 # Get one specified document
@@ -69,77 +399,681 @@ def get_document(document_id: int, db: Session):
     return document
 
 
-# Check if user has access to document
-def has_access_to_document(document_id: int, user_id: int, db: Session):
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document:
-        return False
-    # check if the user is the owner of the project
-    if document.project.owner_id == user_id:
-        return True
-    # check if the user is a participant in the project
-    project_participant = (
-        db.query(ProjectParticipant)
-        .filter(
-            ProjectParticipant.project_id == document.project_id,
-            ProjectParticipant.user_id == user_id,
-        )
+# Get document with the caller's role in its project in a single query,
+# (None, None) when the document is missing or not accessible
+def get_document_with_role(document_id: int, user_id: int, db: Session):
+    row = (
+        db.query(Document, project_role(user_id))
+        .join(Project, Document.project_id == Project.project_id)
+        .filter(Document.id == document_id, project_access_filter(user_id))
         .first()
     )
-    if project_participant:
-        return True
-    return False
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+# Get document if the user has access to it
+def get_document_with_access(document_id: int, user_id: int, db: Session):
+    document, _ = get_document_with_role(document_id, user_id, db)
+    return document
+
+
+# Check if user has access to document
+def has_access_to_document(document_id: int, user_id: int, db: Session):
+    return get_document_with_access(document_id, user_id, db) is not None
+
+
+# Columns documents can be listed by, id breaks ties
+DOCUMENT_SORT_COLUMNS = {"id": Document.id, "filename": Document.filename}
+
+
+# One page of a project's documents ordered by `sort`, after the (value, id)
+# of the last document of the previous page
+def project_documents_statement(
+    project_id: int, sort: str = "id", after: tuple = None, limit: int = None
+):
+    sort_column = DOCUMENT_SORT_COLUMNS[sort]
+    statement = select(Document).filter(Document.project_id == project_id)
+    if sort == "id":
+        statement = statement.order_by(Document.id)
+        if after is not None:
+            statement = statement.filter(Document.id > after[1])
+    else:
+        statement = statement.order_by(sort_column, Document.id)
+        if after is not None:
+            statement = statement.filter(
+                tuple_(sort_column, Document.id) > tuple_(*after)
+            )
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
 
 
 # Get all documents from one project
-async def get_project_documents(project_id: int, user_id: int, db: Session):
+async def get_project_documents(
+    project_id: int,
+    user_id: int,
+    db: Session,
+    sort: str = "id",
+    after: tuple = None,
+    limit: int = None,
+):
     project = get_project_by_id_with_access(project_id, user_id, db)
-    if project.project_id == project_id:
-        documents = db.query(Document).filter(Document.project_id == project_id).all()
-        return documents
-    return None
+    if project is None:
+        return None
+    statement = project_documents_statement(project_id, sort, after, limit)
+    return db.scalars(statement).all()
 
 
-# Download document from bucket
-def download_project_document(document: Document):
+# Open an object for streaming, optionally only a byte range
+def open_document_object(s3_key: str, byte_range: str = None):
     try:
-        s3_key = f"{document.project_id}/{document.file_url.split('/')[-1]}"
-        response = s3.get_object(Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key=s3_key)
-        document_content = response["Body"].read()
-        return document_content, None
-    except ClientError as e:
-        error_message = f"Failed to download document: {e.response['Error']['Message']}"
+        response = storage.get(s3_key, byte_range)
+        return response, None
+    except InvalidRange:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+        )
+    except StorageError as e:
+        error_message = f"Failed to download document: {e}"
         return None, error_message
 
 
-# Update document from bucket
-async def update_project_document(document: Document, file: UploadFile):
+# Open document from bucket for streaming, optionally only a byte range
+def download_project_document(document: Document, byte_range: str = None):
+    return open_document_object(document_s3_key(document), byte_range)
+
+
+# Open an inclusive byte range of a document for a project archive; whole
+# documents are read without a range so they can fill the storage cache
+def open_archive_document(entry: ArchiveEntry, start: int, end: int):
+    byte_range = None
+    if start != 0 or end != entry.size - 1:
+        byte_range = f"bytes={start}-{end}"
+    return storage.get(document_s3_key(entry.source), byte_range)["Body"]
+
+
+def head_archive_document(document: Document):
     try:
-        s3_key = f"{document.project_id}/{file.filename}"
-        try:
-            s3.head_object(Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key=s3_key)
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "404":
-                return f"File not found in S3: {s3_key}"
+        return head_project_document(document)
+    except StorageError as e:
+        logger.warning("Leaving document %s out of archive: %s", document.id, e)
+        return None
+
 
-        # upload updated file
-        s3.put_object(
-            Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key=s3_key, Body=file.file
+# ZIP of every document of a project, None without access; documents saved
+# before their size was recorded are looked up in storage first
+def project_archive(project_id: int, user_id: int, db: Session):
+    project = get_project_by_id_with_access(project_id, user_id, db)
+    if project is None:
+        return None
+    documents = db.scalars(project_documents_statement(project_id)).all()
+    unsized = [document for document in documents if document.size is None]
+    heads = dict(zip(unsized, archive_executor.map(head_archive_document, unsized)))
+
+    entries = []
+    for document in documents:
+        size = document.size
+        if size is None:
+            if heads[document] is None:
+                continue
+            size = heads[document]["ContentLength"]
+        entries.append(
+            ArchiveEntry(
+                document.filename,
+                size,
+                document.updated_at,
+                document.crc32,
+                (document.etag, document.updated_at),
+                document,
+            )
         )
-        return {"message": "File content updated successfully"}
+    return ZipArchive(entries, open_archive_document)
+
+
+# Whether an If-Match header names the current ETag of a document
+def etag_matches(if_match: str, etag: str):
+    if if_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_match.split(",")]
+    return etag is not None and etag in tags
 
-    except ClientError as e:
+
+# Lock a document for an update of its content; the update is refused when
+# it was made against content that has been replaced since
+def lock_document_for_update(db: Session, document: Document, if_match: str = None):
+    db.refresh(document, with_for_update=True)
+    if if_match is None:
+        return
+    etag = document.etag
+    if etag is None and document.blob_digest is None:
+        # documents saved before metadata was stored
+        try:
+            etag = head_project_document(document)["ETag"]
+        except ObjectNotFound:
+            pass
+    if not etag_matches(if_match, etag):
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Document was changed since it was read",
+        )
+
+
+def document_version_key(document_id: int, version: int):
+    return f"versions/{document_id}/{version}"
+
+
+# Bucket key of a version, the blob it kept for content-addressed documents
+def version_s3_key(version: DocumentVersion):
+    if version.blob_digest is not None:
+        return blob_key(version.blob_digest)
+    return document_version_key(version.document_id, version.version)
+
+
+# Keep the current content of a document as a version before it is
+# replaced: objects are copied aside inside storage, blobs keep the
+# reference the document held
+def archive_document_version(db: Session, document: Document):
+    if document.blob_digest is not None:
+        s3_key, etag = blob_key(document.blob_digest), document.etag
+    else:
+        s3_key = document_version_key(document.id, document.version)
+        try:
+            etag = storage.copy(document_s3_key(document), s3_key, document.size)
+        except ObjectNotFound:
+            # nothing was stored to keep
+            return None
+    version = DocumentVersion(
+        document_id=document.id,
+        version=document.version,
+        file_url=document_file_url(s3_key),
+        blob_digest=document.blob_digest,
+        size=document.size,
+        content_type=document.content_type,
+        checksum=document.checksum,
+        crc32=document.crc32,
+        etag=etag,
+        created_at=document.updated_at,
+    )
+    db.add(version)
+    return version
+
+
+# Point a content-addressed document at the blob of its new content; the
+# content is stored before the document is locked, so a refused update
+# only gives its blob reference back
+def replace_document_blob(
+    document: Document, file: UploadFile, db: Session, if_match: str = None
+):
+    hashing = HashingFile(file.file)
+    while hashing.read(UPLOAD_PART_SIZE):
+        pass
+    file.file.seek(0)
+    file_url, etag = store_document_blob(
+        db,
+        file.file,
+        hashing.digest,
+        hashing.size,
+        document_content_type(document.filename),
+    )
+    try:
+        lock_document_for_update(db, document, if_match)
+    except HTTPException:
+        db.execute(release_blob_statement(hashing.digest))
+        db.commit()
+        raise
+    archive_document_version(db, document)
+    document.blob_digest = hashing.digest
+    document.file_url = file_url
+    return hashing, etag
+
+
+# Overwrite the object of a document, hashing the new content on the way;
+# the document stays locked until the update commits, so concurrent
+# updates are applied one after the other
+def replace_document_object(
+    document: Document, file: UploadFile, db: Session, if_match: str = None
+):
+    lock_document_for_update(db, document, if_match)
+    version = archive_document_version(db, document)
+    hashing = HashingFile(file.file)
+    try:
+        _, etag = put_document_object(document_s3_key(document), hashing)
+    except StorageError:
+        if version is not None:
+            storage.delete(version_s3_key(version))
+        raise
+    return hashing, etag
+
+
+# Update document from bucket, along with its stored metadata; the content
+# it replaces is kept as the previous version. With if_match the update
+# only goes through while the document still has that ETag
+async def update_project_document(
+    document: Document, file: UploadFile, db: Session, if_match: str = None
+):
+    try:
+        if document.blob_digest is not None:
+            hashing, etag = await run_in_threadpool(
+                replace_document_blob, document, file, db, if_match
+            )
+        else:
+            hashing, etag = await run_in_threadpool(
+                replace_document_object, document, file, db, if_match
+            )
+    except StorageError as e:
+        db.rollback()
         error_message = f"Failed to update file content: {str(e)}"
         return error_message
 
+    document.size = hashing.size
+    document.checksum = hashing.digest
+    document.crc32 = hashing.crc32
+    document.etag = etag
+    document.content_type = document_content_type(document.filename)
+    document.version += 1
+    db.commit()
+
+
+def get_document_versions(document: Document, db: Session):
+    return db.scalars(
+        select(DocumentVersion)
+        .filter(DocumentVersion.document_id == document.id)
+        .order_by(DocumentVersion.version.desc())
+    ).all()
+
+
+def get_document_version(document: Document, version: int, db: Session):
+    return db.scalars(
+        select(DocumentVersion).filter(
+            DocumentVersion.document_id == document.id,
+            DocumentVersion.version == version,
+        )
+    ).first()
+
+
+# Open an earlier version of a document for streaming
+def download_document_version(version: DocumentVersion, byte_range: str = None):
+    return open_document_object(version_s3_key(version), byte_range)
+
+
+# Delete versions and their objects, blob versions only give their blob
+# reference back; versions whose object could not be deleted are kept.
+# Returns how many were deleted
+def delete_document_versions(db: Session, versions: List[DocumentVersion]):
+    keys = [version_s3_key(version) for version in versions if not version.blob_digest]
+    errors = storage.delete_many(keys)
+    for key, error in errors.items():
+        logger.warning("Document version %s not deleted: %s", key, error)
+    deleted = [version for version in versions if version_s3_key(version) not in errors]
+    release_blobs(
+        db, [version.blob_digest for version in deleted if version.blob_digest]
+    )
+    if deleted:
+        db.execute(
+            delete(DocumentVersion).where(
+                DocumentVersion.id.in_([version.id for version in deleted])
+            )
+        )
+    return len(deleted)
+
+
+# Purge a batch of versions past their retention period, returns how many
+# were purged; versions locked by a concurrent purge are skipped
+def purge_document_versions(db: Session):
+    cutoff = utcnow() - timedelta(days=DOCUMENT_VERSION_RETENTION_DAYS)
+    versions = db.scalars(
+        select(DocumentVersion)
+        .filter(DocumentVersion.superseded_at < cutoff)
+        .order_by(DocumentVersion.superseded_at)
+        .limit(DOCUMENT_VERSION_PURGE_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    ).all()
+    purged = delete_document_versions(db, versions)
+    db.commit()
+    return purged
+
+
+# Versions of documents about to be deleted; their objects go now, the
+# rows go with the documents
+def release_document_versions(db: Session, document_ids: List[int]):
+    versions = db.scalars(
+        select(DocumentVersion).filter(DocumentVersion.document_id.in_(document_ids))
+    ).all()
+    delete_document_versions(db, versions)
+
+
+# Delete an already loaded project with its documents: objects of plain
+# documents and of versions are deleted, blob references given back.
+# Returns an error message and deletes nothing when an object is kept
+def remove_project(db: Session, project: Project):
+    documents = db.scalars(
+        select(Document).filter(Document.project_id == project.project_id)
+    ).all()
+    versions = db.scalars(
+        select(DocumentVersion).filter(
+            DocumentVersion.document_id.in_([document.id for document in documents])
+        )
+    ).all()
+    keys = [document_s3_key(item) for item in documents if item.blob_digest is None]
+    keys += [version_s3_key(item) for item in versions if item.blob_digest is None]
+    errors = storage.delete_many(keys)
+    for key, error in errors.items():
+        logger.warning("Object %s of deleted project not deleted: %s", key, error)
+    if errors:
+        return f"Failed to delete {len(errors)} documents from S3"
+
+    release_blobs(
+        db,
+        [item.blob_digest for item in documents + versions if item.blob_digest],
+    )
+    db.delete(project)
+    db.commit()
+    return None
+
+
+# Objects a document delete removes: the document's own unless it is a
+# blob, and those of its plain versions
+def document_object_keys(db: Session, document: Document):
+    versions = db.scalars(
+        select(DocumentVersion).filter(DocumentVersion.document_id == document.id)
+    ).all()
+    keys = [version_s3_key(version) for version in versions if not version.blob_digest]
+    if document.blob_digest is None:
+        keys.append(document_s3_key(document))
+    return keys
+
+
+# Delete a document whose objects were deleted, giving its and its versions'
+# blob references back. Returns an error message and keeps the document when
+# an object could not be deleted
+def finish_document_delete(db: Session, document: Document, errors: dict):
+    for key, error in errors.items():
+        logger.warning("Object %s of deleted document not deleted: %s", key, error)
+    if errors:
+        return f"Failed to delete {len(errors)} objects of the document from S3"
+
+    versions = db.scalars(
+        select(DocumentVersion).filter(DocumentVersion.document_id == document.id)
+    ).all()
+    release_blobs(
+        db,
+        [item.blob_digest for item in [document, *versions] if item.blob_digest],
+    )
+    db.execute(release_filename_statement(document.project_id, document.filename))
+    db.delete(document)
+    db.commit()
+    return None
+
 
 # Delete document from bucket and corresponding project
 async def delete_project_document(document: Document, db: Session):
-    try:
-        s3_key = f"{document.project_id}/{document.file_url.split('/')[-1]}"
-        s3.delete_object(Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key=s3_key)
-        db.delete(document)
-        db.commit()
-    except ClientError as e:
-        error_message = f"Failed to download document: {e.response['Error']['Message']}"
-        return error_message
+    errors = storage.delete_many(document_object_keys(db, document))
+    return finish_document_delete(db, document, errors)
+
+
+# Documents a bulk delete applies to, those the user cannot access left out
+def bulk_delete_statement(
+    user_id: int,
+    document_ids: List[int] = None,
+    project_id: int = None,
+    filename_prefix: str = None,
+):
+    statement = (
+        select(Document)
+        .join(Project, Document.project_id == Project.project_id)
+        .filter(project_access_filter(user_id))
+        .order_by(Document.id)
+    )
+    if document_ids is not None:
+        return statement.filter(Document.id.in_(document_ids))
+    statement = statement.filter(Document.project_id == project_id)
+    if filename_prefix:
+        statement = statement.filter(
+            Document.filename.startswith(filename_prefix, autoescape=True)
+        )
+    return statement
+
+
+# Delete many documents at once: access is checked in one query, objects
+# go in batched storage deletes and rows in one transaction; documents
+# whose object could not be deleted are kept and reported with the reason
+def delete_project_documents(
+    db: Session,
+    user_id: int,
+    document_ids: List[int] = None,
+    project_id: int = None,
+    filename_prefix: str = None,
+):
+    documents = db.scalars(
+        bulk_delete_statement(user_id, document_ids, project_id, filename_prefix)
+    ).all()
+    failed = {}
+    if document_ids is not None:
+        found = {document.id for document in documents}
+        for document_id in document_ids:
+            if document_id not in found:
+                failed[document_id] = "You don't have access to this document"
+
+    # shared blobs are only released, they go once no document uses them
+    keys = {
+        document_s3_key(document): document
+        for document in documents
+        if document.blob_digest is None
+    }
+    for key, error in storage.delete_many(list(keys)).items():
+        failed[keys[key].id] = f"Failed to delete document: {error}"
+    deleted = [document for document in documents if document.id not in failed]
+
+    if deleted:
+        try:
+            release_blobs(
+                db,
+                [document.blob_digest for document in deleted if document.blob_digest],
+            )
+            release_document_versions(db, [document.id for document in deleted])
+            db.execute(
+                delete(FilenameCounter).where(
+                    tuple_(FilenameCounter.project_id, FilenameCounter.filename).in_(
+                        [
+                            (document.project_id, document.filename)
+                            for document in deleted
+                        ]
+                    )
+                )
+            )
+            db.execute(
+                delete(Document).where(
+                    Document.id.in_([document.id for document in deleted])
+                )
+            )
+            db.commit()
+        except SQLAlchemyError as e:
+            logger.error("Bulk delete of %s documents failed: %s", len(deleted), e)
+            db.rollback()
+            for document in deleted:
+                failed[document.id] = "Failed to delete document"
+            deleted = []
+
+    return {
+        "deleted": [document.id for document in deleted],
+        "failed": [
+            {"id": document_id, "error": error}
+            for document_id, error in sorted(failed.items())
+        ],
+    }
+
+
+# Server-side copies of document objects, run in parallel; takes
+# (document, key) pairs and returns a future per pair
+def copy_document_objects(copies: list):
+    futures = [
+        upload_executor.submit(
+            storage.copy, document_s3_key(document), s3_key, document.size
+        )
+        for document, s3_key in copies
+    ]
+    wait(futures)
+    return futures
+
+
+# Copy a project with its participants and documents for a new owner; objects
+# are copied inside storage and rows inserted in bulk, all or nothing.
+# Returns the new project and an error message
+def clone_project(db: Session, source: Project, owner_id: int, name: str = None):
+    clone = Project(
+        name=name or f"{source.name} (copy)",
+        description=source.description,
+        owner_id=owner_id,
+    )
+    db.add(clone)
+    db.flush()
+
+    # everyone on the source project keeps access to the copy
+    members = set(
+        db.scalars(
+            select(ProjectParticipant.user_id).filter(
+                ProjectParticipant.project_id == source.project_id
+            )
+        )
+    )
+    members.add(source.owner_id)
+    members.discard(owner_id)
+    members.discard(None)
+    if members:
+        db.execute(
+            insert(ProjectParticipant),
+            [
+                {"project_id": clone.project_id, "user_id": user_id}
+                for user_id in sorted(members)
+            ],
+        )
+
+    documents = db.scalars(
+        select(Document)
+        .filter(Document.project_id == source.project_id)
+        .order_by(Document.id)
+    ).all()
+    # content-addressed documents share their blob, nothing to copy
+    copies = [
+        (document, f"{clone.project_id}/{document.filename}")
+        for document in documents
+        if document.blob_digest is None
+    ]
+    futures = copy_document_objects(copies)
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        db.rollback()
+        storage.delete_many(
+            [
+                s3_key
+                for (_, s3_key), future in zip(copies, futures)
+                if future.exception() is None
+            ]
+        )
+        logger.error("Clone of project %s failed: %s", source.project_id, errors[0])
+        return None, f"Failed to copy documents: {errors[0]}"
+
+    copied = {
+        document.id: (s3_key, future.result())
+        for (document, s3_key), future in zip(copies, futures)
+    }
+    retain_blobs(
+        db, [document.blob_digest for document in documents if document.blob_digest]
+    )
+    if documents:
+        db.execute(
+            insert(FilenameCounter),
+            [
+                {
+                    "project_id": clone.project_id,
+                    "filename": document.filename,
+                    "last_suffix": 0,
+                }
+                for document in documents
+            ],
+        )
+        rows = []
+        for document in documents:
+            file_url, etag = document.file_url, document.etag
+            if document.id in copied:
+                s3_key, etag = copied[document.id]
+                file_url = document_file_url(s3_key)
+            rows.append(
+                {
+                    "project_id": clone.project_id,
+                    "filename": document.filename,
+                    "file_url": file_url,
+                    "blob_digest": document.blob_digest,
+                    "size": document.size,
+                    "content_type": document.content_type,
+                    "checksum": document.checksum,
+                    "crc32": document.crc32,
+                    "etag": etag,
+                }
+            )
+        db.execute(insert(Document), rows)
+    db.commit()
+    return clone, None
+
+
+# Move a document to another project under a free name there: the object is
+# copied inside storage, the row re-pointed, then the old object deleted;
+# content-addressed documents keep their blob. Returns an error message
+def move_project_document(db: Session, document: Document, project_id: int):
+    if document.project_id == project_id:
+        return None
+    source_key = document_s3_key(document)
+    filename = allocate_filenames(db, project_id, [document.filename])[0]
+    if document.blob_digest is None:
+        s3_key = f"{project_id}/{filename}"
+        try:
+            document.etag = storage.copy(source_key, s3_key, document.size)
+        except StorageError as e:
+            db.rollback()
+            db.execute(release_filename_statement(project_id, filename))
+            db.commit()
+            return f"Failed to move document: {e}"
+        document.file_url = document_file_url(s3_key)
+
+    db.execute(release_filename_statement(document.project_id, document.filename))
+    document.project_id = project_id
+    document.filename = filename
+    db.commit()
+    if document.blob_digest is None:
+        try:
+            storage.delete(source_key)
+        except StorageError as e:
+            logger.warning("Moved document left %s behind: %s", source_key, e)
+
+
+# Async equivalents for AsyncSession callers
+get_document_async = async_equivalent(get_document)
+get_document_with_role_async = async_equivalent(get_document_with_role)
+get_document_with_access_async = async_equivalent(get_document_with_access)
+has_access_to_document_async = async_equivalent(has_access_to_document)
+
+
+async def get_project_documents_async(
+    project_id: int,
+    user_id: int,
+    db: AsyncSession,
+    sort: str = "id",
+    after: tuple = None,
+    limit: int = None,
+):
+    project = await get_project_by_id_with_access_async(project_id, user_id, db)
+    if project is None:
+        return None
+    statement = project_documents_statement(project_id, sort, after, limit)
+    documents = await db.scalars(statement)
+    return documents.all()
+
+
+async def delete_project_document_async(document: Document, db: AsyncSession):
+    keys = await db.run_sync(document_object_keys, document)
+    errors = await run_in_threadpool(storage.delete_many, keys)
+    return await db.run_sync(finish_document_delete, document, errors)
@@ -1,28 +1,42 @@
 from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from PIL import Image
 import io
 from urllib.parse import urlparse
 from io import BytesIO
-import boto3
 import os
-from botocore.exceptions import ClientError
 import logging
 
-from app.crud.documents import s3
+from app.crud.documents import (
+    PRESIGNED_URL_EXPIRES,
+    presigned_transfers_enabled,
+    upload_executor,
+)
+from app.database import async_equivalent
+from app.images import (
+    CONTENT_TYPES,
+    LOGO_VARIANT_FORMATS,
+    LOGO_VARIANT_MAX_BYTES,
+    LOGO_VARIANT_SIZES,
+    ImageError,
+    image_pool,
+    parse_variant_name,
+    render_logo_variants,
+)
 from app.models import Project
 from app.crud.project import get_project_by_id_with_access
+from app.storage import InvalidRange, StorageError, build_storage
 
 BUCKET_NAME = os.getenv("LOGO_BUCKET_NAME")
 
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png"}
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_DEFAULT_REGION"),
-)
+logger = logging.getLogger(__name__)
+
+storage = build_storage(BUCKET_NAME, "logos")
 
 
 def allowed_file_extension(logo_file):
@@ -31,72 +45,201 @@ def allowed_file_extension(logo_file):
     )
 
 
-async def upload_to_s3(user_id: int, db: Session, project_id: int, logo: UploadFile):
+# Bucket key of a logo variant, next to the original logo
+def logo_variant_key(project_id: int, name: str):
+    return f"{project_id}/variants/{name}"
+
+
+# Filename a variant is downloaded as, "logo_128.webp" for logo.png
+def logo_variant_filename(logo_url: str, name: str):
+    stem = logo_url.split("/")[-1].rsplit(".", 1)[0]
+    size, image_format = parse_variant_name(name)
+    return f"{stem}_{size}.{image_format}"
+
+
+def put_logo_variants(project_id: int, variants: dict):
+    def put(item):
+        name, data = item
+        image_format = parse_variant_name(name)[1]
+        storage.put(
+            logo_variant_key(project_id, name),
+            io.BytesIO(data),
+            CONTENT_TYPES[image_format],
+        )
+
+    list(upload_executor.map(put, variants.items()))
+
+
+# Render the variants of a logo on the image processes and store them,
+# returns their names for Project.logo_variants; logos that cannot be
+# rendered are kept without variants and served as uploaded
+async def store_logo_variants(project_id: int, logo: UploadFile):
+    if logo.size is not None and logo.size > LOGO_VARIANT_MAX_BYTES:
+        return None
+    await logo.seek(0)
+    data = await logo.read()
     try:
-        # read the image
-        content = await logo.read()
+        variants = await image_pool.run(
+            render_logo_variants, data, LOGO_VARIANT_SIZES, LOGO_VARIANT_FORMATS
+        )
+    except ImageError as e:
+        logger.warning("No variants of the logo of project %s: %s", project_id, e)
+        return None
+    await run_in_threadpool(put_logo_variants, project_id, variants)
+    return ",".join(variants)
+
 
-        # create the s3 key and upload the image
-        s3_key = f"{project_id}/{logo.filename}"
-        s3.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=content)
+async def upload_to_s3(project: Project, db: Session, logo: UploadFile):
+    try:
+        # create the s3 key and stream the image to storage
+        s3_key = f"{project.project_id}/{logo.filename}"
+        await run_in_threadpool(storage.put, s3_key, logo.file, logo.content_type)
+        variants = await store_logo_variants(project.project_id, logo)
         logo_url = f"https://{BUCKET_NAME}." f"s3.{BUCKET_NAME}.amazonaws.com/{s3_key}"
-        project = get_project_by_id_with_access(project_id, user_id, db)
         project.logo_url = logo_url
+        project.logo_variants = variants
         db.commit()
     except Exception:
         raise HTTPException(status_code=500, detail="Logo not uploaded successfully")
     return {"message": "Logo uploaded successfully"}
 
 
-def get_project_logo_url(db: Session, project_id: int, user_id: int):
+# Logo URL and variant names of a project the user can access
+def get_project_logo(db: Session, project_id: int, user_id: int):
     project = get_project_by_id_with_access(project_id, user_id, db)
     if not project:
         raise HTTPException(status_code=500, detail="Project not found")
     if not project.logo_url:
         raise HTTPException(status_code=500, detail="Logo not found")
-    return project.logo_url
+    return project.logo_url, project.logo_variants
 
 
-def download_logo_from_s3(logo_url: str, project_id: int):
+def get_project_logo_url(db: Session, project_id: int, user_id: int):
+    return get_project_logo(db, project_id, user_id)[0]
+
+
+# Smallest variant at least size pixels large, WebP for clients accepting
+# it; None when no variant is large enough and the original is served
+def pick_logo_variant(variants: str, size: int, accept: str = None):
+    if not variants:
+        return None
+    available = [parse_variant_name(name) for name in variants.split(",")]
+    formats = {image_format for _, image_format in available}
+    image_format = "png"
+    if "webp" in formats and "image/webp" in (accept or ""):
+        image_format = "webp"
+    sizes = sorted(
+        variant_size
+        for variant_size, variant_format in available
+        if variant_format == image_format and variant_size >= size
+    )
+    if not sizes:
+        return None
+    return f"{sizes[0]}.{image_format}"
+
+
+# Open logo from bucket for streaming, optionally only a byte range or
+# one of its variants
+def download_logo_from_s3(
+    logo_url: str, project_id: int, byte_range: str = None, variant: str = None
+):
     try:
         filename = logo_url.split("/")[-1]
         s3_key = f"{project_id}/{filename}"
-        s3_object = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-        logo_image = s3_object["Body"].read()
-
-        return logo_image, None
-    except ClientError as e:
-        error_message = f"Failed to download document: {e.response['Error']['Message']}"
+        if variant is not None:
+            s3_key = logo_variant_key(project_id, variant)
+        s3_object = storage.get(s3_key, byte_range)
+
+        return s3_object, None
+    except InvalidRange:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable")
+    except StorageError as e:
+        error_message = f"Failed to download document: {e}"
         return None, error_message
 
 
-def delete_logo(project_id: int, db: Session):
-    try:
-        bucket_name = os.getenv("LOGO_BUCKET_NAME")
-        project_prefix = f"{project_id}/"
+def presigned_logo_transfers_enabled():
+    return presigned_transfers_enabled(storage)
+
 
-        # list all files in the project folder
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=project_prefix)
+def presign_logo_download(logo_url: str, project_id: int, variant: str = None):
+    filename = logo_url.split("/")[-1]
+    if variant is not None:
+        return storage.presign_download(
+            logo_variant_key(project_id, variant),
+            logo_variant_filename(logo_url, variant),
+            PRESIGNED_URL_EXPIRES,
+        )
+    return storage.presign_download(
+        f"{project_id}/{filename}", filename, PRESIGNED_URL_EXPIRES
+    )
 
-        if "Contents" in response:
-            objects_to_delete = [{"Key": obj["Key"]} for obj in response["Contents"]]
 
-            if objects_to_delete:
-                s3_client.delete_objects(
-                    Bucket=bucket_name, Delete={"Objects": objects_to_delete}
+# Give a cloned project its own copy of the source project's logo; the
+# clone is left without a logo when the copy fails
+def copy_project_logo(source: Project, clone: Project, db: Session):
+    if not source.logo_url:
+        return
+    filename = source.logo_url.split("/")[-1]
+    s3_key = f"{clone.project_id}/{filename}"
+    try:
+        storage.copy(f"{source.project_id}/{filename}", s3_key)
+        for name in (source.logo_variants or "").split(","):
+            if name:
+                storage.copy(
+                    logo_variant_key(source.project_id, name),
+                    logo_variant_key(clone.project_id, name),
                 )
+        clone.logo_url = (
+            f"https://{BUCKET_NAME}." f"s3.{BUCKET_NAME}.amazonaws.com/{s3_key}"
+        )
+        clone.logo_variants = source.logo_variants
+    except StorageError as e:
+        logger.warning("Logo of project %s not copied: %s", source.project_id, e)
+        clone.logo_url = None
+        clone.logo_variants = None
+    db.commit()
+
+
+def delete_logo(project_id: int, db: Session):
+    try:
+        # delete all files in the project folder
+        storage.delete_prefix(f"{project_id}/")
 
         project_entry = (
             db.query(Project).filter(Project.project_id == project_id).first()
         )
         if project_entry:
             project_entry.logo = None
+            project_entry.logo_variants = None
             db.commit()
 
         return "Successfully deleted project logo"
 
-    except ClientError as e:
-        error_message = (
-            f"Failed to delete logo from S3: {e.response['Error']['Message']}"
+    except StorageError as e:
+        error_message = f"Failed to delete logo from S3: {e}"
+        return error_message
+
+
+# Async equivalents for AsyncSession callers
+get_project_logo_url_async = async_equivalent(get_project_logo_url)
+
+
+async def delete_logo_async(project_id: int, db: AsyncSession):
+    try:
+        # delete all files in the project folder
+        await run_in_threadpool(storage.delete_prefix, f"{project_id}/")
+
+        project_entry = await db.scalar(
+            select(Project).filter(Project.project_id == project_id)
         )
+        if project_entry:
+            project_entry.logo = None
+            project_entry.logo_variants = None
+            await db.commit()
+
+        return "Successfully deleted project logo"
+
+    except StorageError as e:
+        error_message = f"Failed to delete logo from S3: {e}"
         return error_message
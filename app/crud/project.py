@@ -1,9 +1,10 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.orm import Session, load_only, selectinload
+from sqlalchemy import case, exists, or_, select, text, union
 
+from app.database import async_equivalent
 
 from app.schemas import CreateUpdateProject
-from app.models import Document, Project, ProjectParticipant
+from app.models import Document, DocumentVersion, Project, ProjectParticipant
 
 
 # Create project with ownership
@@ -17,59 +18,90 @@ def create_project_with_owner(db: Session, project: CreateUpdateProject, owner_i
     return db_project
 
 
-# List of projects with access
-def get_all_projects_with_access(user_id: int, db: Session):
-    # projects where the user is the owner
-    owner_projects = db.query(Project).filter(Project.owner_id == user_id).all()
-    # projects where the user is a participant
-    participant_projects = (
+# Ids of projects the user owns or participates in, as one UNION
+def accessible_project_ids(user_id: int):
+    return union(
+        select(Project.project_id).where(Project.owner_id == user_id),
+        select(ProjectParticipant.project_id).where(
+            ProjectParticipant.user_id == user_id
+        ),
+    ).subquery()
+
+
+# Projects with access ordered by id, one page after `after_id`
+def accessible_projects_query(
+    user_id: int, db: Session, after_id: int = None, limit: int = None
+):
+    project_ids = accessible_project_ids(user_id)
+    query = (
         db.query(Project)
-        .join(ProjectParticipant)
-        .filter(ProjectParticipant.user_id == user_id)
-        .all()
+        .filter(Project.project_id.in_(select(project_ids.c.project_id)))
+        .order_by(Project.project_id)
     )
-    projects_with_access = owner_projects + participant_projects
+    if after_id is not None:
+        query = query.filter(Project.project_id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
 
-    return projects_with_access
+
+# List of projects with access
+def get_all_projects_with_access(
+    user_id: int, db: Session, after_id: int = None, limit: int = None
+):
+    return accessible_projects_query(user_id, db, after_id, limit).all()
 
 
 # List of projects info + documentation
-def projects_info_with_docs(user_id: int, db: Session):
-    projects_with_access = get_all_projects_with_access(user_id, db)
-    projects_details_with_docs = []
-    for project in projects_with_access:
-        docs = (
-            db.query(Document).filter(Document.project_id == project.project_id).all()
-        )
-        project_info = {
+def projects_info_with_docs(
+    user_id: int, db: Session, after_id: int = None, limit: int = None
+):
+    projects = (
+        accessible_projects_query(user_id, db, after_id, limit)
+        .options(selectinload(Project.documents).options(load_only(Document.filename)))
+        .all()
+    )
+    return [
+        {
             "id": project.project_id,
             "name": project.name,
             "description": project.description,
-            "documents": [{"filename": doc.filename} for doc in docs],
+            "documents": [{"filename": doc.filename} for doc in project.documents],
         }
-        projects_details_with_docs.append(project_info)
+        for project in projects
+    ]
 
-    return projects_details_with_docs
 
-
-# Get project by id with access
-def get_project_by_id_with_access(project_id: int, user_id, db: Session):
-    # Check if the user is the owner of the project
-    owner_project = (
-        db.query(Project)
-        .filter(Project.owner_id == user_id, Project.project_id == project_id)
-        .first()
+# Condition matching projects the user owns or participates in
+def project_access_filter(user_id: int):
+    is_participant = exists().where(
+        ProjectParticipant.project_id == Project.project_id,
+        ProjectParticipant.user_id == user_id,
     )
-    if owner_project:
-        return owner_project
-    # Check if the user is a participant in the project
-    participant_project = (
-        db.query(Project)
-        .join(ProjectParticipant)
-        .filter(ProjectParticipant.user_id == user_id, Project.project_id == project_id)
+    return or_(Project.owner_id == user_id, is_participant)
+
+
+# Caller's role in the project: "owner" or "participant"
+def project_role(user_id: int):
+    return case((Project.owner_id == user_id, "owner"), else_="participant")
+
+
+# Get project with the caller's role in a single query, (None, None) without access
+def get_project_with_role(project_id: int, user_id: int, db: Session):
+    row = (
+        db.query(Project, project_role(user_id))
+        .filter(Project.project_id == project_id, project_access_filter(user_id))
         .first()
     )
-    return participant_project
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+# Get project by id with access
+def get_project_by_id_with_access(project_id: int, user_id, db: Session):
+    project, _ = get_project_with_role(project_id, user_id, db)
+    return project
 
 
 # Get specific project details
@@ -102,18 +134,12 @@ def update_project_info(
     return None
 
 
-# Delete specific project from all tables
-def delete_specific_project(db: Session, project_id: int, user_id: int):
-
-    owner_project = (
-        db.query(Project)
-        .filter(Project.owner_id == user_id, Project.project_id == project_id)
-        .first()
-    )
-    if not owner_project:
-        return None
-
-    # delete the project from the database
-    db.delete(owner_project)
-    db.commit()
-    return owner_project
+# Async equivalents for AsyncSession callers
+create_project_with_owner_async = async_equivalent(create_project_with_owner)
+get_all_projects_with_access_async = async_equivalent(get_all_projects_with_access)
+projects_info_with_docs_async = async_equivalent(projects_info_with_docs)
+get_project_with_role_async = async_equivalent(get_project_with_role)
+get_project_by_id_with_access_async = async_equivalent(get_project_by_id_with_access)
+get_project_info_async = async_equivalent(get_project_info)
+get_project_by_id_async = async_equivalent(get_project_by_id)
+update_project_info_async = async_equivalent(update_project_info)
@@ -0,0 +1,218 @@
+from sqlalchemy import column, exists, func, literal_column, or_, select, table, text
+from sqlalchemy.orm import Session
+import re
+
+from app.crud.project import project_access_filter
+from app.models import Document, DocumentText, Project
+
+# results of one search
+SEARCH_MAX_RESULTS = 50
+# weights of name and description matches in SQLite rankings, filename
+# matches weigh 1
+SQLITE_COLUMN_WEIGHTS = (10.0, 5.0)
+
+# ts_headline options of content search snippets
+SNIPPET_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=5"
+# tokens per snippet of SQLite content search
+SQLITE_SNIPPET_TOKENS = 20
+
+project_search = table("project_search", column("rowid"))
+document_search = table("document_search", column("rowid"), column("rank"))
+document_text_search = table("document_text_search", column("rowid"))
+
+# whether pg_trgm is installed, per database URL
+trigram_support = {}
+
+
+# Words of a query; search matches every word, also as a prefix
+def search_terms(q: str):
+    return re.findall(r"\w+", q.lower())
+
+
+def has_trigram_support(db: Session):
+    bind = db.get_bind()
+    key = str(bind.engine.url)
+    if key not in trigram_support:
+        trigram_support[key] = (
+            db.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).first()
+            is not None
+        )
+    return trigram_support[key]
+
+
+# Projects ranked by ts_rank over their name and description plus that of
+# their best matching filename; with pg_trgm, names and filenames similar to
+# the query or containing it match as well
+def postgres_search_statement(db: Session, q: str, terms: list):
+    tsquery = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+    filename_ranks = (
+        select(
+            Document.project_id,
+            func.max(func.ts_rank(Document.search_vector, tsquery)).label("rank"),
+        )
+        .filter(Document.search_vector.bool_op("@@")(tsquery))
+        .group_by(Document.project_id)
+        .subquery()
+    )
+    matches = or_(
+        Project.search_vector.bool_op("@@")(tsquery),
+        filename_ranks.c.project_id.is_not(None),
+    )
+    rank = func.ts_rank(Project.search_vector, tsquery) + func.coalesce(
+        filename_ranks.c.rank, 0
+    )
+    if has_trigram_support(db):
+        filename_matches = exists().where(
+            Document.project_id == Project.project_id,
+            or_(
+                Document.filename.bool_op("%")(q),
+                Document.filename.icontains(q, autoescape=True),
+            ),
+        )
+        matches = or_(
+            matches,
+            Project.name.bool_op("%")(q),
+            Project.name.icontains(q, autoescape=True),
+            filename_matches,
+        )
+        rank = rank + func.similarity(Project.name, q)
+    return (
+        select(Project, rank.label("rank"))
+        .outerjoin(filename_ranks, filename_ranks.c.project_id == Project.project_id)
+        .filter(matches)
+    )
+
+
+# Projects ranked by bm25 over the FTS5 tables, lower scores rank higher
+def sqlite_search_statement(terms: list):
+    fts_query = " ".join(f'"{term}"*' for term in terms)
+    project_ranks = (
+        select(
+            project_search.c.rowid.label("project_id"),
+            (
+                -func.bm25(literal_column("project_search"), *SQLITE_COLUMN_WEIGHTS)
+            ).label("rank"),
+        )
+        .filter(literal_column("project_search").bool_op("MATCH")(fts_query))
+        .subquery()
+    )
+    # FTS5's rank column is bm25() and, unlike the function, can be aggregated
+    filename_ranks = (
+        select(Document.project_id, func.max(-document_search.c.rank).label("rank"))
+        .select_from(document_search)
+        .join(Document, Document.id == document_search.c.rowid)
+        .filter(literal_column("document_search").bool_op("MATCH")(fts_query))
+        .group_by(Document.project_id)
+        .subquery()
+    )
+    rank = func.coalesce(project_ranks.c.rank, 0) + func.coalesce(
+        filename_ranks.c.rank, 0
+    )
+    return (
+        select(Project, rank.label("rank"))
+        .outerjoin(project_ranks, project_ranks.c.project_id == Project.project_id)
+        .outerjoin(filename_ranks, filename_ranks.c.project_id == Project.project_id)
+        .filter(
+            or_(
+                project_ranks.c.project_id.is_not(None),
+                filename_ranks.c.project_id.is_not(None),
+            )
+        )
+    )
+
+
+# Projects the user can access matching q, best matches first
+def search_projects(db: Session, user_id: int, q: str, limit: int = None):
+    terms = search_terms(q)
+    if not terms:
+        return []
+    if db.get_bind().dialect.name == "sqlite":
+        statement = sqlite_search_statement(terms)
+    else:
+        statement = postgres_search_statement(db, q, terms)
+    rows = db.execute(
+        statement.filter(project_access_filter(user_id))
+        .order_by(literal_column("rank").desc(), Project.project_id)
+        .limit(min(limit or SEARCH_MAX_RESULTS, SEARCH_MAX_RESULTS))
+    ).all()
+    return [
+        {
+            "id": project.project_id,
+            "name": project.name,
+            "description": project.description,
+            "rank": rank,
+        }
+        for project, rank in rows
+    ]
+
+
+# Documents ranked by ts_rank over their extracted text, with the matching
+# fragments highlighted
+def postgres_content_search_statement(terms: list):
+    tsquery = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+    return (
+        select(
+            Document,
+            func.ts_rank(DocumentText.search_vector, tsquery).label("rank"),
+            func.ts_headline(
+                "simple", DocumentText.content, tsquery, SNIPPET_OPTIONS
+            ).label("snippet"),
+        )
+        .select_from(DocumentText)
+        .filter(DocumentText.search_vector.bool_op("@@")(tsquery))
+    )
+
+
+def sqlite_content_search_statement(terms: list):
+    fts_query = " ".join(f'"{term}"*' for term in terms)
+    return (
+        select(
+            Document,
+            (-func.bm25(literal_column("document_text_search"))).label("rank"),
+            func.snippet(
+                literal_column("document_text_search"),
+                0,
+                "<b>",
+                "</b>",
+                "...",
+                SQLITE_SNIPPET_TOKENS,
+            ).label("snippet"),
+        )
+        .select_from(DocumentText)
+        .join(
+            document_text_search,
+            document_text_search.c.rowid == DocumentText.document_id,
+        )
+        .filter(literal_column("document_text_search").bool_op("MATCH")(fts_query))
+    )
+
+
+# Documents the user can access whose extracted text matches q, best
+# matches first
+def search_document_contents(db: Session, user_id: int, q: str, limit: int = None):
+    terms = search_terms(q)
+    if not terms:
+        return []
+    if db.get_bind().dialect.name == "sqlite":
+        statement = sqlite_content_search_statement(terms)
+    else:
+        statement = postgres_content_search_statement(terms)
+    rows = db.execute(
+        statement.join(Document, Document.id == DocumentText.document_id)
+        .join(Project, Project.project_id == Document.project_id)
+        .filter(project_access_filter(user_id))
+        .order_by(literal_column("rank").desc(), Document.id)
+        .limit(min(limit or SEARCH_MAX_RESULTS, SEARCH_MAX_RESULTS))
+    ).all()
+    return [
+        {
+            "id": document.id,
+            "project_id": document.project_id,
+            "filename": document.filename,
+            "rank": rank,
+            "snippet": snippet,
+        }
+        for document, rank, snippet in rows
+    ]
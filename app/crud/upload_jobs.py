@@ -0,0 +1,341 @@
+from concurrent.futures import wait
+from datetime import timedelta
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, selectinload
+from typing_extensions import List
+import logging
+import os
+import random
+import shutil
+import uuid
+
+from app.crud.blobs import (
+    HashingFile,
+    acquire_blob,
+    blob_key,
+    content_addressed_storage,
+    mark_blob_stored,
+    release_blobs,
+)
+from app.crud.documents import (
+    allocate_filenames,
+    discard_document_objects,
+    document_content_type,
+    document_file_url,
+    put_document_object,
+    release_filename_statement,
+    upload_executor,
+)
+from app.models import Document, UploadJob, UploadJobItem, utcnow
+
+# queued files wait here until a worker has sent them to S3; it must be a
+# persistent volume shared by the API and worker processes, uploads are
+# refused while it is unset
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR")
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.getenv("UPLOAD_JOB_MAX_ATTEMPTS", "5"))
+# retry delay doubles per attempt, from the base up to the cap
+UPLOAD_JOB_BACKOFF_SECONDS = float(os.getenv("UPLOAD_JOB_BACKOFF_SECONDS", "2"))
+UPLOAD_JOB_MAX_BACKOFF_SECONDS = float(
+    os.getenv("UPLOAD_JOB_MAX_BACKOFF_SECONDS", "300")
+)
+# a job whose worker died is retried once its lease runs out
+UPLOAD_JOB_LEASE_SECONDS = float(os.getenv("UPLOAD_JOB_LEASE_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+# Copy an uploaded file out of its request spool, hashing it on the way;
+# returns the new path and the HashingFile with its sha256, CRC-32 and size
+def spool_upload(fileobj):
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_SPOOL_DIR, uuid.uuid4().hex)
+    with open(path, "wb") as spool:
+        hashing = HashingFile(spool)
+        shutil.copyfileobj(fileobj, hashing, 1024 * 1024)
+    return path, hashing
+
+
+def remove_spool_files(items: List[UploadJobItem]):
+    for item in items:
+        try:
+            os.remove(item.spool_path)
+        except FileNotFoundError:
+            pass
+
+
+def get_upload_job(job_id: int, user_id: int, db: Session):
+    return (
+        db.query(UploadJob)
+        .options(selectinload(UploadJob.items))
+        .filter(UploadJob.id == job_id, UploadJob.user_id == user_id)
+        .first()
+    )
+
+
+def get_upload_job_by_key(idempotency_key: str, user_id: int, db: Session):
+    return (
+        db.query(UploadJob)
+        .options(selectinload(UploadJob.items))
+        .filter(
+            UploadJob.idempotency_key == idempotency_key, UploadJob.user_id == user_id
+        )
+        .first()
+    )
+
+
+# Queue files given as (filename, file object) pairs for upload; a repeated
+# idempotency key returns the job created by the first request
+def create_upload_job(
+    db: Session,
+    project_id: int,
+    user_id: int,
+    files: list,
+    idempotency_key: str = None,
+):
+    if not UPLOAD_SPOOL_DIR:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Upload spool directory is not configured",
+        )
+    items = []
+    for filename, fileobj in files:
+        spool_path, hashing = spool_upload(fileobj)
+        items.append(
+            UploadJobItem(
+                filename=filename,
+                spool_path=spool_path,
+                digest=hashing.digest,
+                crc32=hashing.crc32,
+                size=hashing.size,
+            )
+        )
+    job = UploadJob(
+        project_id=project_id,
+        user_id=user_id,
+        idempotency_key=idempotency_key,
+        items=items,
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # the same key was submitted concurrently
+        db.rollback()
+        remove_spool_files(items)
+        return get_upload_job_by_key(idempotency_key, user_id, db)
+    return job
+
+
+# Status of a job and each of its files
+def upload_job_status(job: UploadJob):
+    return {
+        "job_id": job.id,
+        "project_id": job.project_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "next_attempt_at": job.next_attempt_at if job.status == "queued" else None,
+        "last_error": job.last_error,
+        "total": len(job.items),
+        "uploaded": sum(item.status == "uploaded" for item in job.items),
+        "failed": sum(item.status == "failed" for item in job.items),
+        "items": [
+            {
+                "filename": item.filename,
+                "stored_as": item.stored_as,
+                "status": item.status,
+                "error": item.error,
+                "document_id": item.document_id,
+            }
+            for item in job.items
+        ],
+    }
+
+
+def retry_delay(attempts: int):
+    delay = min(
+        UPLOAD_JOB_BACKOFF_SECONDS * 2 ** (attempts - 1),
+        UPLOAD_JOB_MAX_BACKOFF_SECONDS,
+    )
+    # jitter keeps retries of jobs that failed together apart
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+# Lock the next due job for this worker, or a running one whose lease expired
+def claim_next_upload_job(db: Session):
+    now = utcnow()
+    statement = (
+        select(UploadJob)
+        .where(
+            or_(
+                and_(UploadJob.status == "queued", UploadJob.next_attempt_at <= now),
+                and_(UploadJob.status == "running", UploadJob.locked_until < now),
+            )
+        )
+        .order_by(UploadJob.next_attempt_at, UploadJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    job = db.scalars(statement).first()
+    if job is None:
+        db.rollback()
+        return None
+    job.status = "running"
+    job.attempts += 1
+    job.locked_until = now + timedelta(seconds=UPLOAD_JOB_LEASE_SECONDS)
+    db.commit()
+    return job
+
+
+def upload_spooled_file(s3_key: str, spool_path: str, content_type: str = None):
+    with open(spool_path, "rb") as spool:
+        return put_document_object(s3_key, spool, content_type)
+
+
+# Send a spooled file to its blob, unless the bytes are there already
+def upload_spooled_blob(
+    digest: str, spool_path: str, stored: bool, etag: str, content_type: str
+):
+    if stored:
+        return document_file_url(blob_key(digest)), etag
+    return upload_spooled_file(blob_key(digest), spool_path, content_type)
+
+
+# Send the pending files of a claimed job to S3, then either finish the job
+# or put it back in the queue with a backoff; uploaded files are kept
+# across attempts so a retry only sends what is still missing
+def process_upload_job(db: Session, job: UploadJob):
+    job_id = job.id
+    pending = [item for item in job.items if item.status == "pending"]
+
+    # names are kept across attempts, so a retried file reuses its key
+    unnamed = [item for item in pending if item.stored_as is None]
+    if unnamed:
+        names = allocate_filenames(
+            db, job.project_id, [item.filename for item in unnamed]
+        )
+        for item, name in zip(unnamed, names):
+            item.stored_as = name
+        db.commit()
+
+    # in content-addressed mode every file takes a reference on its blob
+    # first; content that is stored already is not uploaded again
+    blobs = {}
+    if content_addressed_storage():
+        for item in pending:
+            if item.digest is not None:
+                blobs[item.id] = acquire_blob(db, item.digest, item.size)
+        db.commit()
+
+    futures = []
+    first_of_digest = {}
+    shared = set()
+    for item in pending:
+        if item.id in blobs and item.digest in first_of_digest:
+            # identical file earlier in this job, shares its upload
+            future = first_of_digest[item.digest]
+            shared.add(item.id)
+        elif item.id in blobs:
+            stored, etag = blobs[item.id]
+            future = upload_executor.submit(
+                upload_spooled_blob,
+                item.digest,
+                item.spool_path,
+                stored,
+                etag,
+                document_content_type(item.stored_as),
+            )
+            first_of_digest[item.digest] = future
+        else:
+            future = upload_executor.submit(
+                upload_spooled_file,
+                f"{job.project_id}/{item.stored_as}",
+                item.spool_path,
+            )
+        futures.append(future)
+    wait(futures)
+
+    errors = []
+    uploaded = []
+    released = []
+    for item, future in zip(pending, futures):
+        error = future.exception()
+        if error is not None and item.id in blobs:
+            released.append(item.digest)
+        if isinstance(error, FileNotFoundError) and item.id not in shared:
+            item.status = "failed"
+            item.error = "Spooled file is missing"
+        elif error is not None:
+            logger.error(
+                "Upload of %s in job %s failed: %s", item.stored_as, job_id, error
+            )
+            item.error = str(error)
+            errors.append(str(error))
+        else:
+            file_url, etag = future.result()
+            document = Document(
+                project_id=job.project_id,
+                file_url=file_url,
+                filename=item.stored_as,
+                size=item.size,
+                content_type=document_content_type(item.stored_as),
+                checksum=item.digest,
+                crc32=item.crc32,
+                etag=etag,
+            )
+            if item.id in blobs:
+                document.blob_digest = item.digest
+                if not blobs[item.id][0]:
+                    mark_blob_stored(db, item.digest, etag)
+            db.add(document)
+            uploaded.append((item, document))
+    release_blobs(db, released)
+
+    try:
+        db.flush()
+        for item, document in uploaded:
+            item.status = "uploaded"
+            item.error = None
+            item.document_id = document.id
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error("Saving documents of upload job %s failed: %s", job_id, e)
+        db.rollback()
+        # the name may have been taken meanwhile, so the objects sent under
+        # it are deleted and its claim released; a new one is picked next time
+        discarded = []
+        for item, _ in uploaded:
+            if item.id not in blobs:
+                discarded.append(f"{job.project_id}/{item.stored_as}")
+                db.execute(release_filename_statement(job.project_id, item.stored_as))
+            item.stored_as = None
+        discard_document_objects(discarded)
+        release_blobs(
+            db, released + [item.digest for item, _ in uploaded if item.id in blobs]
+        )
+        errors.append("Failed to save document")
+
+    if errors and job.attempts < UPLOAD_JOB_MAX_ATTEMPTS:
+        job.status = "queued"
+        job.next_attempt_at = utcnow() + retry_delay(job.attempts)
+    else:
+        for item in job.items:
+            if item.status == "pending":
+                item.status = "failed"
+        all_uploaded = all(item.status == "uploaded" for item in job.items)
+        job.status = "succeeded" if all_uploaded else "failed"
+        remove_spool_files(job.items)
+    job.last_error = errors[-1] if errors else None
+    job.locked_until = None
+    db.commit()
+    return job
+
+
+# Claim and process one due job, returns whether there was one
+def run_next_upload_job(db: Session):
+    job = claim_next_upload_job(db)
+    if job is None:
+        return False
+    process_upload_job(db, job)
+    return True
@@ -1,7 +1,10 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.schemas import UsersCreate
 from app.auth.jwt_handler import hash_pass
+from app.database import async_equivalent
 from app.models import User, ProjectParticipant
 
 
@@ -56,3 +59,24 @@ def add_project_participant(db: Session, project_id: int, user_id: int):
     db.commit()
     db.refresh(participant)
     return participant
+
+
+# Async equivalents for AsyncSession callers
+is_only_participant_async = async_equivalent(is_only_participant)
+get_user_by_username_async = async_equivalent(get_user_by_username)
+add_project_participant_async = async_equivalent(add_project_participant)
+
+
+async def create_user_db_async(user: UsersCreate, db: AsyncSession):
+    hashed_password = await hash_pass(user.password)
+    db_user = User(email=user.email, hashed_password=hashed_password)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def is_existing_user_async(email: str, db: AsyncSession):
+    existing_user = await db.execute(select(User.id).filter(User.email == email))
+    if existing_user.first():
+        return True
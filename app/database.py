@@ -1,8 +1,28 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base
+import functools
+import inspect
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import Delete, Insert, Update
 from dotenv import load_dotenv
+from fastapi import Depends
+
+from app.db_metrics import (
+    PoolMetrics,
+    instrument_engine,
+    instrumented_pool_class,
+    pool_metrics_registry,
+)
 
 # load env variables from .env file
 load_dotenv()
@@ -10,19 +30,277 @@ load_dotenv()
 # database URL from env variable
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# opt-in async engine mode
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# optional read replicas, comma separated
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+# seconds between health checks of a replica
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "10"))
+# seconds a client keeps reading from the primary after writing
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+# cookie and header telling every API process when the client last wrote
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "x-last-write"
+
+# async drivers used for each sync backend
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+# connection pool settings
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+# Pool keyword arguments for create_engine, SQLite keeps its default pool
+def get_pool_options(url: str):
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+    }
+
+
+# Engine whose pool is instrumented under the given metrics name
+def create_instrumented_engine(url: str, name: str):
+    metrics = PoolMetrics(name)
+    options = get_pool_options(url)
+    if options:
+        options["poolclass"] = instrumented_pool_class(metrics)
+    instrumented_engine = create_engine(url, **options)
+    instrument_engine(instrumented_engine, metrics)
+    pool_metrics_registry[name] = metrics
+    return instrumented_engine
+
+
+engine = create_instrumented_engine(DATABASE_URL, "primary")
 
 # configured session class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+# Round-robin over replica engines, skipping ones that fail health checks
+class ReplicaSet:
+    def __init__(self, engines: list, health_check_interval: float):
+        self.engines = engines
+        self.health_check_interval = health_check_interval
+        self._health = {id(replica): (True, 0.0) for replica in engines}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, replica):
+        healthy, checked_at = self._health[id(replica)]
+        if time.monotonic() - checked_at < self.health_check_interval:
+            return healthy
+        try:
+            with replica.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            healthy = True
+        except DBAPIError:
+            healthy = False
+        self._health[id(replica)] = (healthy, time.monotonic())
+        return healthy
+
+    def mark_unhealthy(self, replica):
+        self._health[id(replica)] = (False, time.monotonic())
+
+    # next healthy replica, or None when every replica is down
+    def choose(self):
+        for _ in range(len(self.engines)):
+            with self._lock:
+                replica = self.engines[next(self._counter) % len(self.engines)]
+            if self._is_healthy(replica):
+                return replica
+        return None
+
+
+# Writes of one request, and the client's last write before it as sent
+# back in the last-write cookie or header; the client carries the marker,
+# so read-your-writes holds whichever process serves its next request
+class RequestWrites:
+    def __init__(self, last_write_at: float = None, window: float = None):
+        self.last_write_at = last_write_at
+        self.window = READ_YOUR_WRITES_WINDOW if window is None else window
+        self.wrote_at = None
+
+    def record(self):
+        self.wrote_at = time.time()
+
+    def wrote_recently(self):
+        if self.wrote_at is not None:
+            return True
+        return (
+            self.last_write_at is not None
+            and time.time() - self.last_write_at < self.window
+        )
+
+
+# writes of the current request, set by ReadYourWritesMiddleware; the
+# object is shared with the threadpool copies of the request context
+request_writes = ContextVar("request_writes", default=None)
+
+
+replica_set = ReplicaSet(
+    [
+        create_instrumented_engine(url, f"replica-{index}")
+        for index, url in enumerate(DATABASE_REPLICA_URLS)
+    ],
+    REPLICA_HEALTH_CHECK_INTERVAL,
+)
+
+
+# Session of one request, routed per statement: once marked by
+# get_read_db its reads go to a replica, everything else to the primary
+class RoutingSession(Session):
+    def __init__(self, primary=None, replicas=None, **kwargs):
+        super().__init__(**kwargs)
+        self.primary = primary if primary is not None else engine
+        self.replicas = replicas if replicas is not None else replica_set
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        writes = request_writes.get()
+        if (
+            not self.info.get("replica_reads")
+            or self._flushing
+            or self.info.get("use_primary")
+            or isinstance(clause, (Insert, Update, Delete))
+            or getattr(clause, "_for_update_arg", None) is not None
+            or (writes is not None and writes.wrote_recently())
+        ):
+            return self.primary
+        return self.replicas.choose() or self.primary
+
+
+# Pin the rest of a session to the primary, e.g. to bypass replica lag;
+# returns whether earlier reads could have come from a replica
+def use_primary(db: Session):
+    could_use_replica = (
+        isinstance(db, RoutingSession)
+        and bool(db.replicas.engines)
+        and bool(db.info.get("replica_reads"))
+        and not db.info.get("use_primary")
+    )
+    db.info["use_primary"] = True
+    return could_use_replica
+
+
+# Remember that the request wrote, for read-your-writes routing
+@event.listens_for(Session, "after_flush")
+def _mark_session_written(session, flush_context):
+    session.info["wrote"] = True
+    session.info["use_primary"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _record_committed_write(session):
+    if session.info.pop("wrote", False):
+        writes = request_writes.get()
+        if writes is not None:
+            writes.record()
+
+
+RequestSessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False
+)
+
 # Base class for our models
 Base = declarative_base()
 
 
-# dependency to get the session
+# Translate a sync database URL to its async driver
+def get_async_database_url(url: str):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_ASYNC:
+    async_engine = create_async_engine(
+        get_async_database_url(DATABASE_URL), **get_pool_options(DATABASE_URL)
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+
+
+# dependency to get the session, one per request: get_current_user and
+# the endpoint share it
 def get_db():
-    db = SessionLocal()
+    db = RequestSessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+# dependency to get the request session for read-only work, its reads
+# routed to replicas
+def get_read_db(db: Session = Depends(get_db)):
+    db.info["replica_reads"] = True
+    return db
+
+
+# dependency to get the async session
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database mode is disabled, set DATABASE_ASYNC=true")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# dependency of endpoints that read through the async session in async
+# database mode; None when it is off, the endpoint then uses its sync session
+async def get_optional_async_db():
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async for db in get_async_db():
+        yield db
+
+
+# Expose a sync CRUD function as a coroutine taking an AsyncSession as `db`;
+# the query runs on the async driver, so awaiting it never blocks the loop
+def async_equivalent(func):
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        async_db = bound.arguments["db"]
+
+        def call(session):
+            bound.arguments["db"] = session
+            return func(*bound.args, **bound.kwargs)
+
+        return await async_db.run_sync(call)
+
+    return wrapper
+
+
+# Upsert-capable insert() of the session's dialect, None when it has no
+# ON CONFLICT support
+def dialect_insert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql_insert
+    if dialect == "sqlite":
+        return sqlite_insert
+    return None
@@ -0,0 +1,113 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# upper bounds of the checkout wait-time histogram buckets, in seconds
+WAIT_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+# Counters for one connection pool
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_count = 0
+            self.wait_sum = 0.0
+            self.wait_max = 0.0
+            self.wait_buckets = [0] * (len(WAIT_TIME_BUCKETS) + 1)
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.wait_buckets[bisect.bisect_left(WAIT_TIME_BUCKETS, seconds)] += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def _increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self):
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            buckets = {
+                f"le_{bound}": count
+                for bound, count in zip(WAIT_TIME_BUCKETS, self.wait_buckets)
+            }
+            buckets["le_inf"] = self.wait_buckets[-1]
+            return {
+                "name": self.name,
+                "pool_size": pool.size() if pool is not None else None,
+                "checked_out": pool.checkedout() if pool is not None else None,
+                "checked_in": pool.checkedin() if pool is not None else None,
+                "overflow": pool.overflow() if pool is not None else None,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "checkout_timeouts": self.timeouts,
+                "wait_time": {
+                    "count": self.wait_count,
+                    "sum_seconds": self.wait_sum,
+                    "max_seconds": self.wait_max,
+                    "buckets": buckets,
+                },
+            }
+
+
+# QueuePool subclass bound to a PoolMetrics, timing every wait for a connection;
+# recreate() keeps the class, so metrics survive engine.dispose()
+def instrumented_pool_class(metrics: PoolMetrics):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            metrics.record_timeout()
+            raise
+        metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+    return type("InstrumentedQueuePool", (QueuePool,), {"_do_get": _do_get})
+
+
+# Feed pool events of an engine into its metrics
+def instrument_engine(engine, metrics: PoolMetrics):
+    metrics.engine = engine
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics._increment("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        metrics._increment("checkins")
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics._increment("connects")
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics._increment("invalidations")
+
+
+# metrics of every instrumented pool, keyed by name
+pool_metrics_registry = {}
@@ -0,0 +1,207 @@
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# processes extracting document text
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+# address space allowed to each extraction process, in MiB; 0 for no limit
+EXTRACTION_WORKER_MEMORY_MB = int(os.getenv("EXTRACTION_WORKER_MEMORY_MB", "512"))
+# larger documents are not extracted
+EXTRACTION_MAX_BYTES = int(os.getenv("EXTRACTION_MAX_BYTES", str(50 * 1024 * 1024)))
+# text kept per document, the rest is cut off
+EXTRACTION_MAX_CHARS = int(os.getenv("EXTRACTION_MAX_CHARS", "1000000"))
+# share of printable characters below which extracted text is garbage
+MIN_READABLE_RATIO = 0.9
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class ExtractionError(Exception):
+    pass
+
+
+# Cut text to the configured length
+class TextBuffer:
+    def __init__(self, max_chars: int):
+        self.parts = []
+        self.remaining = max_chars
+
+    @property
+    def full(self):
+        return self.remaining <= 0
+
+    def append(self, text: str):
+        if self.full or not text or not (self.parts or text.strip()):
+            return
+        text = text[: self.remaining]
+        self.parts.append(text)
+        self.remaining -= len(text)
+
+    def text(self):
+        lines = "".join(self.parts).splitlines()
+        return "\n".join(" ".join(line.split()) for line in lines if line.strip())
+
+
+# Text of a .docx, read from word/document.xml without loading the tree
+def docx_text(path: str, max_chars: int = EXTRACTION_MAX_CHARS):
+    buffer = TextBuffer(max_chars)
+    try:
+        with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+            for _, element in ElementTree.iterparse(xml):
+                tag = element.tag
+                if tag == f"{WORD_NAMESPACE}t":
+                    buffer.append(element.text or "")
+                elif tag in (f"{WORD_NAMESPACE}tab", f"{WORD_NAMESPACE}br"):
+                    buffer.append(" ")
+                elif tag == f"{WORD_NAMESPACE}p":
+                    buffer.append("\n")
+                    element.clear()
+                if buffer.full:
+                    break
+    except (KeyError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+        raise ExtractionError(f"Not a readable .docx: {e}") from e
+    return buffer.text()
+
+
+# Text of a .pdf, page by page; fonts are decoded through their ToUnicode
+# maps, so text drawn with CID fonts comes out readable
+def pdf_text(path: str, max_chars: int = EXTRACTION_MAX_CHARS):
+    buffer = TextBuffer(max_chars)
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted and not reader.decrypt(""):
+            raise ExtractionError("Not a readable .pdf: encrypted")
+        for page in reader.pages:
+            buffer.append(page.extract_text() + "\n")
+            if buffer.full:
+                break
+    except PyPdfError as e:
+        raise ExtractionError(f"Not a readable .pdf: {e}") from e
+    return buffer.text()
+
+
+# Whether extracted text is mostly printable; fonts without a usable
+# encoding come out as control and private use characters
+def readable_text(text: str):
+    printable = sum(
+        char.isprintable() and char != "\ufffd" or char.isspace() for char in text
+    )
+    return printable >= len(text) * MIN_READABLE_RATIO
+
+
+EXTRACTORS = {"pdf": pdf_text, "docx": docx_text}
+
+
+def extractable(filename: str):
+    return filename.rsplit(".", 1)[-1].lower() in EXTRACTORS
+
+
+# Runs in an extraction process; raises ExtractionError for text that
+# cannot be read
+def extract_text(path: str, filename: str):
+    text = EXTRACTORS[filename.rsplit(".", 1)[-1].lower()](path)
+    if not readable_text(text):
+        raise ExtractionError("Extracted text is unreadable")
+    return text
+
+
+# Keeps a runaway document from taking the memory of the whole host; an
+# extraction over the limit fails with MemoryError
+def limit_worker_memory(max_mb: int):
+    if resource is not None and max_mb > 0:
+        limit = max_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# Process pool for text extraction, replaced when a worker dies; workers
+# are spawned rather than forked so the memory limit applies to their own
+# allocations, not to the address space of the API process
+class ExtractionPool:
+    def __init__(self, workers: int, memory_mb: int):
+        self.workers = workers
+        self.memory_mb = memory_mb
+        self.restarts = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=limit_worker_memory,
+                    initargs=(self.memory_mb,),
+                )
+            return self._executor
+
+    # text of the file at path, raises ExtractionError when it cannot be read
+    def extract(self, path: str, filename: str):
+        executor = self._get_executor()
+        try:
+            return executor.submit(extract_text, path, filename).result()
+        except BrokenProcessPool as e:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+                    self.restarts += 1
+            executor.shutdown(wait=False)
+            raise ExtractionError("Extraction process died") from e
+        except MemoryError as e:
+            raise ExtractionError("Document needs too much memory") from e
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+# Throughput of the extraction pipeline, counted over the time spent working
+class ExtractionMetrics:
+    def __init__(self):
+        self.documents = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, documents: int, failed: int, size: int, started: float):
+        with self._lock:
+            self.documents += documents
+            self.failed += failed
+            self.bytes += size
+            self.seconds += time.monotonic() - started
+
+    def stats(self):
+        with self._lock:
+            seconds = self.seconds or None
+            return {
+                "documents": self.documents,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "seconds": round(self.seconds, 3),
+                "docs_per_second": (
+                    round(self.documents / seconds, 2) if seconds else 0.0
+                ),
+                "mb_per_second": (
+                    round(self.bytes / seconds / 1024 / 1024, 2) if seconds else 0.0
+                ),
+            }
+
+
+extraction_pool = ExtractionPool(EXTRACTION_WORKERS, EXTRACTION_WORKER_MEMORY_MB)
+extraction_metrics = ExtractionMetrics()
@@ -0,0 +1,116 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+# processes rendering logo variants
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# longest side of each logo variant, in pixels
+LOGO_VARIANT_SIZES = tuple(
+    sorted(
+        int(size) for size in os.getenv("LOGO_VARIANT_SIZES", "64,128,400").split(",")
+    )
+)
+# formats every variant is stored in, WebP only where Pillow can write it
+LOGO_VARIANT_FORMATS = tuple(
+    name for name in ("webp", "png") if name != "webp" or features.check("webp")
+)
+# larger logos are stored without variants
+LOGO_VARIANT_MAX_BYTES = int(os.getenv("LOGO_VARIANT_MAX_BYTES", str(20 * 1024 * 1024)))
+# images with more pixels are refused, guards against decompression bombs
+LOGO_MAX_PIXELS = 50_000_000
+
+CONTENT_TYPES = {"webp": "image/webp", "png": "image/png"}
+SAVE_OPTIONS = {"webp": {"quality": 80, "method": 4}, "png": {"optimize": True}}
+
+
+class ImageError(Exception):
+    pass
+
+
+# Name of a variant, also the last part of its key: "<size>.<format>"
+def variant_name(size: int, image_format: str):
+    return f"{size}.{image_format}"
+
+
+def parse_variant_name(name: str):
+    size, image_format = name.split(".")
+    return int(size), image_format
+
+
+# Runs in an image process. Variants keep the aspect ratio, fit in a square
+# of their size and are never larger than the original; returns their
+# content by variant name
+def render_logo_variants(data: bytes, sizes: tuple, formats: tuple):
+    Image.MAX_IMAGE_PIXELS = LOGO_MAX_PIXELS
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            # JPEGs are decoded at the smallest scale covering the largest size
+            original.draft("RGB", (max(sizes), max(sizes)))
+            image = ImageOps.exif_transpose(original)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+                "transparency" in image.info
+            )
+            image = image.convert("RGBA" if has_alpha else "RGB")
+            variants = {}
+            # each size is scaled down from the one above it
+            for size in sorted(sizes, reverse=True):
+                image.thumbnail((size, size), Image.LANCZOS)
+                for image_format in formats:
+                    output = io.BytesIO()
+                    image.save(
+                        output, format=image_format, **SAVE_OPTIONS[image_format]
+                    )
+                    variants[variant_name(size, image_format)] = output.getvalue()
+            return variants
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImageError(f"Not a readable image: {e}") from e
+
+
+# Process pool for image work, replaced when a worker dies; workers are
+# spawned so they do not inherit the threads of the API process
+class ImagePool:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.restarts = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    async def run(self, func, *args):
+        executor = self._get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, func, *args
+            )
+        except BrokenProcessPool as e:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+                    self.restarts += 1
+            executor.shutdown(wait=False)
+            raise ImageError("Image process died") from e
+        except MemoryError as e:
+            raise ImageError("Image needs too much memory") from e
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+image_pool = ImagePool(IMAGE_WORKERS)
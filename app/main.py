@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -8,26 +9,61 @@ from app.api import document_endpoints
 from app.api import projects_endpoints
 from app.api import user_endpoints
 from app.api import logo_endpoints
+from app.api import internal_endpoints
+from app.auth.hashing import password_executor
+from app.middleware import BodySizeLimitMiddleware, ReadYourWritesMiddleware
+from app.extraction import extraction_pool
+from app.images import image_pool
+from app.workers import (
+    blob_collector,
+    text_extractor,
+    upload_worker_pool,
+    version_purger,
+)
 
 models.Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    upload_worker_pool.start()
+    blob_collector.start()
+    version_purger.start()
+    text_extractor.start()
+    yield
+    text_extractor.stop()
+    extraction_pool.shutdown()
+    image_pool.shutdown()
+    version_purger.stop()
+    blob_collector.stop()
+    upload_worker_pool.stop()
+    password_executor.shutdown()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     openapi_tags=[
         {"name": "User Methods", "description": "Operations related to users"},
         {"name": "Project Methods", "description": "Operations related to project"},
         {"name": "Document Methods", "description": "Operations related to documents"},
         {"name": "Logo Methods", "description": "Operations related to logos"},
-    ]
+    ],
 )
 
 # register the rate limit exceeded handler
 app.state.limiter = user_endpoints.limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# reject oversized uploads before they are read
+app.add_middleware(BodySizeLimitMiddleware)
+# keep clients that just wrote reading from the primary
+app.add_middleware(ReadYourWritesMiddleware)
+
 app.include_router(document_endpoints.router)
 app.include_router(projects_endpoints.router)
 app.include_router(user_endpoints.router)
 app.include_router(logo_endpoints.router)
+app.include_router(internal_endpoints.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,132 @@
+import math
+import os
+from http.cookies import CookieError, SimpleCookie
+
+from fastapi import status
+from starlette.responses import JSONResponse
+
+from app.database import (
+    LAST_WRITE_COOKIE,
+    LAST_WRITE_HEADER,
+    READ_YOUR_WRITES_WINDOW,
+    RequestWrites,
+    request_writes,
+)
+
+# largest request body accepted, in bytes
+MAX_REQUEST_BODY_SIZE = int(os.getenv("MAX_REQUEST_BODY_SIZE", str(100 * 1024 * 1024)))
+
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+
+# Reject oversized request bodies before they are spooled: up front from
+# Content-Length, or while receiving when the body is chunked
+class BodySizeLimitMiddleware:
+    def __init__(self, app, max_body_size: int = None):
+        self.app = app
+        self._max_body_size = max_body_size
+
+    @property
+    def max_body_size(self):
+        if self._max_body_size is None:
+            return MAX_REQUEST_BODY_SIZE
+        return self._max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > self.max_body_size:
+                await self._reject(scope, receive, send)
+                return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise RequestBodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestBodyTooLarge:
+            if response_started:
+                raise
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={
+                "detail": f"Request body exceeds {self.max_body_size} bytes",
+            },
+        )
+        await response(scope, receive, send)
+
+
+# Time of the client's last write from the last-write header or cookie
+def last_write_at(headers: dict):
+    value = headers.get(LAST_WRITE_HEADER.encode())
+    if value is None and b"cookie" in headers:
+        try:
+            cookie = SimpleCookie(headers[b"cookie"].decode("latin-1"))
+        except CookieError:
+            cookie = {}
+        if LAST_WRITE_COOKIE in cookie:
+            value = cookie[LAST_WRITE_COOKIE].value.encode()
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Track the writes of each request and hand the client a last-write cookie
+# and header after it wrote, so its reads stay on the primary for
+# READ_YOUR_WRITES_WINDOW seconds on any API process
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        writes = RequestWrites(last_write_at(dict(scope["headers"])))
+
+        async def marking_send(message):
+            if message["type"] == "http.response.start" and writes.wrote_at:
+                value = f"{writes.wrote_at:.3f}"
+                cookie = (
+                    f"{LAST_WRITE_COOKIE}={value}; "
+                    f"Max-Age={math.ceil(READ_YOUR_WRITES_WINDOW)}; "
+                    "Path=/; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [
+                    (LAST_WRITE_HEADER.encode(), value.encode()),
+                    (b"set-cookie", cookie.encode()),
+                ]
+            await send(message)
+
+        token = request_writes.set(writes)
+        try:
+            await self.app(scope, receive, marking_send)
+        finally:
+            request_writes.reset(token)
@@ -1,12 +1,37 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Integer,
+    String,
+    Text,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+    func,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from app.database import Base
+from app.search import register_search_ddl
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
 
 
 class ProjectParticipant(Base):
     __tablename__ = "project_participants"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "project_id", name="uq_project_participants_user_id_project_id"
+        ),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey("projects.project_id", ondelete="CASCADE"))
     user_id = Column(Integer, ForeignKey("users.id"))
 
@@ -17,12 +42,21 @@ class ProjectParticipant(Base):
 
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (
+        Index("ix_projects_owner_id_project_id", "owner_id", "project_id"),
+    )
 
-    project_id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, primary_key=True)
     name = Column(String, index=True)
-    description = Column(String, index=True)
+    description = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
-    logo_url = Column(String, index=True)
+    logo_url = Column(String)
+    # names of the resized copies of the logo, "<size>.<format>" separated
+    # by commas; empty while the logo has none
+    logo_variants = Column(String)
+    # name and description words, maintained by a trigger on Postgres and
+    # only read by search; SQLite searches its project_search FTS5 table instead
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
 
     # relationships
     owner = relationship("User", back_populates="projects")
@@ -45,7 +79,7 @@ class Project(Base):
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String, nullable=False)
 
@@ -61,9 +95,180 @@ class User(Base):
 
 class Document(Base):
     __tablename__ = "documents"
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        Index("ix_documents_project_id_id", "project_id", "id"),
+        UniqueConstraint(
+            "project_id", "filename", name="uq_documents_project_id_filename"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey("projects.project_id", ondelete="CASCADE"))
-    file_url = Column(String, index=True)
-    filename = Column(String, index=True)
+    file_url = Column(String)
+    filename = Column(String)
+    # set for documents stored content-addressed, shared with identical uploads
+    blob_digest = Column(String(64), ForeignKey("blobs.digest"), index=True)
+    # object metadata captured at upload, so HEAD and listings skip S3
+    size = Column(BigInteger)
+    content_type = Column(String)
+    # sha256 and CRC-32 of the content, unknown for presigned uploads
+    checksum = Column(String(64))
+    crc32 = Column(BigInteger)
+    etag = Column(String)
+    # bumped by every content update, earlier ones are kept as versions
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # filename words, maintained by a trigger on Postgres and only read by
+    # search; SQLite searches its document_search FTS5 table instead
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=utcnow,
+        server_default=func.now(),
+    )
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=utcnow,
+        onupdate=utcnow,
+        server_default=func.now(),
+    )
 
     project = relationship("Project", back_populates="documents")
+
+
+# Content a document had before an update; kept in its own object, or its
+# blob for content-addressed documents, until the retention period ends
+class DocumentVersion(Base):
+    __tablename__ = "document_versions"
+    __table_args__ = (
+        UniqueConstraint(
+            "document_id", "version", name="uq_document_versions_document_id_version"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(
+        Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False
+    )
+    version = Column(Integer, nullable=False)
+    file_url = Column(String, nullable=False)
+    blob_digest = Column(String(64), ForeignKey("blobs.digest"))
+    size = Column(BigInteger)
+    content_type = Column(String)
+    checksum = Column(String(64))
+    crc32 = Column(BigInteger)
+    etag = Column(String)
+    # when the version was written and when an update replaced it
+    created_at = Column(DateTime(timezone=True))
+    superseded_at = Column(
+        DateTime(timezone=True), nullable=False, default=utcnow, index=True
+    )
+
+
+# Text extracted from a document for content search, of the document
+# version it was extracted from; a newer document version is re-extracted
+class DocumentText(Base):
+    __tablename__ = "document_texts"
+
+    document_id = Column(
+        Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True
+    )
+    version = Column(Integer, nullable=False)
+    # indexed, failed or skipped; pending until the first extraction is done
+    status = Column(String, nullable=False)
+    content = Column(Text)
+    error = Column(String)
+    extracted_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    # set while a process extracts the document, others leave it alone
+    locked_until = Column(DateTime(timezone=True))
+    # maintained by a trigger on Postgres; SQLite searches its
+    # document_text_search FTS5 table instead
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
+
+
+# Every name handed out in a project, claimed atomically; the row of a
+# name is also the suffix counter of copies uploaded under that name
+class FilenameCounter(Base):
+    __tablename__ = "filename_counters"
+
+    project_id = Column(
+        Integer,
+        ForeignKey("projects.project_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    filename = Column(String, primary_key=True)
+    last_suffix = Column(Integer, nullable=False, default=0)
+
+
+class UploadJob(Base):
+    __tablename__ = "upload_jobs"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "idempotency_key", name="uq_upload_jobs_user_id_idempotency_key"
+        ),
+        Index("ix_upload_jobs_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey("projects.project_id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id"))
+    idempotency_key = Column(String)
+    # queued, running, succeeded or failed
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    # a running job whose lease expired is picked up again by another worker
+    locked_until = Column(DateTime(timezone=True))
+    last_error = Column(String)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow
+    )
+
+    items = relationship(
+        "UploadJobItem",
+        back_populates="job",
+        cascade="all, delete, delete-orphan",
+        order_by="UploadJobItem.id",
+    )
+
+
+class UploadJobItem(Base):
+    __tablename__ = "upload_job_items"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(
+        Integer, ForeignKey("upload_jobs.id", ondelete="CASCADE"), index=True
+    )
+    filename = Column(String, nullable=False)
+    stored_as = Column(String)
+    spool_path = Column(String, nullable=False)
+    # sha256, CRC-32 and size of the spooled file, computed while it was received
+    digest = Column(String(64))
+    crc32 = Column(BigInteger)
+    size = Column(BigInteger)
+    # pending, uploaded or failed
+    status = Column(String, nullable=False, default="pending")
+    error = Column(String)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"))
+
+    job = relationship("UploadJob", back_populates="items")
+
+
+# Content-addressed object in the documents bucket, shared by every
+# document with the same bytes
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    digest = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    # false until the object is in the bucket
+    stored = Column(Boolean, nullable=False, default=False)
+    etag = Column(String)
+    # when the last document let go of it; collected after a grace period
+    unreferenced_at = Column(DateTime(timezone=True), index=True)
+
+
+register_search_ddl(Document.__table__, DocumentText.__table__)
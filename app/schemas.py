@@ -5,7 +5,8 @@ from pydantic import (
     field_validator,
     model_validator,
 )
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 import re
 
 
@@ -25,10 +26,30 @@ class ProjectResponse(CreateUpdateProject):
     owner_id: int
 
 
+# Name of a cloned project, "<name> (copy)" when not given
+class CloneProjectRequest(BaseModel):
+    name: Optional[str] = Field(default=None, min_length=1)
+
+
 class Project(CreateUpdateProject):
     project_id: int
 
 
+class ProjectSearchResult(BaseModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+    rank: float
+
+
+class DocumentSearchResult(BaseModel):
+    id: int
+    project_id: int
+    filename: str
+    rank: float
+    snippet: Optional[str] = None
+
+
 class DocumentFilename(BaseModel):
     filename: str
 
@@ -83,3 +104,108 @@ class UsersLoginResponse(BaseModel):
 class DocumentResponse(BaseModel):
     id: int
     filename: str
+    size: Optional[int] = None
+    etag: Optional[str] = None
+
+
+class DocumentVersionResponse(BaseModel):
+    version: int
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    etag: Optional[str] = None
+    created_at: Optional[datetime] = None
+    superseded_at: datetime
+
+
+class MoveDocumentRequest(BaseModel):
+    project_id: int
+
+
+class PresignedUploadFile(BaseModel):
+    filename: str
+    size: int = Field(ge=0)
+
+
+class PresignedUploadRequest(BaseModel):
+    files: List[PresignedUploadFile] = Field(min_length=1)
+
+
+class PresignedUpload(BaseModel):
+    filename: str
+    stored_as: str
+    # single PUT for small files
+    url: Optional[str] = None
+    # multipart upload for large files, one URL per part
+    upload_id: Optional[str] = None
+    part_size: Optional[int] = None
+    part_urls: Optional[List[str]] = None
+    # sent back with the commit of this file
+    upload_token: str
+
+
+class UploadedPart(BaseModel):
+    part_number: int = Field(ge=1)
+    etag: str
+
+
+class CommittedUploadFile(BaseModel):
+    stored_as: str
+    upload_token: str
+    upload_id: Optional[str] = None
+    parts: Optional[List[UploadedPart]] = None
+
+
+class CommitUploadRequest(BaseModel):
+    files: List[CommittedUploadFile] = Field(min_length=1)
+
+
+class PresignedDownload(BaseModel):
+    url: str
+    expires_in: int
+
+
+# Documents to delete, either by id or every document of a project whose
+# name starts with filename_prefix
+class BulkDeleteRequest(BaseModel):
+    document_ids: Optional[List[int]] = Field(default=None, min_length=1)
+    project_id: Optional[int] = None
+    filename_prefix: Optional[str] = None
+
+    @model_validator(mode="after")
+    def ids_or_filter(self):
+        if (self.document_ids is None) == (self.project_id is None):
+            raise ValueError("Give either document_ids or project_id")
+        if self.document_ids is not None and self.filename_prefix is not None:
+            raise ValueError("filename_prefix needs project_id")
+        return self
+
+
+class BulkDeleteFailure(BaseModel):
+    id: int
+    error: str
+
+
+class BulkDeleteResponse(BaseModel):
+    deleted: List[int]
+    failed: List[BulkDeleteFailure]
+
+
+class UploadJobItemResponse(BaseModel):
+    filename: str
+    stored_as: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+    document_id: Optional[int] = None
+
+
+class UploadJobResponse(BaseModel):
+    job_id: int
+    project_id: int
+    status: str
+    attempts: int
+    next_attempt_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    total: int
+    uploaded: int
+    failed: int
+    items: List[UploadJobItemResponse]
@@ -0,0 +1,177 @@
+from sqlalchemy import DDL, event
+
+# Postgres keeps a weighted tsvector of each project's name and description
+# in projects.search_vector, and one of each document's filename in
+# documents.search_vector; a document change only touches its own row
+POSTGRES_SEARCH_FUNCTIONS = [
+    """
+CREATE OR REPLACE FUNCTION project_search_vector(
+    name VARCHAR, description TEXT
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION document_search_vector(filename VARCHAR)
+RETURNS tsvector AS $$
+    SELECT setweight(
+        to_tsvector('simple', translate(coalesce(filename, ''), '._-', '   ')), 'C'
+    )
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION projects_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := project_search_vector(NEW.name, NEW.description);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION documents_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := document_search_vector(NEW.filename);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+]
+
+POSTGRES_PROJECT_SEARCH_DDL = [
+    "CREATE INDEX ix_projects_search_vector ON projects USING gin (search_vector)",
+    """
+CREATE TRIGGER projects_search_vector
+BEFORE INSERT OR UPDATE OF name, description ON projects
+FOR EACH ROW EXECUTE FUNCTION projects_search_vector_trigger()
+""",
+]
+
+POSTGRES_DOCUMENT_SEARCH_DDL = [
+    "CREATE INDEX ix_documents_search_vector ON documents USING gin (search_vector)",
+    """
+CREATE TRIGGER documents_search_vector
+BEFORE INSERT OR UPDATE OF filename ON documents
+FOR EACH ROW EXECUTE FUNCTION documents_search_vector_trigger()
+""",
+    # trigram indexes for fuzzy and infix matches need the pg_trgm
+    # extension, search matches whole words and prefixes without it
+    """
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS ix_projects_name_trgm
+        ON projects USING gin (name gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_documents_filename_trgm
+        ON documents USING gin (filename gin_trgm_ops);
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is not available, project search uses words only';
+END
+$$
+""",
+]
+
+# Document texts keep a tsvector of their content for content search
+POSTGRES_DOCUMENT_TEXT_SEARCH_DDL = [
+    """
+CREATE OR REPLACE FUNCTION document_texts_search_vector_trigger()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('simple', coalesce(NEW.content, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE TRIGGER document_texts_search_vector
+BEFORE INSERT OR UPDATE OF content ON document_texts
+FOR EACH ROW EXECUTE FUNCTION document_texts_search_vector_trigger()
+""",
+    """
+CREATE INDEX ix_document_texts_search_vector
+ON document_texts USING gin (search_vector)
+""",
+]
+
+# SQLite has no tsvector, FTS5 tables keyed by project and document id
+# stand in
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE project_search USING fts5(name, description)",
+    """
+CREATE TRIGGER projects_search_insert AFTER INSERT ON projects BEGIN
+    INSERT INTO project_search (rowid, name, description)
+    VALUES (new.project_id, new.name, new.description);
+END
+""",
+    """
+CREATE TRIGGER projects_search_update AFTER UPDATE OF name, description ON projects
+BEGIN
+    UPDATE project_search SET name = new.name, description = new.description
+    WHERE rowid = new.project_id;
+END
+""",
+    """
+CREATE TRIGGER projects_search_delete AFTER DELETE ON projects BEGIN
+    DELETE FROM project_search WHERE rowid = old.project_id;
+END
+""",
+    "CREATE VIRTUAL TABLE document_search USING fts5(filename)",
+    """
+CREATE TRIGGER documents_search_insert AFTER INSERT ON documents BEGIN
+    INSERT INTO document_search (rowid, filename) VALUES (new.id, new.filename);
+END
+""",
+    """
+CREATE TRIGGER documents_search_update AFTER UPDATE OF filename ON documents BEGIN
+    UPDATE document_search SET filename = new.filename WHERE rowid = new.id;
+END
+""",
+    """
+CREATE TRIGGER documents_search_delete AFTER DELETE ON documents BEGIN
+    DELETE FROM document_search WHERE rowid = old.id;
+END
+""",
+]
+
+
+SQLITE_DOCUMENT_TEXT_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE document_text_search USING fts5(content)",
+    """
+CREATE TRIGGER document_texts_search_insert AFTER INSERT ON document_texts BEGIN
+    INSERT INTO document_text_search (rowid, content)
+    VALUES (new.document_id, new.content);
+END
+""",
+    """
+CREATE TRIGGER document_texts_search_update AFTER UPDATE OF content
+ON document_texts BEGIN
+    UPDATE document_text_search SET content = new.content
+    WHERE rowid = new.document_id;
+END
+""",
+    """
+CREATE TRIGGER document_texts_search_delete AFTER DELETE ON document_texts BEGIN
+    DELETE FROM document_text_search WHERE rowid = old.document_id;
+END
+""",
+]
+
+
+# Create the search functions, triggers and indexes for schemas made by
+# metadata.create_all(), once both tables they use exist
+def register_search_ddl(documents_table, document_texts_table):
+    postgres_ddl = (
+        POSTGRES_SEARCH_FUNCTIONS
+        + POSTGRES_PROJECT_SEARCH_DDL
+        + POSTGRES_DOCUMENT_SEARCH_DDL
+    )
+    for table, dialect, statements in (
+        (documents_table, "postgresql", postgres_ddl),
+        (documents_table, "sqlite", SQLITE_SEARCH_DDL),
+        (document_texts_table, "postgresql", POSTGRES_DOCUMENT_TEXT_SEARCH_DDL),
+        (document_texts_table, "sqlite", SQLITE_DOCUMENT_TEXT_SEARCH_DDL),
+    ):
+        for statement in statements:
+            event.listen(
+                table, "after_create", DDL(statement).execute_if(dialect=dialect)
+            )
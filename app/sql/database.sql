@@ -11,7 +11,9 @@ CREATE TABLE projects (
     name VARCHAR(100) NOT NULL,
     description TEXT,
     owner_id INT REFERENCES users(id),
-    logo_url VARCHAR(100)
+    logo_url VARCHAR(100),
+    logo_variants VARCHAR,
+    search_vector TSVECTOR
 );
 
 -- Create table 'project_participants'
@@ -26,5 +28,178 @@ CREATE TABLE documents (
     id SERIAL PRIMARY KEY,
     project_id INT REFERENCES projects(project_id) ON DELETE CASCADE,
     filename VARCHAR(100) NOT NULL,
-    file_url VARCHAR(100) NOT NULL
-);
\ No newline at end of file
+    file_url VARCHAR NOT NULL,
+    size BIGINT,
+    content_type VARCHAR,
+    checksum VARCHAR(64),
+    crc32 BIGINT,
+    etag VARCHAR,
+    version INT NOT NULL DEFAULT 1,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    search_vector TSVECTOR
+);
+
+CREATE INDEX ix_documents_project_id_id ON documents (project_id, id);
+ALTER TABLE documents
+    ADD CONSTRAINT uq_documents_project_id_filename UNIQUE (project_id, filename);
+ALTER TABLE project_participants
+    ADD CONSTRAINT uq_project_participants_user_id_project_id UNIQUE (user_id, project_id);
+CREATE INDEX ix_projects_owner_id_project_id ON projects (owner_id, project_id);
+
+-- Create table 'filename_counters'
+CREATE TABLE filename_counters (
+    project_id INT REFERENCES projects(project_id) ON DELETE CASCADE,
+    filename VARCHAR NOT NULL,
+    last_suffix INT NOT NULL,
+    PRIMARY KEY (project_id, filename)
+);
+
+-- Create table 'upload_jobs'
+CREATE TABLE upload_jobs (
+    id SERIAL PRIMARY KEY,
+    project_id INT REFERENCES projects(project_id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id),
+    idempotency_key VARCHAR,
+    status VARCHAR NOT NULL,
+    attempts INT NOT NULL,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    locked_until TIMESTAMP WITH TIME ZONE,
+    last_error VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT uq_upload_jobs_user_id_idempotency_key UNIQUE (user_id, idempotency_key)
+);
+
+CREATE INDEX ix_upload_jobs_status_next_attempt_at ON upload_jobs (status, next_attempt_at);
+
+-- Create table 'upload_job_items'
+CREATE TABLE upload_job_items (
+    id SERIAL PRIMARY KEY,
+    job_id INT REFERENCES upload_jobs(id) ON DELETE CASCADE,
+    filename VARCHAR NOT NULL,
+    stored_as VARCHAR,
+    spool_path VARCHAR NOT NULL,
+    digest VARCHAR(64),
+    crc32 BIGINT,
+    size BIGINT,
+    status VARCHAR NOT NULL,
+    error VARCHAR,
+    document_id INT REFERENCES documents(id) ON DELETE SET NULL
+);
+
+CREATE INDEX ix_upload_job_items_job_id ON upload_job_items (job_id);
+
+-- Create table 'blobs'
+CREATE TABLE blobs (
+    digest VARCHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    refcount INT NOT NULL,
+    stored BOOLEAN NOT NULL,
+    etag VARCHAR,
+    unreferenced_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX ix_blobs_unreferenced_at ON blobs (unreferenced_at);
+ALTER TABLE documents ADD COLUMN blob_digest VARCHAR(64) REFERENCES blobs(digest);
+CREATE INDEX ix_documents_blob_digest ON documents (blob_digest);
+
+-- Create table 'document_versions'
+CREATE TABLE document_versions (
+    id SERIAL PRIMARY KEY,
+    document_id INT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    version INT NOT NULL,
+    file_url VARCHAR NOT NULL,
+    blob_digest VARCHAR(64) REFERENCES blobs(digest),
+    size BIGINT,
+    content_type VARCHAR,
+    checksum VARCHAR(64),
+    crc32 BIGINT,
+    etag VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE,
+    superseded_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT uq_document_versions_document_id_version UNIQUE (document_id, version)
+);
+
+CREATE INDEX ix_document_versions_superseded_at ON document_versions (superseded_at);
+
+-- Full-text search over project names and descriptions, and over the
+-- filename of each document
+CREATE OR REPLACE FUNCTION project_search_vector(
+    name VARCHAR, description TEXT
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION document_search_vector(filename VARCHAR)
+RETURNS tsvector AS $$
+    SELECT setweight(
+        to_tsvector('simple', translate(coalesce(filename, ''), '._-', '   ')), 'C'
+    )
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION projects_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := project_search_vector(NEW.name, NEW.description);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION documents_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := document_search_vector(NEW.filename);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX ix_projects_search_vector ON projects USING gin (search_vector);
+
+CREATE TRIGGER projects_search_vector
+BEFORE INSERT OR UPDATE OF name, description ON projects
+FOR EACH ROW EXECUTE FUNCTION projects_search_vector_trigger();
+
+CREATE INDEX ix_documents_search_vector ON documents USING gin (search_vector);
+
+CREATE TRIGGER documents_search_vector
+BEFORE INSERT OR UPDATE OF filename ON documents
+FOR EACH ROW EXECUTE FUNCTION documents_search_vector_trigger();
+
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS ix_projects_name_trgm
+        ON projects USING gin (name gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS ix_documents_filename_trgm
+        ON documents USING gin (filename gin_trgm_ops);
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is not available, project search uses words only';
+END
+$$;
+
+-- Create table 'document_texts', text extracted from documents for content search
+CREATE TABLE document_texts (
+    document_id INT PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+    version INT NOT NULL,
+    status VARCHAR NOT NULL,
+    content TEXT,
+    error VARCHAR,
+    extracted_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    locked_until TIMESTAMP WITH TIME ZONE,
+    search_vector TSVECTOR
+);
+
+CREATE OR REPLACE FUNCTION document_texts_search_vector_trigger()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('simple', coalesce(NEW.content, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER document_texts_search_vector
+BEFORE INSERT OR UPDATE OF content ON document_texts
+FOR EACH ROW EXECUTE FUNCTION document_texts_search_vector_trigger();
+
+CREATE INDEX ix_document_texts_search_vector
+ON document_texts USING gin (search_vector);
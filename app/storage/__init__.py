@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+from app.storage.base import (
+    InvalidRange,
+    NotModified,
+    ObjectNotFound,
+    StorageBackend,
+    StorageError,
+)
+from app.storage.cache import CachedStorage
+from app.storage.local import LocalStorage
+from app.storage.memory import MemoryStorage
+from app.storage.s3 import S3Storage
+
+# "s3", "local" or "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+# root of the "local" backend, one directory per bucket below it
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "storage")
+# disk cache of hot objects, off while STORAGE_CACHE_MAX_BYTES is 0; every
+# process caches in its own subdirectory up to STORAGE_CACHE_MAX_BYTES
+STORAGE_CACHE_DIR = os.getenv(
+    "STORAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "storage-cache")
+)
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", "0"))
+# larger objects are streamed from the backend, defaults to a quarter of the cache
+STORAGE_CACHE_MAX_OBJECT_BYTES = int(os.getenv("STORAGE_CACHE_MAX_OBJECT_BYTES", "0"))
+# how long a cached object is served before its ETag is checked again
+STORAGE_CACHE_REVALIDATE_SECONDS = float(
+    os.getenv("STORAGE_CACHE_REVALIDATE_SECONDS", "0")
+)
+
+# disk caches of this process, keyed by name
+storage_cache_registry = {}
+
+
+# Backend for one bucket as configured, behind the disk cache when enabled
+def build_storage(bucket: str, name: str):
+    if STORAGE_BACKEND == "local":
+        backend = LocalStorage(os.path.join(LOCAL_STORAGE_DIR, bucket or name))
+    elif STORAGE_BACKEND == "memory":
+        backend = MemoryStorage()
+    else:
+        backend = S3Storage(bucket)
+    if STORAGE_CACHE_MAX_BYTES <= 0:
+        return backend
+    cached = CachedStorage(
+        backend,
+        os.path.join(STORAGE_CACHE_DIR, name),
+        STORAGE_CACHE_MAX_BYTES,
+        STORAGE_CACHE_MAX_OBJECT_BYTES or None,
+        STORAGE_CACHE_REVALIDATE_SECONDS,
+    )
+    storage_cache_registry[name] = cached
+    return cached
+
+
+__all__ = [
+    "CachedStorage",
+    "InvalidRange",
+    "LocalStorage",
+    "MemoryStorage",
+    "NotModified",
+    "ObjectNotFound",
+    "S3Storage",
+    "StorageBackend",
+    "StorageError",
+    "build_storage",
+    "storage_cache_registry",
+]
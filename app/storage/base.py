@@ -0,0 +1,155 @@
+import re
+
+SINGLE_BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectNotFound(StorageError):
+    pass
+
+
+class InvalidRange(StorageError):
+    pass
+
+
+# Raised by a conditional get when the object still has the given ETag
+class NotModified(StorageError):
+    pass
+
+
+# (start, end) of a single "bytes=a-b" range, either None when left open;
+# None for anything else, such as multiple ranges
+def parse_byte_range(byte_range: str):
+    match = SINGLE_BYTE_RANGE.match(byte_range.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    return (int(start) if start else None, int(end) if end else None)
+
+
+# Inclusive (start, end) of a "bytes=a-b" range in an object of `size` bytes
+def resolve_range(byte_range: str, size: int):
+    parsed = parse_byte_range(byte_range)
+    if parsed is None:
+        raise InvalidRange(f"Unsupported range: {byte_range}")
+    start, end = parsed
+    if start is None:
+        # suffix range, the last `end` bytes
+        start, end = max(size - end, 0), size - 1
+    else:
+        end = min(end, size - 1) if end is not None else size - 1
+    if start >= size or start > end:
+        raise InvalidRange(f"Range {byte_range} outside of {size} bytes")
+    return start, end
+
+
+# File-like view of the next `length` bytes of a stream
+class LimitedReader:
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int = -1):
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        chunk = self.stream.read(size)
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self.stream.close()
+
+
+# GetObject-shaped response of an open object, cut down to `byte_range`
+def object_response(
+    stream, size: int, content_type=None, etag=None, last_modified=None, byte_range=None
+):
+    response = {
+        "ContentType": content_type,
+        "ETag": etag,
+        "LastModified": last_modified,
+    }
+    if byte_range:
+        try:
+            start, end = resolve_range(byte_range, size)
+        except InvalidRange:
+            stream.close()
+            raise
+        stream.seek(start)
+        response.update(
+            Body=LimitedReader(stream, end - start + 1),
+            ContentLength=end - start + 1,
+            ContentRange=f"bytes {start}-{end}/{size}",
+        )
+    else:
+        response.update(Body=stream, ContentLength=size)
+    return response
+
+
+# Object store the documents and logos are kept in; get() and head() answer
+# with the same dicts as S3 GetObject and HeadObject
+class StorageBackend:
+    name = "storage"
+    supports_presigned_urls = False
+
+    # store fileobj under key, returns its ETag
+    def put(self, key: str, fileobj, content_type: str = None, part_size: int = None):
+        raise NotImplementedError
+
+    # open an object, raises NotModified when if_none_match is its ETag
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None):
+        raise NotImplementedError
+
+    def head(self, key: str):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    # copy an object to another key of the same store, returns the copy's
+    # ETag; backends that can copy without reading the bytes override this
+    def copy(self, source_key: str, key: str, size: int = None, part_size: int = None):
+        response = self.get(source_key)
+        try:
+            return self.put(
+                key, response["Body"], response.get("ContentType"), part_size
+            )
+        finally:
+            response["Body"].close()
+
+    # delete several objects, returns an error message per key that failed
+    def delete_many(self, keys: list):
+        errors = {}
+        for key in keys:
+            try:
+                self.delete(key)
+            except StorageError as e:
+                errors[key] = str(e)
+        return errors
+
+    # delete every object under prefix, returns how many there were
+    def delete_prefix(self, prefix: str):
+        raise NotImplementedError
+
+    def presign_download(self, key: str, filename: str, expires_in: int):
+        raise StorageError(f"{self.name} storage has no presigned URLs")
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int):
+        raise StorageError(f"{self.name} storage has no presigned URLs")
+
+    def create_multipart_upload(self, key: str, content_type: str):
+        raise StorageError(f"{self.name} storage has no presigned URLs")
+
+    def presign_upload_part(
+        self, key: str, upload_id: str, part_number: int, expires_in: int
+    ):
+        raise StorageError(f"{self.name} storage has no presigned URLs")
+
+    # parts are {"PartNumber", "ETag"} dicts, returns the object's ETag
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list):
+        raise StorageError(f"{self.name} storage has no presigned URLs")
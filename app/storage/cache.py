@@ -0,0 +1,264 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.storage.base import (
+    NotModified,
+    ObjectNotFound,
+    StorageBackend,
+    object_response,
+)
+
+# bytes copied per read while filling the cache
+FILL_CHUNK_SIZE = 1024 * 1024
+
+
+def process_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Read-through cache of whole objects on local disk in front of another
+# backend, bounded by total size with least recently used eviction; a hit
+# is revalidated against the backend with a conditional get on its ETag.
+# Each process caches in its own subdirectory of cache_dir, named by its
+# pid, so max_bytes bounds the cache of one process
+class CachedStorage(StorageBackend):
+    def __init__(
+        self,
+        backend: StorageBackend,
+        cache_dir: str,
+        max_bytes: int,
+        max_object_bytes: int = None,
+        revalidate_seconds: float = 0,
+    ):
+        self.backend = backend
+        self.name = backend.name
+        self.supports_presigned_urls = backend.supports_presigned_urls
+        self.root_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes or max_bytes // 4
+        self.revalidate_seconds = revalidate_seconds
+        self._start()
+        # a forked worker must not share the entries of its parent
+        os.register_at_fork(after_in_child=self._start)
+
+    # Start an empty cache in the directory of this process; entries do not
+    # survive a restart, so directories of exited processes are dropped
+    def _start(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_dir = os.path.join(self.root_dir, str(os.getpid()))
+
+        os.makedirs(self.root_dir, exist_ok=True)
+        for entry in os.scandir(self.root_dir):
+            if not entry.name.isdigit() or not entry.is_dir():
+                continue
+            pid = int(entry.name)
+            if pid == os.getpid() or not process_alive(pid):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lookup(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry["size"]
+            try:
+                os.unlink(entry["path"])
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_prefix(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    # Copy a full GetObject response to disk and make it the entry of key
+    def _fill(self, key: str, response: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = response["Body"].read(FILL_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    tmp.write(chunk)
+                    size += len(chunk)
+            path = os.path.join(self.cache_dir, uuid.uuid4().hex)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            response["Body"].close()
+
+        entry = {
+            "path": path,
+            "size": size,
+            "etag": response.get("ETag"),
+            "content_type": response.get("ContentType"),
+            "last_modified": response.get("LastModified"),
+            "validated_at": time.monotonic(),
+        }
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def _open(self, entry: dict, byte_range: str = None):
+        try:
+            stream = open(entry["path"], "rb")
+        except FileNotFoundError:
+            # evicted since it was looked up
+            return None
+        return object_response(
+            stream,
+            entry["size"],
+            entry["content_type"],
+            entry["etag"],
+            entry["last_modified"],
+            byte_range,
+        )
+
+    # Ask the backend whether a cached copy is still current, False when
+    # the object changed or is gone and the entry was dropped
+    def _revalidate(self, key: str, entry: dict):
+        if time.monotonic() - entry["validated_at"] < self.revalidate_seconds:
+            return True
+        try:
+            response = self.backend.get(key, if_none_match=entry["etag"])
+        except NotModified:
+            entry["validated_at"] = time.monotonic()
+            return True
+        except ObjectNotFound:
+            self.invalidate(key)
+            raise
+        response["Body"].close()
+        self.invalidate(key)
+        self._count("stale")
+        return False
+
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None):
+        if if_none_match is not None:
+            return self.backend.get(key, byte_range, if_none_match)
+
+        entry = self._lookup(key)
+        if entry is not None and self._revalidate(key, entry):
+            response = self._open(entry, byte_range)
+            if response is not None:
+                self._count("hits")
+                return response
+        self._count("misses")
+
+        # only full reads fill the cache, ranges go straight to the backend
+        if byte_range:
+            return self.backend.get(key, byte_range)
+        response = self.backend.get(key)
+        if response["ContentLength"] > self.max_object_bytes:
+            return response
+        entry = self._fill(key, response)
+        return self._open(entry) or self.backend.get(key)
+
+    def put(self, key: str, fileobj, content_type: str = None, part_size: int = None):
+        try:
+            return self.backend.put(key, fileobj, content_type, part_size)
+        finally:
+            self.invalidate(key)
+
+    def head(self, key: str):
+        return self.backend.head(key)
+
+    def delete(self, key: str):
+        try:
+            self.backend.delete(key)
+        finally:
+            self.invalidate(key)
+
+    def copy(self, source_key: str, key: str, size: int = None, part_size: int = None):
+        try:
+            return self.backend.copy(source_key, key, size, part_size)
+        finally:
+            self.invalidate(key)
+
+    def delete_many(self, keys: list):
+        try:
+            return self.backend.delete_many(keys)
+        finally:
+            for key in keys:
+                self.invalidate(key)
+
+    def delete_prefix(self, prefix: str):
+        try:
+            return self.backend.delete_prefix(prefix)
+        finally:
+            self.invalidate_prefix(prefix)
+
+    def presign_download(self, key: str, filename: str, expires_in: int):
+        return self.backend.presign_download(key, filename, expires_in)
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int):
+        self.invalidate(key)
+        return self.backend.presign_upload(key, content_type, expires_in)
+
+    def create_multipart_upload(self, key: str, content_type: str):
+        return self.backend.create_multipart_upload(key, content_type)
+
+    def presign_upload_part(
+        self, key: str, upload_id: str, part_number: int, expires_in: int
+    ):
+        return self.backend.presign_upload_part(key, upload_id, part_number, expires_in)
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list):
+        try:
+            return self.backend.complete_multipart_upload(key, upload_id, parts)
+        finally:
+            self.invalidate(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cache_dir": self.cache_dir,
+                "backend": self.backend.name,
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "max_object_bytes": self.max_object_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from app.storage.base import (
+    NotModified,
+    ObjectNotFound,
+    StorageBackend,
+    StorageError,
+    object_response,
+)
+
+# bytes copied per read while storing an object
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+# Objects as files under root/objects, with their content type and ETag in
+# a JSON sidecar under root/meta; writes land atomically through a rename
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.meta_dir = os.path.join(self.root, "meta")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.meta_dir, exist_ok=True)
+
+    def _paths(self, key: str):
+        parts = key.split("/")
+        if not key or any(part in ("", ".", "..") for part in parts):
+            raise StorageError(f"Invalid key: {key}")
+        return (
+            os.path.join(self.objects_dir, *parts),
+            os.path.join(self.meta_dir, *parts) + ".json",
+        )
+
+    def _write_atomic(self, path: str, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                result = write(tmp)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return result
+
+    def put(self, key: str, fileobj, content_type: str = None, part_size: int = None):
+        object_path, meta_path = self._paths(key)
+
+        def copy(target):
+            md5 = hashlib.md5()
+            while True:
+                chunk = fileobj.read(part_size or COPY_CHUNK_SIZE)
+                if not chunk:
+                    return f'"{md5.hexdigest()}"'
+                md5.update(chunk)
+                target.write(chunk)
+
+        try:
+            etag = self._write_atomic(object_path, copy)
+            meta = json.dumps({"ContentType": content_type, "ETag": etag}).encode()
+            self._write_atomic(meta_path, lambda target: target.write(meta))
+        except OSError as e:
+            raise StorageError(f"Failed to store {key}: {e}") from e
+        return etag
+
+    def _meta(self, key: str):
+        object_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "rb") as meta_file:
+                meta = json.load(meta_file)
+            stat = os.stat(object_path)
+        except FileNotFoundError:
+            raise ObjectNotFound(f"No object {key}")
+        meta.update(
+            ContentLength=stat.st_size,
+            LastModified=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        )
+        return object_path, meta
+
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None):
+        object_path, meta = self._meta(key)
+        if if_none_match is not None and if_none_match == meta["ETag"]:
+            raise NotModified(key)
+        try:
+            stream = open(object_path, "rb")
+        except FileNotFoundError:
+            raise ObjectNotFound(f"No object {key}")
+        return object_response(
+            stream,
+            meta["ContentLength"],
+            meta["ContentType"],
+            meta["ETag"],
+            meta["LastModified"],
+            byte_range,
+        )
+
+    def head(self, key: str):
+        return self._meta(key)[1]
+
+    def copy(self, source_key: str, key: str, size: int = None, part_size: int = None):
+        source_path, meta = self._meta(source_key)
+        object_path, meta_path = self._paths(key)
+        content_type, etag = meta["ContentType"], meta["ETag"]
+        try:
+            with open(source_path, "rb") as source:
+                self._write_atomic(
+                    object_path, lambda target: shutil.copyfileobj(source, target)
+                )
+            meta = json.dumps({"ContentType": content_type, "ETag": etag}).encode()
+            self._write_atomic(meta_path, lambda target: target.write(meta))
+        except OSError as e:
+            raise StorageError(f"Failed to copy {source_key}: {e}") from e
+        return etag
+
+    def delete(self, key: str):
+        for path in self._paths(key):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def delete_prefix(self, prefix: str):
+        deleted = 0
+        for directory, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                if filename.startswith(".tmp-"):
+                    continue
+                path = os.path.join(directory, filename)
+                key = os.path.relpath(path, self.objects_dir).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    self.delete(key)
+                    deleted += 1
+        return deleted
@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from datetime import datetime, timezone
+from io import BytesIO
+
+from app.storage.base import (
+    NotModified,
+    ObjectNotFound,
+    StorageBackend,
+    object_response,
+)
+
+
+# Objects kept in a dict, for tests and single-process development
+class MemoryStorage(StorageBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, fileobj, content_type: str = None, part_size: int = None):
+        data = fileobj.read()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            self._objects[key] = {
+                "data": data,
+                "ContentType": content_type,
+                "ETag": etag,
+                "LastModified": datetime.now(timezone.utc),
+            }
+        return etag
+
+    def _object(self, key: str):
+        with self._lock:
+            stored = self._objects.get(key)
+        if stored is None:
+            raise ObjectNotFound(f"No object {key}")
+        return stored
+
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None):
+        stored = self._object(key)
+        if if_none_match is not None and if_none_match == stored["ETag"]:
+            raise NotModified(key)
+        return object_response(
+            BytesIO(stored["data"]),
+            len(stored["data"]),
+            stored["ContentType"],
+            stored["ETag"],
+            stored["LastModified"],
+            byte_range,
+        )
+
+    def head(self, key: str):
+        stored = self._object(key)
+        return {
+            "ContentLength": len(stored["data"]),
+            "ContentType": stored["ContentType"],
+            "ETag": stored["ETag"],
+            "LastModified": stored["LastModified"],
+        }
+
+    def copy(self, source_key: str, key: str, size: int = None, part_size: int = None):
+        stored = self._object(source_key)
+        with self._lock:
+            self._objects[key] = dict(stored, LastModified=datetime.now(timezone.utc))
+        return stored["ETag"]
+
+    def delete(self, key: str):
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            keys = [key for key in self._objects if key.startswith(prefix)]
+            for key in keys:
+                del self._objects[key]
+        return len(keys)
+
+    def keys(self):
+        with self._lock:
+            return sorted(self._objects)
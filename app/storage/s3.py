@@ -0,0 +1,262 @@
+import os
+from contextlib import contextmanager
+
+import boto3
+from botocore.exceptions import ClientError
+
+from app.storage.base import (
+    InvalidRange,
+    NotModified,
+    ObjectNotFound,
+    StorageBackend,
+    StorageError,
+)
+
+# objects at least this large are sent as multipart uploads by default
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# keys per DeleteObjects request, the S3 maximum
+DELETE_BATCH_SIZE = 1000
+# larger objects are copied in parts of this size, CopyObject takes at most 5 GiB
+DEFAULT_COPY_PART_SIZE = 512 * 1024 * 1024
+
+NOT_FOUND_CODES = {"404", "NoSuchKey", "NotFound", "NoSuchUpload"}
+
+
+def default_s3_client():
+    return boto3.client(
+        "s3",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_DEFAULT_REGION"),
+    )
+
+
+# Turn S3 client errors into storage errors
+@contextmanager
+def translated_errors():
+    try:
+        yield
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        code = str(error.get("Code"))
+        message = error.get("Message") or code
+        if code in NOT_FOUND_CODES:
+            raise ObjectNotFound(message) from e
+        if code == "InvalidRange":
+            raise InvalidRange(message) from e
+        if code in ("304", "NotModified"):
+            raise NotModified(message) from e
+        raise StorageError(message) from e
+
+
+class S3Storage(StorageBackend):
+    name = "s3"
+    supports_presigned_urls = True
+
+    def __init__(self, bucket: str, client=None):
+        self.bucket = bucket
+        self.client = client or default_s3_client()
+
+    # Stream fileobj in parts, at most one part is held in memory at a time
+    def put(self, key: str, fileobj, content_type: str = None, part_size: int = None):
+        part_size = part_size or DEFAULT_PART_SIZE
+        extra = {"ContentType": content_type} if content_type else {}
+        with translated_errors():
+            part = fileobj.read(part_size)
+            if len(part) < part_size:
+                response = self.client.put_object(
+                    Bucket=self.bucket, Key=key, Body=part, **extra
+                )
+                return response["ETag"]
+
+            upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=key, **extra
+            )["UploadId"]
+            parts = []
+            try:
+                while part:
+                    part_number = len(parts) + 1
+                    response = self.client.upload_part(
+                        Bucket=self.bucket,
+                        Key=key,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        Body=part,
+                    )
+                    parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+                    # release the sent part before reading the next one
+                    part = None
+                    part = fileobj.read(part_size)
+                return self.complete_multipart_upload(key, upload_id, parts)
+            except Exception:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+                raise
+
+    def get(self, key: str, byte_range: str = None, if_none_match: str = None):
+        kwargs = {}
+        if byte_range:
+            kwargs["Range"] = byte_range
+        if if_none_match:
+            kwargs["IfNoneMatch"] = if_none_match
+        with translated_errors():
+            return self.client.get_object(Bucket=self.bucket, Key=key, **kwargs)
+
+    def head(self, key: str):
+        with translated_errors():
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+
+    def delete(self, key: str):
+        with translated_errors():
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    # Copy inside the bucket without the bytes passing through us; objects
+    # larger than a part are copied with UploadPartCopy
+    def copy(self, source_key: str, key: str, size: int = None, part_size: int = None):
+        part_size = part_size or DEFAULT_COPY_PART_SIZE
+        source = {"Bucket": self.bucket, "Key": source_key}
+        with translated_errors():
+            if size is None or size <= part_size:
+                try:
+                    response = self.client.copy_object(
+                        Bucket=self.bucket, Key=key, CopySource=source
+                    )
+                    return response["CopyObjectResult"]["ETag"]
+                except ClientError as e:
+                    # objects of unknown size are tried in one request
+                    # first, CopyObject refuses those over 5 GiB
+                    code = e.response.get("Error", {}).get("Code")
+                    if size is not None or code != "InvalidRequest":
+                        raise
+            head = self.client.head_object(Bucket=self.bucket, Key=source_key)
+            size = head["ContentLength"]
+
+            extra = (
+                {"ContentType": head["ContentType"]} if head.get("ContentType") else {}
+            )
+            upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=key, **extra
+            )["UploadId"]
+            try:
+                parts = []
+                for start in range(0, size, part_size):
+                    end = min(start + part_size, size) - 1
+                    response = self.client.upload_part_copy(
+                        Bucket=self.bucket,
+                        Key=key,
+                        UploadId=upload_id,
+                        PartNumber=len(parts) + 1,
+                        CopySource=source,
+                        CopySourceRange=f"bytes={start}-{end}",
+                    )
+                    parts.append(
+                        {
+                            "PartNumber": len(parts) + 1,
+                            "ETag": response["CopyPartResult"]["ETag"],
+                        }
+                    )
+                return self.complete_multipart_upload(key, upload_id, parts)
+            except Exception:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+                raise
+
+    # DeleteObjects in batches; a failed batch fails each of its keys
+    def delete_many(self, keys: list):
+        errors = {}
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            stop = start + DELETE_BATCH_SIZE
+            batch = keys[start:stop]
+            try:
+                with translated_errors():
+                    response = self.client.delete_objects(
+                        Bucket=self.bucket,
+                        Delete={
+                            "Objects": [{"Key": key} for key in batch],
+                            "Quiet": True,
+                        },
+                    )
+            except StorageError as e:
+                errors.update((key, str(e)) for key in batch)
+                continue
+            for error in response.get("Errors", []):
+                errors[error["Key"]] = error.get("Message") or error.get("Code")
+        return errors
+
+    # objects S3 refuses to delete are reported once every page was tried
+    def delete_prefix(self, prefix: str):
+        deleted = 0
+        errors = {}
+        with translated_errors():
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(
+                Bucket=self.bucket,
+                Prefix=prefix,
+                PaginationConfig={"PageSize": DELETE_BATCH_SIZE},
+            ):
+                objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+                if objects:
+                    response = self.client.delete_objects(
+                        Bucket=self.bucket,
+                        Delete={"Objects": objects, "Quiet": True},
+                    )
+                    for error in response.get("Errors", []):
+                        errors[error["Key"]] = error.get("Message") or error.get("Code")
+                    deleted += len(objects) - len(response.get("Errors", []))
+        if errors:
+            key, error = next(iter(errors.items()))
+            raise StorageError(
+                f"{len(errors)} objects under {prefix} not deleted, {key}: {error}"
+            )
+        return deleted
+
+    # Short-lived GET URL of an object, served as an attachment
+    def presign_download(self, key: str, filename: str, expires_in: int):
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "ResponseContentDisposition": f"attachment; filename={filename}",
+            },
+            ExpiresIn=expires_in,
+        )
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int):
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires_in,
+        )
+
+    def create_multipart_upload(self, key: str, content_type: str):
+        with translated_errors():
+            return self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=key, ContentType=content_type
+            )["UploadId"]
+
+    def presign_upload_part(
+        self, key: str, upload_id: str, part_number: int, expires_in: int
+    ):
+        return self.client.generate_presigned_url(
+            "upload_part",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "UploadId": upload_id,
+                "PartNumber": part_number,
+            },
+            ExpiresIn=expires_in,
+        )
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list):
+        with translated_errors():
+            response = self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        return response["ETag"]
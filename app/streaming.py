@@ -0,0 +1,130 @@
+import os
+from datetime import timezone
+from email.utils import format_datetime
+
+from fastapi import HTTPException, status
+
+from app.storage import InvalidRange
+from app.storage.base import parse_byte_range, resolve_range
+from fastapi.responses import (
+    JSONResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+
+# bytes read from S3 per chunk of a streamed download
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+
+# Range header to forward to S3, None for absent or unsupported ranges
+# (multiple ranges are answered with the full body, as RFC 9110 allows)
+def parse_range_header(range_header: str):
+    if not range_header:
+        return None
+    parsed = parse_byte_range(range_header)
+    if parsed is None:
+        return None
+    start, end = parsed
+    if start is not None and end is not None and start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Invalid range",
+        )
+    return range_header.strip()
+
+
+def iter_body(body, chunk_size: int = None):
+    try:
+        while True:
+            chunk = body.read(chunk_size or DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        body.close()
+
+
+# Stream an S3 GetObject response to the client chunk by chunk
+def s3_streaming_response(s3_object: dict, filename: str):
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes",
+    }
+    if s3_object.get("ContentLength") is not None:
+        headers["Content-Length"] = str(s3_object["ContentLength"])
+    if s3_object.get("ETag"):
+        headers["ETag"] = s3_object["ETag"]
+    status_code = status.HTTP_200_OK
+    if s3_object.get("ContentRange"):
+        headers["Content-Range"] = s3_object["ContentRange"]
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+    return StreamingResponse(
+        iter_body(s3_object["Body"]),
+        status_code=status_code,
+        headers=headers,
+        media_type=s3_object.get("ContentType") or "application/octet-stream",
+    )
+
+
+# Point the client at a presigned URL instead of proxying the bytes,
+# either as a redirect or as JSON for clients that fetch it themselves
+def presigned_download_response(url: str, expires_in: int, redirect: bool = True):
+    if redirect:
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    return JSONResponse({"url": url, "expires_in": expires_in})
+
+
+# Answer a HEAD request from stored object metadata
+def metadata_response(
+    filename: str,
+    size: int,
+    content_type: str = None,
+    etag: str = None,
+    last_modified=None,
+):
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(size),
+    }
+    if etag:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    return Response(
+        headers=headers, media_type=content_type or "application/octet-stream"
+    )
+
+
+# Stream a ZIP archive, serving a single byte range when the archive can be
+# resumed and If-Range, if sent, still matches it
+def archive_response(archive, filename: str, range_header: str, if_range: str):
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes" if archive.resumable else "none",
+        "ETag": archive.etag,
+    }
+    start, end = 0, archive.size - 1
+    status_code = status.HTTP_200_OK
+    byte_range = parse_range_header(range_header)
+    if byte_range and archive.resumable and if_range in (None, archive.etag):
+        try:
+            start, end = resolve_range(byte_range, archive.size)
+        except InvalidRange:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{archive.size}"},
+            )
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        archive.iter_range(start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/zip",
+    )
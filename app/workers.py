@@ -0,0 +1,192 @@
+import logging
+import os
+import threading
+
+from app.crud.document_texts import extract_pending_documents
+from app.crud.documents import collect_unreferenced_blobs, purge_document_versions
+from app.crud.upload_jobs import run_next_upload_job
+from app.database import SessionLocal
+from app.extraction import extraction_pool
+
+# upload workers started with the API; set to 0 when they run as their own
+# process with `python -m app.workers`
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+# how often idle workers look for due retries, in seconds
+UPLOAD_WORKER_POLL_INTERVAL = float(os.getenv("UPLOAD_WORKER_POLL_INTERVAL", "1"))
+# seconds between garbage collections of unreferenced blobs, 0 disables them
+BLOB_GC_INTERVAL = float(os.getenv("BLOB_GC_INTERVAL", "300"))
+# seconds between purges of expired document versions, 0 disables them
+VERSION_PURGE_INTERVAL = float(os.getenv("VERSION_PURGE_INTERVAL", "3600"))
+# seconds between looks for documents to extract text from, 0 disables
+# extraction; uploads and updates wake the extractor right away
+EXTRACTION_INTERVAL = float(os.getenv("EXTRACTION_INTERVAL", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+# Threads that process queued upload jobs, each with its own session
+class UploadWorkerPool:
+    def __init__(
+        self, session_factory, workers: int, poll_interval: float, on_processed=None
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        # called after each processed job
+        self.on_processed = on_processed
+        self.processed = 0
+        self.errors = 0
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        self._stop.clear()
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"upload-worker-{number}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    # wake idle workers for a newly queued job
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self):
+        with self.session_factory() as db:
+            try:
+                worked = run_next_upload_job(db)
+            except Exception:
+                # the lease runs out and another attempt picks the job up
+                logger.exception("Upload worker failed")
+                db.rollback()
+                with self._lock:
+                    self.errors += 1
+                return False
+        if worked:
+            with self._lock:
+                self.processed += 1
+            if self.on_processed is not None:
+                self.on_processed()
+        return worked
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "alive": sum(thread.is_alive() for thread in self._threads),
+                "processed": self.processed,
+                "errors": self.errors,
+            }
+
+
+# Thread running a maintenance function with its own session every interval
+class PeriodicTask:
+    def __init__(self, name: str, session_factory, func, interval: float):
+        self.name = name
+        self.session_factory = session_factory
+        self.func = func
+        self.interval = interval
+        self.runs = 0
+        self.errors = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    # run before the interval is up
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        with self.session_factory() as db:
+            try:
+                result = self.func(db)
+            except Exception:
+                logger.exception("%s failed", self.name)
+                db.rollback()
+                self.errors += 1
+                return None
+        self.runs += 1
+        return result
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            self.run_once()
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "alive": self._thread is not None and self._thread.is_alive(),
+            "runs": self.runs,
+            "errors": self.errors,
+        }
+
+
+text_extractor = PeriodicTask(
+    "text-extraction", SessionLocal, extract_pending_documents, EXTRACTION_INTERVAL
+)
+upload_worker_pool = UploadWorkerPool(
+    SessionLocal, UPLOAD_WORKERS, UPLOAD_WORKER_POLL_INTERVAL, text_extractor.notify
+)
+blob_collector = PeriodicTask(
+    "blob-gc", SessionLocal, collect_unreferenced_blobs, BLOB_GC_INTERVAL
+)
+version_purger = PeriodicTask(
+    "version-purge", SessionLocal, purge_document_versions, VERSION_PURGE_INTERVAL
+)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    pool = UploadWorkerPool(
+        SessionLocal,
+        max(UPLOAD_WORKERS, 1),
+        UPLOAD_WORKER_POLL_INTERVAL,
+        text_extractor.notify,
+    )
+    pool.start()
+    blob_collector.start()
+    version_purger.start()
+    text_extractor.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pool.stop()
+        blob_collector.stop()
+        version_purger.stop()
+        text_extractor.stop()
+        extraction_pool.shutdown()
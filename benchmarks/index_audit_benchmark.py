@@ -0,0 +1,170 @@
+"""Before/after benchmark of the index audit migration (Postgres only).
+
+Builds the tables in a scratch schema twice, once with the old indexes and
+once with the audited ones, seeds them with the same data and measures
+single-row document insert latency and document access-check latency.
+
+    DATABASE_URL=postgresql://... python benchmarks/index_audit_benchmark.py
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.crud.documents import get_document_with_role
+from app.database import DATABASE_URL
+from app.models import Document
+
+SCHEMA = "index_audit_bench"
+
+TABLES = """
+CREATE TABLE users (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(100) UNIQUE NOT NULL,
+    hashed_password VARCHAR(100) NOT NULL
+);
+CREATE TABLE projects (
+    project_id SERIAL PRIMARY KEY,
+    name VARCHAR(100),
+    description VARCHAR,
+    owner_id INT REFERENCES users(id),
+    logo_url VARCHAR
+);
+CREATE TABLE project_participants (
+    id SERIAL PRIMARY KEY,
+    project_id INT REFERENCES projects(project_id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id)
+);
+CREATE TABLE documents (
+    id SERIAL PRIMARY KEY,
+    project_id INT REFERENCES projects(project_id) ON DELETE CASCADE,
+    filename VARCHAR NOT NULL,
+    file_url VARCHAR NOT NULL
+);
+"""
+
+INDEXES = {
+    "before": """
+CREATE INDEX ix_projects_name ON projects (name);
+CREATE INDEX ix_projects_description ON projects (description);
+CREATE INDEX ix_projects_logo_url ON projects (logo_url);
+CREATE INDEX ix_projects_project_id ON projects (project_id);
+CREATE INDEX ix_project_participants_id ON project_participants (id);
+CREATE INDEX ix_documents_id ON documents (id);
+CREATE INDEX ix_documents_file_url ON documents (file_url);
+CREATE INDEX ix_documents_filename ON documents (filename);
+CREATE INDEX ix_users_id ON users (id);
+""",
+    "after": """
+CREATE INDEX ix_projects_name ON projects (name);
+CREATE INDEX ix_projects_owner_id_project_id ON projects (owner_id, project_id);
+CREATE UNIQUE INDEX uq_project_participants_user_id_project_id
+    ON project_participants (user_id, project_id);
+CREATE INDEX ix_documents_project_id_id ON documents (project_id, id);
+CREATE UNIQUE INDEX uq_documents_project_id_filename
+    ON documents (project_id, filename);
+""",
+}
+
+SEED = """
+INSERT INTO users (email, hashed_password)
+    SELECT 'user' || n || '@example.com', 'x' FROM generate_series(1, :users) n;
+INSERT INTO projects (name, description, owner_id, logo_url)
+    SELECT 'Project ' || n, repeat('description ', 20) || n, 1 + n % :users,
+           'https://logos.example.com/' || md5(n::text) || '.png'
+    FROM generate_series(1, :projects) n;
+INSERT INTO project_participants (project_id, user_id)
+    SELECT DISTINCT 1 + n % :projects, 1 + (n * 7) % :users
+    FROM generate_series(1, :participants) n;
+INSERT INTO documents (project_id, filename, file_url)
+    SELECT 1 + n % :projects, 'file' || n || '.pdf',
+           'https://docs.example.com/' || md5(n::text) || '/file' || n || '.pdf'
+    FROM generate_series(1, :documents) n;
+ANALYZE;
+"""
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summary(values):
+    return (
+        f"mean {statistics.mean(values) * 1000:.3f} ms, "
+        f"p99 {percentile(values, 99) * 1000:.3f} ms"
+    )
+
+
+def run_variant(variant: str, args):
+    engine = create_engine(
+        DATABASE_URL, connect_args={"options": f"-csearch_path={SCHEMA}"}
+    )
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        connection.execute(text(TABLES))
+        connection.execute(text(INDEXES[variant]))
+        for statement in SEED.split(";"):
+            if statement.strip():
+                connection.execute(
+                    text(statement),
+                    {
+                        "users": args.users,
+                        "projects": args.projects,
+                        "participants": args.projects * 2,
+                        "documents": args.documents,
+                    },
+                )
+
+    rng = random.Random(42)
+    insert_latencies = []
+    with Session(engine) as db:
+        for n in range(args.samples):
+            started = time.perf_counter()
+            db.add(
+                Document(
+                    project_id=rng.randint(1, args.projects),
+                    filename=f"insert{n}.pdf",
+                    file_url=f"https://docs.example.com/{n:032x}/insert{n}.pdf",
+                )
+            )
+            db.commit()
+            insert_latencies.append(time.perf_counter() - started)
+
+    access_latencies = []
+    with Session(engine) as db:
+        for _ in range(args.samples):
+            document_id = rng.randint(1, args.documents)
+            user_id = rng.randint(1, args.users)
+            started = time.perf_counter()
+            get_document_with_role(document_id, user_id, db)
+            access_latencies.append(time.perf_counter() - started)
+            db.expunge_all()
+
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    engine.dispose()
+
+    print(f"{variant:<7} document insert: {summary(insert_latencies)}")
+    print(f"{variant:<7} access check:    {summary(access_latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--projects", type=int, default=20000)
+    parser.add_argument("--documents", type=int, default=200000)
+    parser.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    for variant in ("before", "after"):
+        run_variant(variant, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Login throughput and event-loop responsiveness benchmark.
+
+Runs concurrent /login requests against the app in-process while probing an
+unrelated endpoint, then prints login throughput and probe latency
+percentiles. Pass --inline to hash on the event loop (the old behaviour) for
+comparison.
+
+    DATABASE_URL=postgresql://... INTERNAL_METRICS_TOKEN=... \
+        python benchmarks/login_benchmark.py
+
+The probe endpoint is internal, so INTERNAL_METRICS_TOKEN must be set; the
+benchmark stops if a probe is not answered with 200.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+from app.auth import hashing
+from app.auth.hashing import hash_password_sync
+from app.database import SessionLocal
+from app.main import app
+from app.models import User
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "Benchmarkpassword1!"
+PROBE_INTERVAL = 0.01
+PROBE_PATH = "/internal/metrics/password-executor"
+# the in-process app reads the same variable to accept the probe
+INTERNAL_METRICS_TOKEN = os.getenv("INTERNAL_METRICS_TOKEN")
+
+
+def ensure_user():
+    db = SessionLocal()
+    try:
+        if not db.query(User).filter(User.email == EMAIL).first():
+            db.add(User(email=EMAIL, hashed_password=hash_password_sync(PASSWORD)))
+            db.commit()
+    finally:
+        db.close()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(logins: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        semaphore = asyncio.Semaphore(concurrency)
+        probe_latencies = []
+        done = asyncio.Event()
+
+        async def login():
+            async with semaphore:
+                await c.post("/login", data={"username": EMAIL, "password": PASSWORD})
+
+        async def probe_once():
+            response = await c.get(
+                PROBE_PATH, headers={"X-Internal-Token": INTERNAL_METRICS_TOKEN}
+            )
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"probe {PROBE_PATH} returned {response.status_code}: "
+                    f"{response.text}"
+                )
+
+        # latency is measured from when the probe was due, so loop stalls count
+        async def probe():
+            while not done.is_set():
+                due = time.perf_counter() + PROBE_INTERVAL
+                await asyncio.sleep(PROBE_INTERVAL)
+                await probe_once()
+                probe_latencies.append(time.perf_counter() - due)
+
+        # a rejected probe would otherwise only surface after every login
+        await probe_once()
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    print(f"logins:            {logins} in {elapsed:.2f}s")
+    print(f"login throughput:  {logins / elapsed:.1f}/s")
+    print(f"probe requests:    {len(probe_latencies)}")
+    print(f"probe p50 latency: {statistics.median(probe_latencies) * 1000:.1f} ms")
+    print(f"probe p99 latency: {percentile(probe_latencies, 99) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+    if not INTERNAL_METRICS_TOKEN:
+        parser.error("INTERNAL_METRICS_TOKEN must be set to probe the internal route")
+
+    if args.inline:
+
+        async def run_inline(func, *func_args):
+            return func(*func_args)
+
+        hashing.password_executor.run = run_inline
+
+    app.state.limiter.enabled = False
+    ensure_user()
+    asyncio.run(run(args.logins, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,43 @@
 import pytest
+import io
 import os
 import boto3
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import sessionmaker
 from fastapi import status
 from unittest.mock import Mock
 
 from app.main import app, get_db
-from app.models import Project, User, Document, ProjectParticipant
+from app.api import internal_endpoints
+from app.database import get_read_db
+from app.models import (
+    Project,
+    User,
+    Document,
+    DocumentText,
+    DocumentVersion,
+    ProjectParticipant,
+)
 from app.auth.jwt_handler import SECRET_KEY, hash_pass, ALGORITHM
+from app.auth.cache import principal_cache
+from app.storage import MemoryStorage
+from app.workers import blob_collector, text_extractor, upload_worker_pool
 from datetime import datetime, timedelta
 from moto import mock_aws
 from jose import JWTError, jwt
 
+# upload jobs, blob collection and text extraction are run explicitly by
+# the tests
+upload_worker_pool.workers = 0
+blob_collector.interval = 0
+text_extractor.interval = 0
+
+# the internal metrics routes are only served with this token
+internal_endpoints.INTERNAL_METRICS_TOKEN = "test-internal-token"
+INTERNAL_HEADERS = {"X-Internal-Token": "test-internal-token"}
+
 TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
 engine = create_engine(TEST_DATABASE_URL)
 
@@ -27,7 +50,10 @@ def mock_download_project_document(mocker):
     mock_download_function = mocker.patch(
         "app.crud.documents.download_project_document", new_callable=Mock
     )
-    mock_download_function.return_value = (b"Test file content", None)
+    mock_download_function.return_value = (
+        {"Body": io.BytesIO(b"Test file content"), "ContentLength": 17},
+        None,
+    )
     return mock_download_function
 
 
@@ -73,6 +99,7 @@ def test_client_with_auth(db_session, token):
             db_session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
 
     headers = {"Authorization": f"Bearer {token}"}
     with TestClient(app, headers=headers) as client:
@@ -91,17 +118,47 @@ def s3_client():
         yield conn
 
 
+# Documents and logos are kept in memory unless a test swaps in S3
+@pytest.fixture(autouse=True)
+def memory_storage(mocker):
+    documents = MemoryStorage()
+    mocker.patch("app.crud.documents.storage", documents)
+    mocker.patch("app.crud.logo.storage", MemoryStorage())
+    return documents
+
+
+@pytest.fixture(autouse=True)
+def upload_spool_dir(tmp_path, mocker):
+    mocker.patch("app.crud.upload_jobs.UPLOAD_SPOOL_DIR", str(tmp_path))
+    return tmp_path
+
+
 @pytest.fixture
 def bucket_name():
     return "my-test-bucket"
 
 
+# Collect SQL statements executed on the test database
+@pytest.fixture
+def query_counter():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 # Clear the content of specific tables before each test
 @pytest.fixture(scope="function", autouse=True)
 def setup(db_session):
     db_session.execute(text("TRUNCATE TABLE projects RESTART IDENTITY CASCADE"))
     db_session.execute(text("TRUNCATE TABLE users RESTART IDENTITY CASCADE"))
+    db_session.execute(text("TRUNCATE TABLE blobs CASCADE"))
     db_session.commit()
+    principal_cache.clear()
 
 
 # Create a new database session with a rollback at the end of the test
@@ -126,6 +183,7 @@ def test_client(db_session):
             db_session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     with TestClient(app) as test_client:
         yield test_client
 
@@ -0,0 +1,122 @@
+from conftest import *
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import NullPool
+
+from app.database import get_async_database_url
+from app.crud.project import (
+    get_project_by_id_with_access_async,
+    projects_info_with_docs_async,
+)
+from app.crud.documents import (
+    delete_project_document_async,
+    get_project_documents_async,
+)
+import app.api.document_endpoints
+from app.crud.user import create_user_db_async, is_existing_user_async
+from app.models import Document, DocumentVersion
+from app.schemas import UsersCreate
+
+pytest.importorskip("asyncpg")
+
+
+@pytest_asyncio.fixture
+async def async_db_session():
+    async_engine = create_async_engine(get_async_database_url(TEST_DATABASE_URL))
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+    await async_engine.dispose()
+
+
+def test_async_database_url():
+    assert (
+        get_async_database_url("postgresql://user@localhost/db").drivername
+        == "postgresql+asyncpg"
+    )
+    assert get_async_database_url("sqlite:///local.db").drivername == (
+        "sqlite+aiosqlite"
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_project_with_access_async(async_db_session, test_project):
+    project = await get_project_by_id_with_access_async(
+        1, test_project.owner_id, async_db_session
+    )
+    assert project.name == "Test Project"
+
+    documents = await get_project_documents_async(
+        project_id=1, user_id=test_project.owner_id, db=async_db_session
+    )
+    assert [document.filename for document in documents] == ["document.pdf"]
+
+
+@pytest.mark.asyncio
+async def test_projects_info_with_docs_async(async_db_session, test_project):
+    projects = await projects_info_with_docs_async(
+        user_id=test_project.owner_id, db=async_db_session
+    )
+    assert projects[0]["documents"] == [{"filename": "document.pdf"}]
+
+
+@pytest.mark.asyncio
+async def test_create_user_async(async_db_session):
+    user = UsersCreate(
+        email="asyncuser@example.com",
+        password="Testpassword!",
+        repeat_password="Testpassword!",
+    )
+    db_user = await create_user_db_async(user, async_db_session)
+    assert db_user.id is not None
+    assert await is_existing_user_async("asyncuser@example.com", async_db_session)
+
+
+# Test the async delete keeps a document and its versions while an object
+# cannot be deleted, like the sync delete
+@pytest.mark.asyncio
+async def test_delete_document_async_keeps_failed_objects(
+    async_db_session, db_session, test_project, memory_storage, mocker
+):
+    db_session.add(DocumentVersion(document_id=1, version=1, file_url="u"))
+    db_session.commit()
+    failing = mocker.patch.object(
+        memory_storage, "delete_many", return_value={"1/versions/1/1": "S3 is down"}
+    )
+    document = await async_db_session.get(Document, 1)
+
+    error = await delete_project_document_async(document, async_db_session)
+
+    assert error == "Failed to delete 1 objects of the document from S3"
+    db_session.expire_all()
+    assert db_session.get(Document, 1) is not None
+    assert db_session.query(DocumentVersion).count() == 1
+
+    failing.return_value = {}
+    assert await delete_project_document_async(document, async_db_session) is None
+    db_session.expire_all()
+    assert db_session.get(Document, 1) is None
+    assert db_session.query(DocumentVersion).count() == 0
+
+
+# Test document listings read through the async session in async mode
+def test_list_documents_async_mode(test_client_with_auth, test_project, mocker):
+    # the test client runs the app on its own event loop, connections are
+    # not pooled across loops
+    async_engine = create_async_engine(
+        get_async_database_url(TEST_DATABASE_URL), poolclass=NullPool
+    )
+    mocker.patch(
+        "app.database.AsyncSessionLocal",
+        async_sessionmaker(bind=async_engine, expire_on_commit=False),
+    )
+    listing = mocker.spy(app.api.document_endpoints, "get_project_documents_async")
+
+    response = test_client_with_auth.get("/project/1/documents")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [document["filename"] for document in response.json()] == ["document.pdf"]
+    assert listing.call_count == 1
@@ -3,7 +3,26 @@ from conftest import status
 import pytest
 from unittest.mock import AsyncMock, Mock
 from unittest import mock
-from app.crud.documents import download_project_document
+from botocore.exceptions import ClientError
+from app.crud.documents import (
+    allocate_filenames,
+    delete_project_document,
+    download_project_document,
+    purge_document_versions,
+    put_document_object,
+    upload_token,
+)
+from app.crud.upload_jobs import run_next_upload_job
+from app.pagination import encode_cursor
+from app.storage import S3Storage
+import app.middleware
+import datetime
+import hashlib
+import io
+import tempfile
+import tracemalloc
+import zipfile
+import zlib
 
 
 def test_download_document(
@@ -22,7 +41,18 @@ def test_download_document(
 
 # Testing upload documents
 @pytest.mark.asyncio
-async def test_upload_documents(test_client_with_auth, test_project, s3_client):
+async def test_upload_documents(
+    test_client_with_auth, test_project, s3_client, mocker, db_session, tmp_path
+):
+    s3_client.create_bucket(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"),
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+    mocker.patch("app.crud.upload_jobs.UPLOAD_SPOOL_DIR", str(tmp_path))
     # Files to upload
     files = [
         ("files", ("testfile1.pdf", b"Content1", "text/plain")),
@@ -30,8 +60,21 @@ async def test_upload_documents(test_client_with_auth, test_project, s3_client):
     ]
     response = test_client_with_auth.post("/project/1/documents/", files=files)
 
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json() == {"message": "Files uploaded successfully"}
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.headers["Location"] == "/uploads/1"
+    assert response.json()["status"] == "queued"
+    assert response.json()["total"] == 2
+
+    assert run_next_upload_job(db_session)
+
+    response = test_client_with_auth.get("/uploads/1")
+    assert response.json()["status"] == "succeeded"
+    assert response.json()["uploaded"] == 2
+    assert list(tmp_path.iterdir()) == []
+    stored = s3_client.get_object(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key="1/testfile2.pdf"
+    )
+    assert stored["Body"].read() == b"Content 2"
 
 
 # Testing to get list of all project documents
@@ -42,7 +85,9 @@ async def test_list_all_project_documents(
     response = test_client_with_auth.get("/project/1/documents")
 
     assert response.status_code == status.HTTP_200_OK
-    assert response.json() == [{"id": 1, "filename": "document.pdf"}]
+    assert response.json() == [
+        {"id": 1, "filename": "document.pdf", "size": None, "etag": None}
+    ]
 
 
 # Testing deleting the documents
@@ -55,3 +100,827 @@ async def test_delete_document(
     assert response.status_code == status.HTTP_204_NO_CONTENT
     assert response.content == b""
     assert response.headers.get("application/json") is None
+
+
+# Test access resolution costs a single query per document endpoint
+@pytest.mark.parametrize(
+    "url, expected_queries",
+    [
+        ("/document/1", 1),
+        # access check and document listing
+        ("/project/1/documents", 2),
+    ],
+)
+def test_document_endpoint_query_count(
+    mock_download_project_document,
+    test_client_with_auth,
+    test_project,
+    query_counter,
+    url,
+    expected_queries,
+):
+    # warm the principal cache so only the endpoint's own queries are counted
+    test_client_with_auth.get("/project/1/documents")
+    query_counter.clear()
+
+    response = test_client_with_auth.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(query_counter) == expected_queries
+
+
+# Test a document in a project without access is forbidden
+def test_download_document_without_access(test_client_with_auth, db_session):
+    other_user = User(email="other@example.com", hashed_password="12345")
+    other_project = Project(name="Other", description="", owner=other_user)
+    db_session.add(
+        Document(filename="secret.pdf", file_url="secret.pdf", project=other_project)
+    )
+    db_session.commit()
+
+    response = test_client_with_auth.get("/document/1")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+# Test project documents are paginated with a cursor in both sort orders
+@pytest.mark.parametrize(
+    "sort, expected_pages",
+    [
+        ("id", [["document.pdf", "c.pdf"], ["a.pdf", "b.pdf"]]),
+        ("filename", [["a.pdf", "b.pdf"], ["c.pdf", "document.pdf"]]),
+    ],
+)
+def test_list_project_documents_pagination(
+    test_client_with_auth, test_project, db_session, sort, expected_pages
+):
+    for filename in ["c.pdf", "a.pdf", "b.pdf"]:
+        db_session.add(Document(filename=filename, file_url=filename, project_id=1))
+    db_session.commit()
+
+    cursor = None
+    for expected_page in expected_pages:
+        params = {"sort": sort, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = test_client_with_auth.get("/project/1/documents", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        assert [doc["filename"] for doc in response.json()] == expected_page
+        cursor = response.headers.get("X-Next-Cursor")
+    assert cursor is None
+
+
+# Test cursors whose fields do not match the sort key are rejected
+@pytest.mark.parametrize(
+    "sort, values",
+    [
+        ("id", {"sort": "id", "value": "a.pdf", "id": 1}),
+        ("id", {"sort": "id", "value": 1, "id": True}),
+        ("filename", {"sort": "filename", "value": 7, "id": 1}),
+        ("filename", {"sort": "filename", "value": ["a.pdf"], "id": 1}),
+        ("filename", {"sort": "filename", "value": "a.pdf", "id": "1"}),
+        ("filename", {"sort": "id", "value": "a.pdf", "id": 1}),
+    ],
+)
+def test_list_project_documents_invalid_cursor(
+    test_client_with_auth, test_project, sort, values
+):
+    response = test_client_with_auth.get(
+        "/project/1/documents",
+        params={"sort": sort, "cursor": encode_cursor(values)},
+    )
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_list_project_documents_page_size_cap(test_client_with_auth, test_project):
+    response = test_client_with_auth.get(
+        "/project/1/documents", params={"limit": 100000}
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+# Test oversized uploads are rejected from Content-Length before being read
+def test_upload_documents_too_large(test_client_with_auth, test_project, monkeypatch):
+    monkeypatch.setattr(app.middleware, "MAX_REQUEST_BODY_SIZE", 1024)
+    files = [("files", ("big.pdf", b"x" * 2048, "application/pdf"))]
+
+    response = test_client_with_auth.post("/project/1/documents/", files=files)
+
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+# Test large files are streamed in parts with bounded memory
+def test_put_document_object_streams_parts(mocker):
+    # records part sizes only, a Mock would keep every uploaded body alive
+    class PartRecordingS3:
+        part_sizes = []
+        completed = False
+
+        def create_multipart_upload(self, **kwargs):
+            return {"UploadId": "upload-1"}
+
+        def upload_part(self, Body, **kwargs):
+            self.part_sizes.append(len(Body))
+            return {"ETag": "etag"}
+
+        def complete_multipart_upload(self, **kwargs):
+            self.completed = True
+            return {"ETag": '"etag-8"'}
+
+    part_size = 5 * 1024 * 1024
+    mocker.patch("app.crud.documents.UPLOAD_PART_SIZE", part_size)
+    s3_stub = PartRecordingS3()
+    mocker.patch("app.crud.documents.storage", S3Storage("bucket", s3_stub))
+
+    spool = tempfile.TemporaryFile()
+    chunk = b"x" * (1024 * 1024)
+    for _ in range(40):
+        spool.write(chunk)
+    spool.seek(0)
+
+    tracemalloc.start()
+    put_document_object("1/big.pdf", spool)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert s3_stub.part_sizes == [part_size] * 8
+    assert s3_stub.completed
+    assert peak < 2 * part_size
+
+
+# Test documents are streamed from S3 and byte ranges are forwarded
+@pytest.mark.parametrize(
+    "range_header, expected_status, expected_content",
+    [
+        (None, status.HTTP_200_OK, b"0123456789"),
+        ("bytes=2-5", status.HTTP_206_PARTIAL_CONTENT, b"2345"),
+        ("bytes=-3", status.HTTP_206_PARTIAL_CONTENT, b"789"),
+    ],
+)
+def test_download_document_range(
+    test_client_with_auth,
+    test_project,
+    s3_client,
+    mocker,
+    range_header,
+    expected_status,
+    expected_content,
+):
+    s3_client.create_bucket(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"),
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    s3_client.put_object(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"),
+        Key="1/document.pdf",
+        Body=b"0123456789",
+        ContentType="application/pdf",
+    )
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+    headers = {"Range": range_header} if range_header else {}
+
+    response = test_client_with_auth.get("/document/1", headers=headers)
+
+    assert response.status_code == expected_status
+    assert response.content == expected_content
+    assert response.headers["Content-Length"] == str(len(expected_content))
+    assert response.headers["Content-Type"] == "application/pdf"
+    assert response.headers["Accept-Ranges"] == "bytes"
+    if range_header:
+        assert response.headers["Content-Range"].endswith("/10")
+
+
+def test_download_document_unsatisfiable_range(
+    test_client_with_auth, test_project, s3_client, mocker
+):
+    s3_client.create_bucket(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"),
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    s3_client.put_object(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key="1/document.pdf", Body=b"0123"
+    )
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+
+    response = test_client_with_auth.get(
+        "/document/1", headers={"Range": "bytes=100-200"}
+    )
+
+    assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+
+
+# Test files uploaded with presigned URLs are registered on commit
+def test_presigned_upload_and_commit(
+    test_client_with_auth, test_project, s3_client, mocker
+):
+    import requests
+
+    s3_client.create_bucket(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"),
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+    mocker.patch("app.crud.documents.DOCUMENT_TRANSFER_MODE", "presigned")
+    mocker.patch("app.crud.documents.UPLOAD_PART_SIZE", 5 * 1024 * 1024)
+    large = b"x" * (5 * 1024 * 1024 + 10)
+
+    response = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads",
+        json={
+            "files": [
+                {"filename": "document.pdf", "size": 7},
+                {"filename": "large.pdf", "size": len(large)},
+            ]
+        },
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    small_upload, large_upload = response.json()
+    assert small_upload["stored_as"] == "document(1).pdf"
+    assert small_upload["upload_id"] is None
+    assert len(large_upload["part_urls"]) == 2
+
+    put = requests.put(
+        small_upload["url"],
+        data=b"content",
+        headers={"Content-Type": "application/pdf"},
+    )
+    assert put.status_code == 200
+    part_size = large_upload["part_size"]
+    parts = []
+    for number, url in enumerate(large_upload["part_urls"], start=1):
+        start = (number - 1) * part_size
+        put = requests.put(url, data=large[start:][:part_size])
+        parts.append({"part_number": number, "etag": put.headers["ETag"]})
+
+    response = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads/commit",
+        json={
+            "files": [
+                {
+                    "stored_as": "document(1).pdf",
+                    "upload_token": small_upload["upload_token"],
+                },
+                {
+                    "stored_as": "large.pdf",
+                    "upload_token": large_upload["upload_token"],
+                    "upload_id": large_upload["upload_id"],
+                    "parts": parts,
+                },
+            ]
+        },
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    listing = test_client_with_auth.get("/project/1/documents?sort=filename")
+    assert [doc["filename"] for doc in listing.json()] == [
+        "document(1).pdf",
+        "document.pdf",
+        "large.pdf",
+    ]
+    stored = s3_client.get_object(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"), Key="1/large.pdf"
+    )
+    assert stored["ContentLength"] == len(large)
+    assert [doc["size"] for doc in listing.json()] == [7, None, len(large)]
+
+
+# Test committing a file that never reached the bucket is rejected
+def test_commit_missing_presigned_upload(
+    test_client_with_auth, test_project, s3_client, mocker
+):
+    s3_client.create_bucket(
+        Bucket=os.getenv("AWS_S3_BUCKET_NAME"),
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+    mocker.patch("app.crud.documents.DOCUMENT_TRANSFER_MODE", "presigned")
+    (upload,) = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads",
+        json={"files": [{"filename": "missing.pdf", "size": 7}]},
+    ).json()
+
+    response = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads/commit",
+        json={
+            "files": [
+                {"stored_as": "missing.pdf", "upload_token": upload["upload_token"]}
+            ]
+        },
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["detail"]["results"] == [
+        {
+            "stored_as": "missing.pdf",
+            "status": "failed",
+            "error": "Upload not found in storage",
+        }
+    ]
+
+
+# Test a commit is refused for names not allocated to the caller
+def test_commit_presigned_upload_requires_token(
+    test_client_with_auth, test_project, memory_storage, mocker
+):
+    mocker.patch("app.crud.documents.DOCUMENT_TRANSFER_MODE", "presigned")
+    mocker.patch.object(memory_storage, "supports_presigned_urls", True)
+    memory_storage.put("1/other.pdf", io.BytesIO(b"content"))
+    forged = upload_token(2, 1, "other.pdf", None)
+    someone_else = upload_token(1, 2, "other.pdf", None)
+    renamed = upload_token(1, 1, "document(1).pdf", None)
+
+    response = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads/commit",
+        json={
+            "files": [
+                {"stored_as": "other.pdf", "upload_token": token}
+                for token in ("not-a-token", forged, someone_else, renamed)
+            ]
+        },
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert [result["error"] for result in response.json()["detail"]["results"]] == [
+        "Invalid upload token"
+    ] * 4
+    listing = test_client_with_auth.get("/project/1/documents")
+    assert [doc["filename"] for doc in listing.json()] == ["document.pdf"]
+
+
+# Test a commit where only some files succeed reports each file with 207
+def test_commit_presigned_uploads_partially(
+    test_client_with_auth, test_project, memory_storage, mocker
+):
+    mocker.patch("app.crud.documents.DOCUMENT_TRANSFER_MODE", "presigned")
+    mocker.patch.object(memory_storage, "supports_presigned_urls", True)
+    memory_storage.put("1/other.pdf", io.BytesIO(b"content"))
+
+    response = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads/commit",
+        json={
+            "files": [
+                {
+                    "stored_as": "other.pdf",
+                    "upload_token": upload_token(1, 1, "other.pdf", None),
+                },
+                {
+                    "stored_as": "missing.pdf",
+                    "upload_token": upload_token(1, 1, "missing.pdf", None),
+                },
+            ]
+        },
+    )
+
+    assert response.status_code == status.HTTP_207_MULTI_STATUS
+    assert response.json()["results"] == [
+        {"stored_as": "other.pdf", "status": "uploaded"},
+        {
+            "stored_as": "missing.pdf",
+            "status": "failed",
+            "error": "Upload not found in storage",
+        },
+    ]
+    listing = test_client_with_auth.get("/project/1/documents?sort=filename")
+    assert [doc["filename"] for doc in listing.json()] == [
+        "document.pdf",
+        "other.pdf",
+    ]
+
+
+# Test presigned upload endpoints are off in proxy mode
+def test_presigned_uploads_disabled(test_client_with_auth, test_project):
+    response = test_client_with_auth.post(
+        "/project/1/documents/presigned-uploads",
+        json={"files": [{"filename": "a.pdf", "size": 1}]},
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+# Test downloads redirect to a presigned URL in presigned mode
+def test_download_document_presigned(
+    test_client_with_auth, test_project, s3_client, mocker
+):
+    mocker.patch("app.crud.documents.DOCUMENT_TRANSFER_MODE", "presigned")
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+
+    response = test_client_with_auth.get("/document/1", follow_redirects=False)
+
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    location = response.headers["location"]
+    assert "/1/document.pdf?" in location
+    assert "Signature" in location
+
+    response = test_client_with_auth.get("/document/1?redirect=false")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["url"].split("?")[0] == location.split("?")[0]
+    assert response.json()["expires_in"] == 300
+
+
+# Test name allocation costs the same few queries however big the project is
+def test_allocate_filenames_constant_queries(db_session, test_project, query_counter):
+    db_session.add_all(
+        Document(project_id=1, filename=f"file{n}.pdf", file_url=f"u{n}")
+        for n in range(200)
+    )
+    db_session.commit()
+
+    query_counter.clear()
+    assert allocate_filenames(db_session, 1, ["new.pdf"]) == ["new.pdf"]
+    fresh_queries = len(query_counter)
+
+    query_counter.clear()
+    assert allocate_filenames(db_session, 1, ["new.pdf"]) == ["new(1).pdf"]
+
+    assert fresh_queries <= 3
+    assert len(query_counter) <= fresh_queries + 2
+    # names of documents saved before claims existed are still respected
+    assert allocate_filenames(db_session, 1, ["document.pdf"]) == ["document(1).pdf"]
+
+
+# Test concurrent uploads of one name never get the same stored name
+def test_allocate_filenames_concurrently(test_project):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def allocate(_):
+        with TestingSessionLocal() as db:
+            return allocate_filenames(db, 1, ["report.pdf"])[0]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        names = list(pool.map(allocate, range(16)))
+
+    assert sorted(names) == sorted(
+        ["report.pdf"] + [f"report({n}).pdf" for n in range(1, 16)]
+    )
+
+
+# Test the name of a deleted document can be used again
+@pytest.mark.asyncio
+async def test_deleted_document_releases_name(db_session, test_project, mocker):
+    assert allocate_filenames(db_session, 1, ["report.pdf"]) == ["report.pdf"]
+    document = Document(project_id=1, filename="report.pdf", file_url="u/report.pdf")
+    db_session.add(document)
+    db_session.commit()
+
+    await delete_project_document(document, db_session)
+
+    assert allocate_filenames(db_session, 1, ["report.pdf"]) == ["report.pdf"]
+
+
+# Test HEAD is answered from stored metadata without calling S3
+def test_head_document_from_metadata(
+    test_client_with_auth, test_project, db_session, mocker
+):
+    document = db_session.get(Document, 1)
+    document.size = 1234
+    document.content_type = "application/pdf"
+    document.etag = '"abc"'
+    db_session.commit()
+    storage_stub = mocker.patch("app.crud.documents.storage")
+
+    response = test_client_with_auth.head("/document/1")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Length"] == "1234"
+    assert response.headers["Content-Type"] == "application/pdf"
+    assert response.headers["ETag"] == '"abc"'
+    assert response.headers["Last-Modified"].endswith("GMT")
+    assert response.content == b""
+    assert storage_stub.method_calls == []
+    listing = test_client_with_auth.get("/project/1/documents")
+    assert listing.json() == [
+        {"id": 1, "filename": "document.pdf", "size": 1234, "etag": '"abc"'}
+    ]
+
+
+# Test HEAD of a document without recorded metadata asks S3
+def test_head_document_without_metadata(
+    test_client_with_auth, test_project, s3_client, mocker
+):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    s3_client.put_object(Bucket=bucket, Key="1/document.pdf", Body=b"12345")
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+
+    response = test_client_with_auth.head("/document/1")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Length"] == "5"
+    assert "ETag" in response.headers
+
+
+# Test updating a document overwrites its own object and metadata
+def test_update_document_records_metadata(
+    test_client_with_auth, test_project, db_session, s3_client, mocker
+):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch(
+        "app.crud.documents.storage",
+        S3Storage(os.getenv("AWS_S3_BUCKET_NAME"), s3_client),
+    )
+    head_object = mocker.patch.object(s3_client, "head_object")
+
+    files = {"file": ("renamed.pdf", b"new content", "application/pdf")}
+    response = test_client_with_auth.put("/document/1", files=files)
+
+    assert response.status_code == status.HTTP_200_OK
+    head_object.assert_not_called()
+    stored = s3_client.get_object(Bucket=bucket, Key="1/document.pdf")
+    assert stored["Body"].read() == b"new content"
+    db_session.expire_all()
+    document = db_session.get(Document, 1)
+    assert document.size == len(b"new content")
+    assert document.checksum == hashlib.sha256(b"new content").hexdigest()
+    assert document.etag == stored["ETag"]
+    assert document.content_type == "application/pdf"
+
+
+def add_archive_documents(db_session, memory_storage, contents):
+    for filename, content in contents.items():
+        memory_storage.put(f"1/{filename}", io.BytesIO(content))
+        db_session.add(
+            Document(
+                project_id=1,
+                filename=filename,
+                file_url=f"u/{filename}",
+                size=len(content),
+                crc32=zlib.crc32(content),
+            )
+        )
+    db_session.commit()
+
+
+# Test a project's documents download as one ZIP, looking up unknown sizes
+def test_download_project_archive(
+    test_client_with_auth, test_project, db_session, memory_storage
+):
+    memory_storage.put("1/document.pdf", io.BytesIO(b"legacy"))
+    add_archive_documents(
+        db_session, memory_storage, {"a.pdf": b"A" * 1000, "empty.pdf": b""}
+    )
+
+    response = test_client_with_auth.get("/project/1/documents/archive")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Type"] == "application/zip"
+    assert response.headers["Content-Length"] == str(len(response.content))
+    # the legacy document has no CRC, so the archive cannot be resumed
+    assert response.headers["Accept-Ranges"] == "none"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["document.pdf", "a.pdf", "empty.pdf"]
+        assert archive.read("document.pdf") == b"legacy"
+        assert archive.read("a.pdf") == b"A" * 1000
+
+
+# Test an interrupted archive download resumes without refetching what the
+# client already has
+def test_download_project_archive_resume(
+    test_client_with_auth, test_project, db_session, memory_storage, mocker
+):
+    db_session.query(Document).delete()
+    db_session.commit()
+    add_archive_documents(
+        db_session,
+        memory_storage,
+        {f"file{n}.pdf": bytes([n]) * 5000 for n in range(6)},
+    )
+    full = test_client_with_auth.get("/project/1/documents/archive")
+    assert full.headers["Accept-Ranges"] == "bytes"
+    get = mocker.patch.object(memory_storage, "get", wraps=memory_storage.get)
+
+    offset = len(full.content) - 10000
+    response = test_client_with_auth.get(
+        "/project/1/documents/archive",
+        headers={"Range": f"bytes={offset}-", "If-Range": full.headers["ETag"]},
+    )
+
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert full.content[:offset] + response.content == full.content
+    assert [call.args[0] for call in get.call_args_list] == [
+        "1/file4.pdf",
+        "1/file5.pdf",
+    ]
+    response = test_client_with_auth.get(
+        "/project/1/documents/archive",
+        headers={"Range": f"bytes={offset}-", "If-Range": '"stale"'},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == full.content
+
+
+def test_download_project_archive_without_access(
+    test_client_with_auth, test_project, db_session
+):
+    test_project.owner_id = None
+    test_project.participants = []
+    db_session.commit()
+
+    response = test_client_with_auth.get("/project/1/documents/archive")
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+# Test documents are deleted in batched S3 requests and one transaction,
+# with missing or inaccessible ids reported
+def test_bulk_delete_documents(
+    test_client_with_auth, test_project, db_session, s3_client, mocker
+):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch("app.crud.documents.storage", S3Storage(bucket, s3_client))
+    mocker.patch("app.storage.s3.DELETE_BATCH_SIZE", 2)
+    delete_objects = mocker.patch.object(
+        s3_client, "delete_objects", wraps=s3_client.delete_objects
+    )
+    other = Project(name="Other", description="Other", owner_id=None)
+    db_session.add(other)
+    for n in range(5):
+        s3_client.put_object(Bucket=bucket, Key=f"1/file{n}.pdf", Body=b"x")
+        db_session.add(
+            Document(project_id=1, filename=f"file{n}.pdf", file_url=f"u/file{n}.pdf")
+        )
+    db_session.add(Document(project=other, filename="secret.pdf", file_url="u/s"))
+    db_session.commit()
+    ids = [document.id for document in db_session.query(Document).order_by("id")]
+
+    response = test_client_with_auth.post(
+        "/documents/bulk-delete", json={"document_ids": ids[1:] + [999]}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["deleted"] == ids[1:6]
+    assert [failure["id"] for failure in response.json()["failed"]] == [ids[6], 999]
+    assert delete_objects.call_count == 3
+    assert s3_client.list_objects_v2(Bucket=bucket)["KeyCount"] == 0
+    db_session.expire_all()
+    assert [document.filename for document in db_session.query(Document)] == [
+        "document.pdf",
+        "secret.pdf",
+    ]
+
+
+# Test a filter deletes matching documents and keeps those whose object
+# could not be deleted
+def test_bulk_delete_documents_by_prefix(
+    test_client_with_auth, test_project, db_session, memory_storage, mocker
+):
+    for filename in ("draft_1.pdf", "draft_2.pdf", "final.pdf"):
+        db_session.add(
+            Document(project_id=1, filename=filename, file_url=f"u/{filename}")
+        )
+    db_session.commit()
+    mocker.patch.object(
+        memory_storage,
+        "delete_many",
+        return_value={"1/draft_2.pdf": "Access Denied"},
+    )
+
+    response = test_client_with_auth.post(
+        "/documents/bulk-delete", json={"project_id": 1, "filename_prefix": "draft_"}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()["deleted"]) == 1
+    assert response.json()["failed"][0]["error"].endswith("Access Denied")
+    db_session.expire_all()
+    assert sorted(document.filename for document in db_session.query(Document)) == [
+        "document.pdf",
+        "draft_2.pdf",
+        "final.pdf",
+    ]
+
+
+def test_bulk_delete_documents_invalid_request(test_client_with_auth, test_project):
+    response = test_client_with_auth.post(
+        "/documents/bulk-delete", json={"document_ids": [1], "project_id": 1}
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+# Test a moved document gets a free name and its object follows it
+def test_move_document(test_client_with_auth, test_project, db_session, memory_storage):
+    target = Project(name="Target", description="", owner_id=test_project.owner_id)
+    db_session.add(target)
+    db_session.add(Document(project=target, filename="document.pdf", file_url="u/x"))
+    db_session.commit()
+    target_id = target.project_id
+    memory_storage.put("1/document.pdf", io.BytesIO(b"content"))
+
+    response = test_client_with_auth.post(
+        "/document/1/move", json={"project_id": target_id}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["filename"] == "document(1).pdf"
+    assert memory_storage.keys() == [f"{target_id}/document(1).pdf"]
+    db_session.expire_all()
+    assert db_session.get(Document, 1).project_id == target_id
+
+
+def test_move_document_without_access_to_target(
+    test_client_with_auth, test_project, db_session
+):
+    db_session.add(Project(name="Other", description="", owner_id=None))
+    db_session.commit()
+
+    response = test_client_with_auth.post("/document/1/move", json={"project_id": 2})
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+# Test an update keeps the replaced content readable as the previous version
+def test_update_document_keeps_version(
+    test_client_with_auth, test_project, memory_storage
+):
+    memory_storage.put("1/document.pdf", io.BytesIO(b"first"))
+    files = {"file": ("document.pdf", b"second", "application/pdf")}
+
+    response = test_client_with_auth.put("/document/1", files=files)
+
+    assert response.status_code == status.HTTP_200_OK
+    versions = test_client_with_auth.get("/document/1/versions").json()
+    assert [version["version"] for version in versions] == [1]
+    assert versions[0]["etag"] == memory_storage.head("versions/1/1")["ETag"]
+    assert test_client_with_auth.get("/document/1/versions/1").content == b"first"
+    assert test_client_with_auth.get("/document/1").content == b"second"
+    missing = test_client_with_auth.get("/document/1/versions/2")
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+
+
+# Test an update made against replaced content is refused
+def test_update_document_if_match(
+    test_client_with_auth, test_project, db_session, memory_storage
+):
+    etag = memory_storage.put("1/document.pdf", io.BytesIO(b"first"))
+    files = {"file": ("document.pdf", b"second", "application/pdf")}
+
+    response = test_client_with_auth.put(
+        "/document/1", files=files, headers={"If-Match": etag}
+    )
+    stale = test_client_with_auth.put(
+        "/document/1",
+        files={"file": ("document.pdf", b"third", "application/pdf")},
+        headers={"If-Match": etag},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] == memory_storage.head("1/document.pdf")["ETag"]
+    assert stale.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert memory_storage.get("1/document.pdf")["Body"].read() == b"second"
+    db_session.expire_all()
+    assert db_session.get(Document, 1).version == 2
+    assert db_session.query(DocumentVersion).count() == 1
+
+
+# Test versions past retention are purged with their objects
+def test_purge_document_versions(test_project, db_session, memory_storage):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for version, age in ((1, 40), (2, 1)):
+        memory_storage.put(f"versions/1/{version}", io.BytesIO(b"old"))
+        db_session.add(
+            DocumentVersion(
+                document_id=1,
+                version=version,
+                file_url=f"u/versions/1/{version}",
+                superseded_at=now - datetime.timedelta(days=age),
+            )
+        )
+    db_session.commit()
+
+    assert purge_document_versions(db_session) == 1
+
+    assert memory_storage.keys() == ["versions/1/2"]
+    assert [version.version for version in db_session.query(DocumentVersion)] == [2]
@@ -0,0 +1,216 @@
+from conftest import *
+from sqlalchemy.orm import Session
+import io
+import zipfile
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from app.crud.document_texts import claim_documents, extract_pending_documents
+from app.crud.search import search_document_contents
+from app.extraction import (
+    ExtractionError,
+    ExtractionPool,
+    docx_text,
+    extract_text,
+    extraction_metrics,
+    pdf_text,
+    readable_text,
+)
+from app.models import Base
+
+
+def pdf_bytes(*lines: bytes):
+    content = b"BT /F1 12 Tf 72 720 Td "
+    for line in lines:
+        content += b"(" + line + b") Tj 0 -14 Td "
+    content += b"ET"
+    stream = zlib.compress(content)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length "
+        + str(len(stream)).encode()
+        + b" /Filter /FlateDecode >>\nstream\n"
+        + stream
+        + b"\nendstream",
+    ]
+    pdf, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += str(number).encode() + b" 0 obj\n" + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    return pdf + b"startxref\n%d\n%%%%EOF\n" % xref
+
+
+def docx_bytes(*paragraphs: str):
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr(
+            "word/document.xml",
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+            f'wordprocessingml/2006/main"><w:body>{body}</w:body></w:document>',
+        )
+    return buffer.getvalue()
+
+
+# Test text is read from the pages of a PDF
+def test_pdf_text(tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(pdf_bytes(b"Quarterly budget", b"Revenue \\(draft\\)"))
+    assert pdf_text(str(path)) == "Quarterly budget\nRevenue (draft)"
+    assert pdf_text(str(path), max_chars=9) == "Quarterly"
+
+    path.write_bytes(b"not a pdf")
+    with pytest.raises(ExtractionError):
+        pdf_text(str(path))
+
+
+# Test text without a usable encoding fails instead of being indexed
+def test_extract_unreadable_text(tmp_path):
+    path = tmp_path / "cid.pdf"
+    path.write_bytes(pdf_bytes(b"\\001\\002\\003\\004\\005\\006\\016\\017"))
+
+    with pytest.raises(ExtractionError, match="unreadable"):
+        extract_text(str(path), "cid.pdf")
+    assert readable_text("Quarterly budget\n")
+    assert not readable_text("\x01\x02\ue000\ufffd budget")
+
+
+# Test paragraphs of a .docx come out as lines
+def test_docx_text(tmp_path):
+    path = tmp_path / "notes.docx"
+    path.write_bytes(docx_bytes("Hello world", "Second line"))
+    assert docx_text(str(path)) == "Hello world\nSecond line"
+
+    path.write_bytes(b"not a zip")
+    with pytest.raises(ExtractionError):
+        docx_text(str(path))
+
+
+# Test a worker over its memory limit fails the document, not the pool
+def test_extraction_pool_memory_limit(tmp_path):
+    path = tmp_path / "huge.docx"
+    path.write_bytes(docx_bytes("x" * (64 * 1024 * 1024)))
+    pool = ExtractionPool(1, 128)
+    try:
+        with pytest.raises(ExtractionError):
+            pool.extract(str(path), "huge.docx")
+        path.write_bytes(docx_bytes("still works"))
+        assert pool.extract(str(path), "small.docx") == "still works"
+    finally:
+        pool.shutdown()
+
+
+# Test uploaded documents are indexed and re-indexed when updated
+def test_extract_pending_documents(
+    test_client_with_auth, test_project, db_session, memory_storage
+):
+    memory_storage.put("1/document.pdf", io.BytesIO(pdf_bytes(b"Quarterly budget")))
+    documents_before = extraction_metrics.stats()["documents"]
+
+    assert extract_pending_documents(db_session) == 1
+    assert extract_pending_documents(db_session) == 0
+
+    def search(q):
+        response = test_client_with_auth.get("/documents/search", params={"q": q})
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    results = search("budg")
+    assert [result["id"] for result in results] == [1]
+    assert results[0]["snippet"] == "Quarterly <b>budget</b>"
+    assert extraction_metrics.stats()["documents"] == documents_before + 1
+
+    files = {"file": ("document.pdf", pdf_bytes(b"Annual forecast"), "application/pdf")}
+    assert test_client_with_auth.put("/document/1", files=files).status_code == 200
+    assert extract_pending_documents(db_session) == 1
+
+    assert search("budget") == []
+    assert [result["id"] for result in search("forecast")] == [1]
+    db_session.expire_all()
+    text = db_session.get(DocumentText, 1)
+    assert (text.version, text.status) == (2, "indexed")
+
+
+# Test unreadable documents are recorded as failed and not retried
+def test_extract_unreadable_document(test_project, db_session, memory_storage):
+    memory_storage.put("1/document.pdf", io.BytesIO(b"not a pdf"))
+
+    assert extract_pending_documents(db_session) == 1
+    assert extract_pending_documents(db_session) == 0
+
+    text = db_session.get(DocumentText, 1)
+    assert text.status == "failed"
+    assert text.content is None
+
+
+# Test documents claimed by another process are left to it until its
+# lease runs out
+def test_extract_claimed_document(test_project, db_session, memory_storage):
+    memory_storage.put("1/document.pdf", io.BytesIO(pdf_bytes(b"Quarterly budget")))
+    now = datetime.now(timezone.utc)
+    db_session.add(
+        DocumentText(
+            document_id=1,
+            version=1,
+            status="pending",
+            extracted_at=now,
+            locked_until=now + timedelta(minutes=5),
+        )
+    )
+    db_session.commit()
+
+    assert extract_pending_documents(db_session) == 0
+    assert claim_documents(db_session, [db_session.get(Document, 1)]) == set()
+
+    db_session.get(DocumentText, 1).locked_until = now - timedelta(seconds=1)
+    db_session.commit()
+    assert extract_pending_documents(db_session) == 1
+    db_session.expire_all()
+    text = db_session.get(DocumentText, 1)
+    assert (text.status, text.locked_until) == ("indexed", None)
+
+
+# Test documents without any text are skipped, not indexed
+def test_extract_document_without_text(test_project, db_session, memory_storage):
+    memory_storage.put("1/document.pdf", io.BytesIO(pdf_bytes()))
+
+    assert extract_pending_documents(db_session) == 1
+
+    text = db_session.get(DocumentText, 1)
+    assert (text.status, text.error) == ("skipped", "Document has no text")
+
+
+# Test SQLite databases search document texts through their FTS5 table
+def test_search_document_contents_sqlite(tmp_path):
+    sqlite_engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(bind=sqlite_engine)
+    with Session(sqlite_engine) as session:
+        session.add(User(id=1, email="owner", hashed_password="x"))
+        session.add(Project(project_id=1, name="Mine", owner_id=1))
+        session.add(Project(project_id=2, name="Others", owner_id=None))
+        session.add(Document(id=1, project_id=1, filename="a.pdf", file_url="u"))
+        session.add(Document(id=2, project_id=2, filename="b.pdf", file_url="u"))
+        for document_id in (1, 2):
+            session.add(
+                DocumentText(
+                    document_id=document_id,
+                    version=1,
+                    status="indexed",
+                    content="Quarterly budget review",
+                )
+            )
+        session.commit()
+
+        results = search_document_contents(session, 1, "budget")
+
+    assert [result["id"] for result in results] == [1]
+    assert results[0]["snippet"] == "Quarterly <b>budget</b> review"
+    sqlite_engine.dispose()
@@ -0,0 +1,66 @@
+from conftest import *
+from sqlalchemy import exc
+
+import app.database as database
+from app.db_metrics import pool_metrics_registry
+
+
+# Test pool metrics are exposed for the primary engine
+def test_db_pool_metrics(test_client_with_auth, test_project):
+    response = test_client_with_auth.get(
+        "/internal/metrics/db-pool", headers=INTERNAL_HEADERS
+    )
+    assert response.status_code == status.HTTP_200_OK
+    primary = next(item for item in response.json() if item["name"] == "primary")
+    assert primary["pool_size"] == database.DATABASE_POOL_SIZE
+    assert set(primary["wait_time"]) == {
+        "count",
+        "sum_seconds",
+        "max_seconds",
+        "buckets",
+    }
+
+
+# Test checkout waits and timeouts are recorded on an exhausted pool
+def test_db_pool_checkout_timeout(monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_POOL_SIZE", 1)
+    monkeypatch.setattr(database, "DATABASE_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(database, "DATABASE_POOL_TIMEOUT", 0.1)
+    small_engine = database.create_instrumented_engine(TEST_DATABASE_URL, "test-small")
+    try:
+        connection = small_engine.connect()
+        with pytest.raises(exc.TimeoutError):
+            small_engine.connect()
+        snapshot = pool_metrics_registry["test-small"].snapshot()
+        assert snapshot["checked_out"] == 1
+        assert snapshot["checkouts"] == 1
+        assert snapshot["checkout_timeouts"] == 1
+        assert snapshot["wait_time"]["count"] == 1
+        connection.close()
+        assert pool_metrics_registry["test-small"].snapshot()["checkins"] == 1
+    finally:
+        small_engine.dispose()
+        del pool_metrics_registry["test-small"]
+
+
+# Test extraction throughput is exposed
+def test_extraction_metrics(test_client_with_auth):
+    response = test_client_with_auth.get(
+        "/internal/metrics/extraction", headers=INTERNAL_HEADERS
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert {"docs_per_second", "mb_per_second", "pool_restarts"} <= set(response.json())
+
+
+# Test internal routes need the shared token and are off without one
+def test_internal_metrics_require_token(test_client, monkeypatch):
+    missing = test_client.get("/internal/metrics/auth-cache")
+    wrong = test_client.get(
+        "/internal/metrics/auth-cache", headers={"X-Internal-Token": "guess"}
+    )
+    monkeypatch.setattr(internal_endpoints, "INTERNAL_METRICS_TOKEN", None)
+    disabled = test_client.get("/internal/metrics/auth-cache", headers=INTERNAL_HEADERS)
+
+    assert missing.status_code == status.HTTP_403_FORBIDDEN
+    assert wrong.status_code == status.HTTP_403_FORBIDDEN
+    assert disabled.status_code == status.HTTP_404_NOT_FOUND
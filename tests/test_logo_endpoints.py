@@ -1,6 +1,8 @@
 from conftest import *
 from conftest import status
+import io
 import pytest
+from PIL import Image
 from unittest.mock import AsyncMock, Mock
 
 from app.crud.logo import (
@@ -10,6 +12,7 @@ from app.crud.logo import (
     download_logo_from_s3,
     delete_logo,
 )
+from app.storage import MemoryStorage, S3Storage
 
 
 # Test uploading a logo
@@ -57,7 +60,8 @@ async def test_download_project_logo(
         "app.crud.logo.get_project_logo_url", return_value="http://example.com/logo.png"
     )
     mocker.patch(
-        "app.crud.logo.download_logo_from_s3", return_value=(b"file_content", None)
+        "app.crud.logo.download_logo_from_s3",
+        return_value=({"Body": io.BytesIO(b"file_content")}, None),
     )
 
     response = test_client_with_auth.get("/project/1/logo")
@@ -79,3 +83,87 @@ async def test_delete_project_logo(
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
     assert response.content == b""
+
+
+# Test logo downloads redirect to a presigned URL in presigned mode
+def test_download_project_logo_presigned(
+    test_client_with_auth, test_project, s3_client, mocker
+):
+    mocker.patch("app.crud.documents.DOCUMENT_TRANSFER_MODE", "presigned")
+    mocker.patch(
+        "app.crud.logo.storage", S3Storage(os.getenv("LOGO_BUCKET_NAME"), s3_client)
+    )
+
+    response = test_client_with_auth.get("/project/1/logo", follow_redirects=False)
+
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    assert "/1/logo.png?" in response.headers["location"]
+
+
+def png_bytes(width: int, height: int):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(output, format="PNG")
+    return output.getvalue()
+
+
+# Test an uploaded logo gets variants of every size and format
+def test_upload_project_logo_variants(
+    test_client_with_auth, test_project, db_session, mocker
+):
+    logos = MemoryStorage()
+    mocker.patch("app.crud.logo.storage", logos)
+    files = {"file": ("logo.png", png_bytes(800, 400), "image/png")}
+
+    response = test_client_with_auth.put("/project/1/logo", files=files)
+
+    assert response.status_code == status.HTTP_200_OK
+    names = [f"{size}.{fmt}" for size in (64, 128, 400) for fmt in ("png", "webp")]
+    assert logos.keys() == sorted(
+        ["1/logo.png"] + [f"1/variants/{name}" for name in names]
+    )
+    variant = logos.get("1/variants/128.png")
+    assert variant["ContentType"] == "image/png"
+    assert Image.open(variant["Body"]).size == (128, 64)
+    db_session.expire_all()
+    assert sorted(db_session.get(Project, 1).logo_variants.split(",")) == sorted(names)
+
+
+# Test downloads with a size get the smallest variant covering it
+def test_download_project_logo_variant(test_client_with_auth, test_project, mocker):
+    logos = MemoryStorage()
+    mocker.patch("app.crud.logo.storage", logos)
+    original = png_bytes(800, 400)
+    files = {"file": ("logo.png", original, "image/png")}
+    test_client_with_auth.put("/project/1/logo", files=files)
+
+    webp = test_client_with_auth.get(
+        "/project/1/logo", params={"size": 100}, headers={"Accept": "image/webp"}
+    )
+    png = test_client_with_auth.get("/project/1/logo", params={"size": 64})
+    larger = test_client_with_auth.get("/project/1/logo", params={"size": 1000})
+
+    assert webp.status_code == status.HTTP_200_OK
+    assert webp.content == logos.get("1/variants/128.webp")["Body"].read()
+    assert webp.headers["Content-Type"] == "image/webp"
+    assert webp.headers["Content-Disposition"] == "attachment; filename=logo_128.webp"
+    assert webp.headers["Vary"] == "Accept"
+    assert png.content == logos.get("1/variants/64.png")["Body"].read()
+    assert larger.content == original
+    assert len(png.content) * 10 < len(original)
+
+
+# Test a logo Pillow cannot read is kept and served as uploaded
+def test_upload_project_logo_unreadable(
+    test_client_with_auth, test_project, db_session, mocker
+):
+    logos = MemoryStorage()
+    mocker.patch("app.crud.logo.storage", logos)
+    files = {"file": ("logo.png", b"not an image", "image/png")}
+
+    response = test_client_with_auth.put("/project/1/logo", files=files)
+    download = test_client_with_auth.get("/project/1/logo", params={"size": 64})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert logos.keys() == ["1/logo.png"]
+    assert db_session.get(Project, 1).logo_variants is None
+    assert download.content == b"not an image"
@@ -1,6 +1,14 @@
 from conftest import *
 from sqlalchemy import text
 
+import app.crud.logo
+from app.crud.search import search_projects
+from app.database import Base
+from app.models import Blob
+from sqlalchemy.orm import Session
+from app.storage import S3Storage
+import io
+
 
 def test_create_project(test_client_with_auth):
     response = test_client_with_auth.post(
@@ -69,7 +77,219 @@ def test_delete_project(test_client_with_auth, test_project):
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+# Test deleting a project deletes the objects of its documents and their
+# versions and gives back their blob references
+def test_delete_project_releases_storage(
+    test_client_with_auth, test_project, db_session, memory_storage
+):
+    digest = "a" * 64
+    memory_storage.put("1/document.pdf", io.BytesIO(b"current"))
+    memory_storage.put("versions/1/1", io.BytesIO(b"old"))
+    db_session.add(Blob(digest=digest, size=3, refcount=2, stored=True))
+    db_session.add(DocumentVersion(document_id=1, version=1, file_url="u"))
+    db_session.add(
+        DocumentVersion(document_id=1, version=2, file_url="u", blob_digest=digest)
+    )
+    db_session.commit()
+
+    response = test_client_with_auth.delete("/project/1")
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert memory_storage.keys() == []
+    db_session.expire_all()
+    assert db_session.get(Blob, digest).refcount == 1
+    assert db_session.query(DocumentVersion).count() == 0
+
+
 def test_delete_nonexistent_project(test_client_with_auth, test_project):
     response = test_client_with_auth.delete("/project/999")
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json() == {"detail": "Project with ID 999 not found"}
+
+
+# Test access resolution costs a single query per project endpoint
+@pytest.mark.parametrize(
+    "method, url, kwargs, expected_queries",
+    [
+        ("get", "/project/1/info", {}, 1),
+        # access check, UPDATE and refresh
+        ("put", "/project/1/info", {"json": {"name": "A", "description": "B"}}, 3),
+    ],
+)
+def test_project_endpoint_query_count(
+    test_client_with_auth,
+    test_project,
+    query_counter,
+    method,
+    url,
+    kwargs,
+    expected_queries,
+):
+    # warm the principal cache so only the endpoint's own queries are counted
+    test_client_with_auth.get("/project/1/info")
+    query_counter.clear()
+
+    response = getattr(test_client_with_auth, method)(url, **kwargs)
+
+    assert response.status_code < 300
+    assert len(query_counter) == expected_queries
+
+
+# Test projects list takes a constant number of queries and no duplicates
+def test_get_all_projects_query_count(
+    test_client_with_auth, test_project, db_session, create_user, query_counter
+):
+    for index in range(5):
+        project = Project(name=f"Extra {index}", description="", owner_id=1)
+        project.documents.append(Document(filename=f"{index}.pdf", file_url=""))
+        db_session.add(project)
+        db_session.add(ProjectParticipant(project=project, user_id=create_user.id))
+    db_session.commit()
+    test_client_with_auth.get("/project/1/info")
+    query_counter.clear()
+
+    response = test_client_with_auth.get("/projects")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [project["id"] for project in response.json()] == [1, 2, 3, 4, 5, 6]
+    # projects page and document selectin load
+    assert len(query_counter) == 2
+
+
+# Test projects list is paginated with a cursor
+def test_get_all_projects_pagination(test_client_with_auth, test_project, db_session):
+    for index in range(4):
+        db_session.add(Project(name=f"Extra {index}", description="", owner_id=1))
+    db_session.commit()
+
+    first_page = test_client_with_auth.get("/projects", params={"limit": 3})
+    assert [project["id"] for project in first_page.json()] == [1, 2, 3]
+    cursor = first_page.headers["X-Next-Cursor"]
+
+    second_page = test_client_with_auth.get(
+        "/projects", params={"limit": 3, "cursor": cursor}
+    )
+    assert [project["id"] for project in second_page.json()] == [4, 5]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+def test_get_all_projects_invalid_cursor(test_client_with_auth, test_project):
+    response = test_client_with_auth.get("/projects", params={"cursor": "nope"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+# Test a clone copies documents inside the bucket and keeps participants
+def test_clone_project(
+    test_client_with_auth, test_project, db_session, s3_client, mocker
+):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch("app.crud.documents.storage", S3Storage(bucket, s3_client))
+    copy_object = mocker.patch.object(
+        s3_client, "copy_object", wraps=s3_client.copy_object
+    )
+    participant = User(email="participant@example.com", hashed_password="x")
+    db_session.add(ProjectParticipant(project=test_project, user=participant))
+    db_session.commit()
+    s3_client.put_object(Bucket=bucket, Key="1/document.pdf", Body=b"content")
+    app.crud.logo.storage.put("1/logo.png", io.BytesIO(b"png"))
+
+    response = test_client_with_auth.post("/project/1/clone", json={"name": "Copy"})
+
+    assert response.status_code == status.HTTP_201_CREATED
+    clone_id = response.json()["project_id"]
+    assert response.json()["name"] == "Copy"
+    assert copy_object.call_count == 1
+    body = s3_client.get_object(Bucket=bucket, Key=f"{clone_id}/document.pdf")["Body"]
+    assert body.read() == b"content"
+    db_session.expire_all()
+    clone = db_session.get(Project, clone_id)
+    assert [document.filename for document in clone.documents] == ["document.pdf"]
+    assert [user.email for user in clone.participants] == ["participant@example.com"]
+    assert clone.logo_url.endswith(f"/{clone_id}/logo.png")
+    assert app.crud.logo.storage.head(f"{clone_id}/logo.png")["ContentLength"] == 3
+
+
+# Test a failed copy leaves no project and no copied objects behind
+def test_clone_project_copy_failure(
+    test_client_with_auth, test_project, db_session, memory_storage
+):
+    db_session.add(Document(project_id=1, filename="a.pdf", file_url="u/a.pdf"))
+    db_session.commit()
+    memory_storage.put("1/a.pdf", io.BytesIO(b"a"))
+
+    response = test_client_with_auth.post("/project/1/clone")
+
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert db_session.query(Project).count() == 1
+    assert memory_storage.keys() == ["1/a.pdf"]
+
+
+def test_clone_project_without_access(test_client_with_auth, db_session):
+    db_session.add(Project(name="Other", description="", owner_id=None))
+    db_session.commit()
+
+    response = test_client_with_auth.post("/project/1/clone")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+# Test search matches names, descriptions and document filenames by word
+# prefix, best matches first, and leaves out projects of other users
+def test_search_projects(test_client_with_auth, test_project, db_session):
+    by_filename = Project(name="Archive", description="Old things", owner_id=1)
+    by_filename.documents.append(Document(filename="budget_2024.pdf", file_url="u"))
+    db_session.add(by_filename)
+    db_session.add(Project(name="Budget", description="Planning", owner_id=1))
+    db_session.add(Project(name="Budget of others", description="", owner_id=None))
+    db_session.commit()
+
+    response = test_client_with_auth.get("/projects/search", params={"q": "budg"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [project["name"] for project in response.json()] == ["Budget", "Archive"]
+    by_description = test_client_with_auth.get(
+        "/projects/search", params={"q": "test descr"}
+    )
+    assert [project["id"] for project in by_description.json()] == [1]
+
+
+# Test search follows renamed and deleted documents
+def test_search_projects_after_document_changes(
+    test_client_with_auth, test_project, db_session
+):
+    document = db_session.query(Document).one()
+    document.filename = "minutes.pdf"
+    db_session.commit()
+
+    def search(q):
+        response = test_client_with_auth.get("/projects/search", params={"q": q})
+        return [project["id"] for project in response.json()]
+
+    assert search("minutes") == [1]
+    assert search("document") == []
+    db_session.delete(document)
+    db_session.commit()
+    assert search("minutes") == []
+
+
+# Test SQLite databases search through their FTS5 table
+def test_search_projects_sqlite(tmp_path):
+    sqlite_engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(bind=sqlite_engine)
+    with Session(sqlite_engine) as session:
+        session.add(User(id=1, email="owner", hashed_password="x"))
+        project = Project(name="Roadmap", description="Plans", owner_id=1)
+        project.documents.append(Document(filename="budget_2024.pdf", file_url="u"))
+        session.add(project)
+        session.add(Project(name="Budget", description="", owner_id=1))
+        session.add(Project(name="Budget", description="", owner_id=None))
+        session.commit()
+
+        results = search_projects(session, 1, "budget")
+
+    assert [result["name"] for result in results] == ["Budget", "Roadmap"]
+    sqlite_engine.dispose()
@@ -0,0 +1,120 @@
+from conftest import *
+import time
+
+from app.database import (
+    Base,
+    ReplicaSet,
+    RequestWrites,
+    RoutingSession,
+    get_read_db,
+    request_writes,
+    use_primary,
+)
+
+
+# SQLite file standing in for a replica, seeded with a project only it has
+@pytest.fixture
+def replica_engine(tmp_path):
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=replica)
+    with replica.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO projects (project_id, name, description, owner_id) "
+                "VALUES (1, 'Replica Project', 'From replica', 1)"
+            )
+        )
+    yield replica
+    replica.dispose()
+
+
+@pytest.fixture
+def routing_session(replica_engine):
+    session = RoutingSession(
+        primary=engine,
+        replicas=ReplicaSet([replica_engine], health_check_interval=60),
+    )
+    yield get_read_db(session)
+    session.close()
+
+
+# Requests made with the writes of a client
+@pytest.fixture
+def client_writes():
+    writes = RequestWrites(window=60)
+    token = request_writes.set(writes)
+    yield writes
+    request_writes.reset(token)
+
+
+def test_reads_go_to_replica(routing_session, test_project):
+    project = routing_session.query(Project).filter_by(project_id=1).one()
+    assert project.name == "Replica Project"
+
+
+# Test sessions not marked by get_read_db stay on the primary
+def test_request_session_reads_primary(replica_engine, test_project):
+    session = RoutingSession(
+        primary=engine,
+        replicas=ReplicaSet([replica_engine], health_check_interval=60),
+    )
+    try:
+        project = session.query(Project).filter_by(project_id=1).one()
+        assert project.name == "Test Project"
+    finally:
+        session.close()
+
+
+def test_writes_go_to_primary(routing_session, test_project, db_session, client_writes):
+    routing_session.add(Project(name="Written", description="", owner_id=1))
+    routing_session.commit()
+
+    assert db_session.query(Project).filter_by(name="Written").count() == 1
+    assert client_writes.wrote_recently()
+
+
+def test_client_reads_own_writes_from_primary(routing_session, test_project):
+    token = request_writes.set(RequestWrites(last_write_at=time.time(), window=60))
+    try:
+        project = routing_session.query(Project).filter_by(project_id=1).one()
+        assert project.name == "Test Project"
+    finally:
+        request_writes.reset(token)
+
+
+def test_old_writes_read_from_replica(routing_session, test_project):
+    token = request_writes.set(RequestWrites(last_write_at=time.time() - 61, window=60))
+    try:
+        project = routing_session.query(Project).filter_by(project_id=1).one()
+        assert project.name == "Replica Project"
+    finally:
+        request_writes.reset(token)
+
+
+# Test a write response carries the marker and later requests send it back
+def test_write_response_sets_last_write_cookie(test_client_with_auth, test_project):
+    response = test_client_with_auth.post(
+        "/projects", json={"name": "New", "description": "Written"}
+    )
+    read = test_client_with_auth.get("/projects")
+
+    assert response.status_code == status.HTTP_201_CREATED
+    last_write = float(response.headers["X-Last-Write"])
+    assert abs(last_write - time.time()) < 60
+    assert "last_write=" in response.headers["set-cookie"]
+    assert (
+        test_client_with_auth.cookies["last_write"] == response.headers["X-Last-Write"]
+    )
+    assert "X-Last-Write" not in read.headers
+
+
+def test_use_primary_pins_session(routing_session, test_project):
+    assert use_primary(routing_session) is True
+    project = routing_session.query(Project).filter_by(project_id=1).one()
+    assert project.name == "Test Project"
+
+
+def test_unhealthy_replica_falls_back_to_primary(routing_session, test_project):
+    routing_session.replicas.mark_unhealthy(routing_session.replicas.engines[0])
+    project = routing_session.query(Project).filter_by(project_id=1).one()
+    assert project.name == "Test Project"
@@ -0,0 +1,203 @@
+from conftest import *
+import pytest
+from unittest import mock
+
+import app.storage
+from app.storage import (
+    CachedStorage,
+    InvalidRange,
+    LocalStorage,
+    MemoryStorage,
+    NotModified,
+    ObjectNotFound,
+    S3Storage,
+    StorageError,
+)
+
+
+@pytest.fixture
+def cached(tmp_path, mocker):
+    backend = MemoryStorage()
+    mocker.patch.object(backend, "get", wraps=backend.get)
+    return CachedStorage(
+        backend, str(tmp_path / "cache"), max_bytes=5, max_object_bytes=4
+    )
+
+
+# Test the local backend stores objects with metadata and serves ranges
+def test_local_storage(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+
+    etag = storage.put("1/report.pdf", io.BytesIO(b"0123456789"), "application/pdf")
+
+    head = storage.head("1/report.pdf")
+    assert head["ContentLength"] == 10
+    assert head["ContentType"] == "application/pdf"
+    assert head["ETag"] == etag
+    response = storage.get("1/report.pdf", "bytes=2-5")
+    assert response["Body"].read() == b"2345"
+    assert response["ContentRange"] == "bytes 2-5/10"
+    with pytest.raises(NotModified):
+        storage.get("1/report.pdf", if_none_match=etag)
+    with pytest.raises(InvalidRange):
+        storage.get("1/report.pdf", "bytes=20-30")
+    assert storage.delete_prefix("1/") == 1
+    with pytest.raises(ObjectNotFound):
+        storage.head("1/report.pdf")
+
+
+# Test S3 errors surface as storage errors
+def test_s3_storage_missing_object(s3_client):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    storage = S3Storage(bucket, s3_client)
+
+    with pytest.raises(ObjectNotFound):
+        storage.get("1/missing.pdf")
+    etag = storage.put("1/document.pdf", io.BytesIO(b"12345"))
+    with pytest.raises(NotModified):
+        storage.get("1/document.pdf", if_none_match=etag)
+
+
+# Test objects S3 refuses to delete under a prefix surface as storage errors
+def test_s3_storage_delete_prefix_errors(s3_client, mocker):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    storage = S3Storage(bucket, s3_client)
+    storage.put("1/logo.png", io.BytesIO(b"12345"))
+    mocker.patch.object(
+        s3_client,
+        "delete_objects",
+        return_value={
+            "Errors": [
+                {"Key": "1/logo.png", "Code": "AccessDenied", "Message": "Denied"}
+            ]
+        },
+    )
+
+    with pytest.raises(StorageError, match="1 objects under 1/ not deleted"):
+        storage.delete_prefix("1/")
+
+
+# Test a cached object is served from disk once its ETag is confirmed
+def test_cached_storage_hit(cached):
+    cached.backend.put("1/a.pdf", io.BytesIO(b"abc"))
+
+    assert cached.get("1/a.pdf")["Body"].read() == b"abc"
+    assert cached.get("1/a.pdf", "bytes=1-")["Body"].read() == b"bc"
+
+    assert cached.stats()["hits"] == 1
+    assert cached.stats()["misses"] == 1
+    etag = cached.backend.head("1/a.pdf")["ETag"]
+    assert cached.backend.get.call_args_list[-1] == mock.call(
+        "1/a.pdf", if_none_match=etag
+    )
+
+
+# Test an object changed behind the cache is fetched again
+def test_cached_storage_revalidation(cached):
+    cached.backend.put("1/a.pdf", io.BytesIO(b"abc"))
+    cached.get("1/a.pdf")["Body"].read()
+
+    cached.backend.put("1/a.pdf", io.BytesIO(b"xyz"))
+
+    assert cached.get("1/a.pdf")["Body"].read() == b"xyz"
+    assert cached.stats()["stale"] == 1
+    cached.delete("1/a.pdf")
+    assert cached.stats()["entries"] == 0
+    with pytest.raises(ObjectNotFound):
+        cached.get("1/a.pdf")
+
+
+# Test the least recently used objects are evicted to stay under the size cap
+def test_cached_storage_eviction(cached):
+    for key in ("a", "b", "c"):
+        cached.backend.put(key, io.BytesIO(b"x" * 2))
+    cached.backend.put("big", io.BytesIO(b"x" * 5))
+
+    cached.get("a")["Body"].read()
+    cached.get("b")["Body"].read()
+    cached.get("a")["Body"].read()
+    cached.get("c")["Body"].read()
+    cached.get("big")["Body"].read()
+
+    stats = cached.stats()
+    assert stats["evictions"] == 1
+    assert stats["size_bytes"] == 4
+    # too large to cache at all
+    assert cached._lookup("big") is None
+    assert cached._lookup("b") is None
+
+
+# Test each process caches in its own directory and only directories of
+# exited processes are cleared
+def test_cached_storage_process_directories(tmp_path):
+    root = tmp_path / "cache"
+    for owner in (os.getppid(), 2**22 + 1, os.getpid()):
+        (root / str(owner)).mkdir(parents=True)
+        (root / str(owner) / "entry").write_bytes(b"x")
+    (root / "notes.txt").write_bytes(b"x")
+
+    cached = CachedStorage(MemoryStorage(), str(root), max_bytes=16)
+    cached.backend.put("a", io.BytesIO(b"abc"))
+    cached.get("a")["Body"].read()
+
+    assert cached.cache_dir == str(root / str(os.getpid()))
+    assert len(os.listdir(cached.cache_dir)) == 1
+    assert (root / str(os.getppid()) / "entry").exists()
+    assert not (root / str(2**22 + 1)).exists()
+    assert (root / "notes.txt").exists()
+
+
+# Test cache statistics are exposed per configured cache
+def test_storage_cache_metrics(test_client_with_auth, cached, mocker):
+    mocker.patch.dict(app.storage.storage_cache_registry, {"documents": cached})
+
+    response = test_client_with_auth.get(
+        "/internal/metrics/storage-cache", headers=INTERNAL_HEADERS
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["documents"]["max_bytes"] == 5
+
+
+# Test objects larger than a part are copied with UploadPartCopy
+def test_s3_storage_multipart_copy(s3_client, mocker):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    storage = S3Storage(bucket, s3_client)
+    upload_part_copy = mocker.patch.object(
+        s3_client, "upload_part_copy", wraps=s3_client.upload_part_copy
+    )
+    s3_client.put_object(
+        Bucket=bucket, Key="1/big.bin", Body=os.urandom(6 * 1024 * 1024)
+    )
+
+    storage.copy("1/big.bin", "2/big.bin", 6 * 1024 * 1024, 5 * 1024 * 1024)
+
+    assert [call.kwargs["CopySourceRange"] for call in upload_part_copy.mock_calls] == [
+        "bytes=0-5242879",
+        "bytes=5242880-6291455",
+    ]
+    source = storage.get("1/big.bin")["Body"].read()
+    assert storage.get("2/big.bin")["Body"].read() == source
+
+
+# Test backends without a native copy read and rewrite the object
+def test_local_storage_copy(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.put("1/a.pdf", io.BytesIO(b"abc"), "application/pdf")
+
+    storage.copy("1/a.pdf", "2/a.pdf")
+
+    assert storage.get("2/a.pdf")["Body"].read() == b"abc"
+    assert storage.head("2/a.pdf")["ContentType"] == "application/pdf"
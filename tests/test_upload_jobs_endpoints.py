@@ -0,0 +1,255 @@
+from conftest import *
+from conftest import status
+from datetime import timedelta
+import hashlib
+import pytest
+
+from app.crud.documents import collect_unreferenced_blobs
+from app.crud.upload_jobs import run_next_upload_job
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models import Blob, FilenameCounter, UploadJob, utcnow
+from app.storage import ObjectNotFound, S3Storage, StorageError
+
+
+@pytest.fixture
+def spool_dir(tmp_path, mocker):
+    mocker.patch("app.crud.upload_jobs.UPLOAD_SPOOL_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def failing_put_object(memory_storage, mocker):
+    # fails every upload of a file whose name is in `broken`
+    broken = {"broken.pdf"}
+    put = memory_storage.put
+
+    def failing_put(key, fileobj, content_type=None, part_size=None):
+        if key.rsplit("/", 1)[-1] in broken:
+            raise StorageError("boom")
+        return put(key, fileobj, content_type, part_size)
+
+    mocker.patch.object(memory_storage, "put", side_effect=failing_put)
+    return broken
+
+
+def make_due(db_session, job_id):
+    db_session.expire_all()
+    job = db_session.get(UploadJob, job_id)
+    job.next_attempt_at = utcnow()
+    db_session.commit()
+
+
+# Test failed files are retried with backoff while uploaded ones are kept
+def test_upload_job_retries_failed_files(
+    test_client_with_auth, test_project, db_session, spool_dir, failing_put_object
+):
+    files = [
+        ("files", ("good.pdf", b"1", "application/pdf")),
+        ("files", ("broken.pdf", b"2", "application/pdf")),
+        ("files", ("document.pdf", b"3", "application/pdf")),
+    ]
+    test_client_with_auth.post("/project/1/documents/", files=files)
+
+    assert run_next_upload_job(db_session)
+
+    job = test_client_with_auth.get("/uploads/1").json()
+    assert job["status"] == "queued"
+    assert job["attempts"] == 1
+    assert job["last_error"] is not None
+    assert [(item["stored_as"], item["status"]) for item in job["items"]] == [
+        ("good.pdf", "uploaded"),
+        ("broken.pdf", "pending"),
+        ("document(1).pdf", "uploaded"),
+    ]
+    # not due before its backoff has passed
+    assert not run_next_upload_job(db_session)
+
+    failing_put_object.clear()
+    make_due(db_session, 1)
+    assert run_next_upload_job(db_session)
+
+    job = test_client_with_auth.get("/uploads/1").json()
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 2
+    assert job["uploaded"] == 3
+    filenames = {
+        document.filename
+        for document in db_session.query(Document).filter_by(project_id=1)
+    }
+    assert filenames == {"document.pdf", "good.pdf", "broken.pdf", "document(1).pdf"}
+    assert list(spool_dir.iterdir()) == []
+
+
+# Test a job gives up after the last attempt
+def test_upload_job_fails_after_max_attempts(
+    test_client_with_auth,
+    test_project,
+    db_session,
+    spool_dir,
+    failing_put_object,
+    mocker,
+):
+    mocker.patch("app.crud.upload_jobs.UPLOAD_JOB_MAX_ATTEMPTS", 2)
+    files = [("files", ("broken.pdf", b"2", "application/pdf"))]
+    test_client_with_auth.post("/project/1/documents/", files=files)
+
+    assert run_next_upload_job(db_session)
+    make_due(db_session, 1)
+    assert run_next_upload_job(db_session)
+
+    job = test_client_with_auth.get("/uploads/1").json()
+    assert job["status"] == "failed"
+    assert job["items"][0]["status"] == "failed"
+    assert not run_next_upload_job(db_session)
+    assert list(spool_dir.iterdir()) == []
+
+
+# Test objects of files whose documents could not be saved are deleted and
+# their names released
+def test_upload_job_save_failure(
+    test_client_with_auth, test_project, db_session, memory_storage, mocker
+):
+    files = [("files", ("good.pdf", b"1", "application/pdf"))]
+    test_client_with_auth.post("/project/1/documents/", files=files)
+    flush = db_session.flush
+    outage = ["database is down"]
+
+    def failing_flush(*args, **kwargs):
+        if outage and any(isinstance(obj, Document) for obj in db_session.new):
+            raise SQLAlchemyError("database is down")
+        return flush(*args, **kwargs)
+
+    mocker.patch.object(db_session, "flush", side_effect=failing_flush)
+    assert run_next_upload_job(db_session)
+
+    job = test_client_with_auth.get("/uploads/1").json()
+    assert job["status"] == "queued"
+    assert job["last_error"] == "Failed to save document"
+    assert job["items"][0]["stored_as"] is None
+    with pytest.raises(ObjectNotFound):
+        memory_storage.head("1/good.pdf")
+    assert db_session.get(FilenameCounter, (1, "good.pdf")) is None
+
+    outage.clear()
+    make_due(db_session, 1)
+    assert run_next_upload_job(db_session)
+    job = test_client_with_auth.get("/uploads/1").json()
+    assert job["status"] == "succeeded"
+    assert job["items"][0]["stored_as"] == "good.pdf"
+
+
+# Test uploads are refused while no spool directory is configured
+def test_upload_requires_spool_dir(test_client_with_auth, test_project, mocker):
+    mocker.patch("app.crud.upload_jobs.UPLOAD_SPOOL_DIR", None)
+    files = [("files", ("good.pdf", b"1", "application/pdf"))]
+
+    response = test_client_with_auth.post("/project/1/documents/", files=files)
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+# Test a repeated Idempotency-Key returns the existing job
+def test_upload_job_idempotency_key(
+    test_client_with_auth, test_project, db_session, spool_dir
+):
+    files = [("files", ("testfile.pdf", b"1", "application/pdf"))]
+    headers = {"Idempotency-Key": "upload-1"}
+
+    first = test_client_with_auth.post(
+        "/project/1/documents/", files=files, headers=headers
+    )
+    second = test_client_with_auth.post(
+        "/project/1/documents/", files=files, headers=headers
+    )
+
+    assert first.status_code == second.status_code == status.HTTP_202_ACCEPTED
+    assert first.json()["job_id"] == second.json()["job_id"]
+    assert db_session.query(UploadJob).count() == 1
+    assert len(list(spool_dir.iterdir())) == 1
+
+
+# Test a job whose worker died is picked up again once its lease expired
+def test_upload_job_lease_expiry(
+    test_client_with_auth, test_project, db_session, spool_dir
+):
+    files = [("files", ("testfile.pdf", b"1", "application/pdf"))]
+    test_client_with_auth.post("/project/1/documents/", files=files)
+    job = db_session.get(UploadJob, 1)
+    job.status = "running"
+    job.locked_until = utcnow() + timedelta(minutes=5)
+    db_session.commit()
+
+    assert not run_next_upload_job(db_session)
+
+    job.locked_until = utcnow() - timedelta(seconds=1)
+    db_session.commit()
+    assert run_next_upload_job(db_session)
+    assert test_client_with_auth.get("/uploads/1").json()["status"] == "succeeded"
+
+
+# Test users only see their own upload jobs
+def test_upload_job_of_other_user(test_client_with_auth, test_project, db_session):
+    participant = db_session.query(User).filter_by(email="Participant User").one()
+    db_session.add(UploadJob(project_id=1, user_id=participant.id))
+    db_session.commit()
+
+    response = test_client_with_auth.get("/uploads/1")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+# Test identical uploads share one blob that is collected once unreferenced
+def test_content_addressed_uploads(
+    test_client_with_auth, test_project, db_session, spool_dir, s3_client, mocker
+):
+    bucket = os.getenv("AWS_S3_BUCKET_NAME")
+    s3_client.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+    mocker.patch("app.crud.documents.storage", S3Storage(bucket, s3_client))
+    mocker.patch("app.crud.blobs.DOCUMENT_STORAGE_MODE", "content")
+    mocker.patch("app.crud.blobs.BLOB_GC_GRACE_SECONDS", 0)
+    put_object = mocker.patch.object(
+        s3_client, "put_object", wraps=s3_client.put_object
+    )
+    digest = hashlib.sha256(b"same bytes").hexdigest()
+
+    files = [
+        ("files", ("a.pdf", b"same bytes", "application/pdf")),
+        ("files", ("b.pdf", b"same bytes", "application/pdf")),
+    ]
+    test_client_with_auth.post("/project/1/documents/", files=files)
+    assert run_next_upload_job(db_session)
+    files = [("files", ("c.pdf", b"same bytes", "application/pdf"))]
+    test_client_with_auth.post("/project/1/documents/", files=files)
+    assert run_next_upload_job(db_session)
+
+    assert put_object.call_count == 1
+    keys = [obj["Key"] for obj in s3_client.list_objects_v2(Bucket=bucket)["Contents"]]
+    assert keys == [f"blobs/{digest[:2]}/{digest}"]
+    db_session.expire_all()
+    assert db_session.get(Blob, digest).refcount == 3
+    documents = db_session.query(Document).filter_by(blob_digest=digest).all()
+    assert sorted(document.filename for document in documents) == [
+        "a.pdf",
+        "b.pdf",
+        "c.pdf",
+    ]
+
+    response = test_client_with_auth.get(f"/document/{documents[0].id}")
+    assert response.content == b"same bytes"
+    assert response.headers["Content-Disposition"] == (
+        f"attachment; filename={documents[0].filename}"
+    )
+
+    for document in documents[:2]:
+        response = test_client_with_auth.delete(f"/document/{document.id}")
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert collect_unreferenced_blobs(db_session) == 0
+    test_client_with_auth.delete(f"/document/{documents[2].id}")
+
+    assert collect_unreferenced_blobs(db_session) == 1
+    assert db_session.get(Blob, digest) is None
+    assert s3_client.list_objects_v2(Bucket=bucket)["KeyCount"] == 0
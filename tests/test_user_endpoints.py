@@ -1,4 +1,5 @@
 from conftest import *
+from app.auth.hashing import password_executor
 
 
 # Test creating a new user
@@ -118,3 +119,47 @@ def test_create_user_passwords_do_not_match(test_client_with_auth):
         error["msg"] == "Value error, Passwords don't match"
         for error in response.json()["detail"]
     )
+
+
+# Test repeated requests with the same token are served from the principal cache
+def test_current_user_cached(test_client_with_auth, test_project):
+    test_client_with_auth.get("/project/1/info")
+    test_client_with_auth.get("/project/1/info")
+
+    stats = test_client_with_auth.get(
+        "/internal/metrics/auth-cache", headers=INTERNAL_HEADERS
+    ).json()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["size"] == 1
+    assert set(principal_cache._entries.popitem()[1][1]) == {"id", "email"}
+
+
+# Test updating a user drops its cached principal
+def test_current_user_cache_invalidated_on_update(
+    test_client_with_auth, db_session, create_user
+):
+    test_client_with_auth.get("/projects")
+    assert principal_cache.stats()["size"] == 1
+
+    user = db_session.query(User).filter_by(email=create_user.email).one()
+    user.hashed_password = "changedpassword"
+    db_session.commit()
+
+    assert principal_cache.stats()["size"] == 0
+
+
+# Test password hashing sheds load once the executor backlog is full
+def test_create_user_password_executor_overloaded(test_client_with_auth, monkeypatch):
+    monkeypatch.setattr(password_executor, "workers", 0)
+    monkeypatch.setattr(password_executor, "max_queue", 0)
+    response = test_client_with_auth.post(
+        "/auth",
+        json={
+            "email": "busyuser@example.com",
+            "password": "Testpassword!",
+            "repeat_password": "Testpassword!",
+        },
+    )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"